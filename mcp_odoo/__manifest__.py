@@ -7,10 +7,12 @@
     'website': 'https://chef-pixel.fr',
     'support': "hello@chef-pixel.fr",
     'category': 'Tools',
-    'depends': ['base'],
+    'depends': ['base', 'bus'],
     'license': 'LGPL-3',
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
+        'data/chatbot_model_price.xml',
         'views/chatbot_v18.xml',
         # 'views/chatbot_messages.xml',
         # 'wizard/chatbot_wizard_view.xml',
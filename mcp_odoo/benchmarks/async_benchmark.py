@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent upstream calls of one worker: blocking client versus asyncio client.
+
+Sends --requests calls to the local stand-in servers, all issued at once,
+the way a worker fans out tool calls or polls batch jobs:
+
+- ``sync``: a pool of --threads threads, each call blocking its thread on a
+  keep-alive requests session (the blocking HTTP client);
+- ``async``: every call in flight on the event loop of models/async_http.py
+  (the asyncio HTTP client), bounded by --max-connections.
+
+    python async_benchmark.py --requests 200 --threads 8 --latency 0.2 --target tools
+
+No Odoo install is needed. httpx must be installed for the asyncio client
+to save threads; without it the async runner falls back to a thread pool.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fake_servers import add_server_arguments, start_fake_servers
+from run_benchmark import percentile, rss_kb
+
+ASYNC_HTTP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'async_http.py')
+
+
+def load_async_http():
+    """Import models/async_http.py without importing the Odoo addon."""
+    spec = importlib.util.spec_from_file_location('chatbot_async_http', ASYNC_HTTP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_call(target, anthropic_url, mcp_url):
+    """(url, payload) of one benchmarked call."""
+    if target == 'messages':
+        return f'{anthropic_url}/v1/messages', {
+            'model': 'claude-3-5-haiku-20241022', 'max_tokens': 256,
+            'messages': [{'role': 'user', 'content': 'Show me the latest partners'}],
+        }
+    return f'{mcp_url}/search', {'model': 'res.partner', 'domain': [], 'fields': ['name'], 'limit': 5}
+
+
+class ThreadSampler:
+    """Peak number of live client threads during a run (the fake servers' threads are not counted)."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = self.count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    @staticmethod
+    def count():
+        return sum(1 for thread in threading.enumerate() if 'process_request_thread' not in thread.name)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.count())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_sync(args, url, payload):
+    """Every call submitted at once to a pool of --threads blocking threads."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=args.threads)
+    session.mount('http://', adapter)
+
+    def call(start):
+        response = session.post(url, json=payload, timeout=args.timeout)
+        response.raise_for_status()
+        response.json()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix='bench_sync') as executor:
+        call(time.perf_counter())
+        wall_start = time.perf_counter()
+        # Latencies include the wait for a free thread, as for the asyncio client
+        futures = [executor.submit(call, wall_start) for _i in range(args.requests)]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        wall = time.perf_counter() - wall_start
+    return results, wall
+
+
+def run_async(args, url, payload, async_http):
+    """Every call in flight together on the event loop of the async runner."""
+    runner = async_http.AsyncRunner(args.max_connections)
+
+    async def call():
+        start = runner.loop.time()
+        response = await runner.request('POST', url, json=payload, timeout=args.timeout)
+        response.raise_for_status()
+        response.json()
+        return runner.loop.time() - start
+
+    runner.run(call())
+    wall_start = time.perf_counter()
+    results = runner.gather([call() for _i in range(args.requests)], args.timeout)
+    wall = time.perf_counter() - wall_start
+    return results, wall, runner.get_stats()
+
+
+def summarize(client, results, wall, threads, memory_before, extra=None):
+    latencies = sorted(result for result in results if not isinstance(result, BaseException))
+    errors = [str(result) or type(result).__name__ for result in results if isinstance(result, BaseException)]
+    summary = {
+        'client': client,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'req_per_s': round(len(latencies) / wall, 2) if wall else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95': round(percentile(latencies, 0.95) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        'peak_threads': threads,
+        'rss_kb': {'before': memory_before, 'after': rss_kb(os.getpid())},
+        'sample_errors': sorted(set(errors))[:3],
+    }
+    summary.update(extra or {})
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['client']}")
+    print(f"  requests: {summary['requests']}  errors: {summary['errors']}  req/s: {summary['req_per_s']}")
+    print("  latency ms: " + '  '.join(f"{key} {value}" for key, value in summary['latency_ms'].items()))
+    print(f"  peak threads: {summary['peak_threads']}  rss kB: {summary['rss_kb']}")
+    if 'runner' in summary:
+        print(f"  runner: {summary['runner']}")
+    for error in summary['sample_errors']:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['tools', 'messages'], default='tools',
+                        help='tools: MCP /search calls, messages: Anthropic /v1/messages calls')
+    parser.add_argument('--client', choices=['both', 'sync', 'async'], default='both')
+    parser.add_argument('--requests', type=int, default=200, help='Calls issued at once')
+    parser.add_argument('--threads', type=int, default=8, help='Threads of the blocking client')
+    parser.add_argument('--max-connections', type=int, default=32, help='Connections of the asyncio client')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--json', action='store_true', help='Print each summary as one JSON line')
+    add_server_arguments(parser)
+    parser.set_defaults(anthropic_port=0, mcp_port=0)
+    args = parser.parse_args()
+
+    anthropic, mcp = start_fake_servers(
+        args.anthropic_port, args.mcp_port, args.latency, args.mcp_latency, 'text', args.chunks, args.chunk_delay
+    )
+    url, payload = build_call(
+        args.target, f'http://127.0.0.1:{anthropic.server_port}', f'http://127.0.0.1:{mcp.server_port}'
+    )
+    async_http = load_async_http()
+
+    summaries = []
+    if args.client in ('both', 'sync'):
+        memory_before = rss_kb(os.getpid())
+        with ThreadSampler() as sampler:
+            results, wall = run_sync(args, url, payload)
+        summaries.append(summarize(f'sync ({args.threads} threads)', results, wall, sampler.peak, memory_before))
+    if args.client in ('both', 'async'):
+        memory_before = rss_kb(os.getpid())
+        with ThreadSampler() as sampler:
+            results, wall, stats = run_async(args, url, payload, async_http)
+        summaries.append(summarize(
+            f"async ({stats['backend']}, {args.max_connections} connections)",
+            results, wall, sampler.peak, memory_before, {'runner': stats}
+        ))
+
+    for summary in summaries:
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print_summary(summary)
+    if not args.json and len(summaries) == 2 and summaries[0]['req_per_s']:
+        print(f"async / sync throughput: {summaries[1]['req_per_s'] / summaries[0]['req_per_s']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-ins for the Anthropic Messages API and the MCP server.
+
+Standard library only, so the benchmark can run next to any Odoo install:
+
+    python fake_servers.py --anthropic-port 8765 --mcp-port 8766 --latency 0.2 --scenario tool_use
+
+Scenarios of the fake Anthropic server:
+
+- ``text``: every request is answered with a plain text message;
+- ``tool_use``: the first turn asks for a ``search_odoo_records`` tool call,
+  the turn carrying the tool result is answered with text.
+
+Requests with ``"stream": true`` are answered with server-sent events in the
+Messages API format, the text being split into ``--chunks`` deltas.
+
+The Message Batches API is also served (in memory): a batch ends ``--latency``
+seconds after its submission and every request succeeds.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = (
+    "Here is the information you asked for. The latest partner is Azure Interior, "
+    "based in Fremont, with 3 open opportunities and 2 confirmed sales orders."
+)
+
+
+class FakeServerSettings:
+    """Behaviour shared by the handlers of a fake server."""
+
+    def __init__(self, latency=0.0, scenario='text', chunks=20, chunk_delay=0.0, records=10):
+        self.latency = latency
+        self.scenario = scenario
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.records = records
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.batches = {}
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = FakeServerSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body or b'{}')
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeAnthropicHandler(_JsonHandler):
+    """POST /v1/messages, Message Batches API under /v1/messages/batches"""
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        if path.startswith('/v1/messages/batches'):
+            return self._post_batch(path)
+        if path != '/v1/messages':
+            return self._send_json({'error': {'type': 'not_found_error'}}, status=404)
+        payload = self._read_json()
+        self.settings.count(self.path)
+        time.sleep(self.settings.latency)
+
+        messages = payload.get('messages') or []
+        last = messages[-1] if messages else {}
+        has_tool_result = isinstance(last.get('content'), list) and any(
+            block.get('type') == 'tool_result' for block in last['content']
+        )
+        if self.settings.scenario == 'tool_use' and payload.get('tools') and not has_tool_result:
+            content = [{
+                'type': 'tool_use',
+                'id': f'toolu_{uuid.uuid4().hex[:20]}',
+                'name': 'search_odoo_records',
+                'input': {'model': 'res.partner', 'domain': [], 'fields': ['name'], 'limit': 5},
+            }]
+            stop_reason = 'tool_use'
+        else:
+            content = [{'type': 'text', 'text': ANSWER}]
+            stop_reason = 'end_turn'
+        usage = {'input_tokens': 900 + 40 * len(messages), 'output_tokens': 60}
+
+        if payload.get('stream'):
+            return self._send_stream(payload, content, stop_reason, usage)
+        return self._send_json({
+            'id': f'msg_{uuid.uuid4().hex[:24]}',
+            'type': 'message',
+            'role': 'assistant',
+            'model': payload.get('model'),
+            'content': content,
+            'stop_reason': stop_reason,
+            'usage': usage,
+        })
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        self.settings.count(path)
+        parts = path.split('/')
+        batch = self.settings.batches.get(parts[4]) if len(parts) > 4 and path.startswith('/v1/messages/batches/') else None
+        if batch is None:
+            return self._send_json({'error': {'type': 'not_found_error'}}, status=404)
+        if len(parts) == 6 and parts[5] == 'results':
+            lines = [json.dumps({
+                'custom_id': request['custom_id'],
+                'result': {'type': 'canceled'} if batch['canceled'] else {'type': 'succeeded', 'message': {
+                    'id': f'msg_{uuid.uuid4().hex[:24]}', 'type': 'message', 'role': 'assistant',
+                    'model': request.get('params', {}).get('model'),
+                    'content': [{'type': 'text', 'text': ANSWER}], 'stop_reason': 'end_turn',
+                    'usage': {'input_tokens': 300, 'output_tokens': 60},
+                }},
+            }) for request in batch['requests']]
+            body = ('\n'.join(lines) + '\n').encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/binary')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        return self._send_json(self._batch_object(batch))
+
+    def _post_batch(self, path):
+        payload = self._read_json()
+        self.settings.count('/v1/messages/batches')
+        parts = path.split('/')
+        if len(parts) == 6 and parts[5] == 'cancel':
+            batch = self.settings.batches.get(parts[4])
+            if batch is None:
+                return self._send_json({'error': {'type': 'not_found_error'}}, status=404)
+            batch['canceled'] = True
+            return self._send_json(self._batch_object(batch))
+        batch = {
+            'id': f'msgbatch_{uuid.uuid4().hex[:24]}',
+            'requests': payload.get('requests') or [],
+            'created': time.monotonic(),
+            'canceled': False,
+        }
+        with self.settings.lock:
+            self.settings.batches[batch['id']] = batch
+        return self._send_json(self._batch_object(batch))
+
+    def _batch_object(self, batch):
+        ended = batch['canceled'] or time.monotonic() - batch['created'] >= self.settings.latency
+        total = len(batch['requests'])
+        counts = {'processing': 0 if ended else total, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        if ended:
+            counts['canceled' if batch['canceled'] else 'succeeded'] = total
+        return {
+            'id': batch['id'],
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': counts,
+            'results_url': (
+                f"http://{self.headers.get('Host')}/v1/messages/batches/{batch['id']}/results" if ended else None
+            ),
+        }
+
+    def _send_stream(self, payload, content, stop_reason, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        event('message_start', {'type': 'message_start', 'message': {
+            'id': f'msg_{uuid.uuid4().hex[:24]}', 'type': 'message', 'role': 'assistant',
+            'model': payload.get('model'), 'content': [], 'stop_reason': None,
+            'usage': {'input_tokens': usage['input_tokens'], 'output_tokens': 1},
+        }})
+        for index, block in enumerate(content):
+            if block['type'] == 'text':
+                event('content_block_start', {
+                    'type': 'content_block_start', 'index': index, 'content_block': {'type': 'text', 'text': ''}
+                })
+                text = block['text']
+                size = max(len(text) // max(self.settings.chunks, 1), 1)
+                for start in range(0, len(text), size):
+                    event('content_block_delta', {
+                        'type': 'content_block_delta', 'index': index,
+                        'delta': {'type': 'text_delta', 'text': text[start:start + size]},
+                    })
+                    time.sleep(self.settings.chunk_delay)
+            else:
+                event('content_block_start', {
+                    'type': 'content_block_start', 'index': index,
+                    'content_block': dict(block, input={}),
+                })
+                event('content_block_delta', {
+                    'type': 'content_block_delta', 'index': index,
+                    'delta': {'type': 'input_json_delta', 'partial_json': json.dumps(block['input'])},
+                })
+            event('content_block_stop', {'type': 'content_block_stop', 'index': index})
+        event('message_delta', {
+            'type': 'message_delta', 'delta': {'stop_reason': stop_reason},
+            'usage': {'output_tokens': usage['output_tokens']},
+        })
+        event('message_stop', {'type': 'message_stop'})
+
+
+class FakeMCPHandler(_JsonHandler):
+    """POST /search, /read, /messages, /connect, /disconnect"""
+
+    def do_POST(self):
+        payload = self._read_json()
+        path = self.path.rstrip('/')
+        self.settings.count(path)
+        time.sleep(self.settings.latency)
+        if path == '/search':
+            limit = min(int(payload.get('limit') or 10), self.settings.records)
+            return self._send_json({'success': True, 'model': payload.get('model'), 'records': [
+                {'id': record_id, 'name': f'Record {record_id}'} for record_id in range(1, limit + 1)
+            ]})
+        if path == '/read':
+            return self._send_json({'success': True, 'model': payload.get('model'), 'records': [
+                {'id': record_id, 'name': f'Record {record_id}'} for record_id in payload.get('ids') or []
+            ]})
+        if path == '/messages':
+            return self._send_json({'message': ANSWER, 'usage': {'input_tokens': 500, 'output_tokens': 60}})
+        if path in ('/connect', '/disconnect'):
+            return self._send_json({'success': True, 'message': 'ok'})
+        return self._send_json({'error': f'Unknown endpoint {path}'}, status=404)
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    # Accept bursts of concurrent connections (the default backlog is 5)
+    request_queue_size = 1024
+
+
+def start_server(handler_class, port, settings, host='127.0.0.1'):
+    """Start a fake server in a daemon thread and return it (port 0 picks a free port)."""
+    handler = type(handler_class.__name__, (handler_class,), {'settings': settings})
+    server = _FakeHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler_class.__name__, daemon=True).start()
+    return server
+
+
+def start_fake_servers(anthropic_port=0, mcp_port=0, latency=0.0, mcp_latency=None,
+                       scenario='text', chunks=20, chunk_delay=0.0):
+    """
+    Start both fake servers.
+
+    Returns:
+        Tuple (anthropic server, MCP server); their base URL is
+        f"http://127.0.0.1:{server.server_port}"
+    """
+    anthropic = start_server(FakeAnthropicHandler, anthropic_port, FakeServerSettings(
+        latency=latency, scenario=scenario, chunks=chunks, chunk_delay=chunk_delay
+    ))
+    mcp = start_server(FakeMCPHandler, mcp_port, FakeServerSettings(
+        latency=latency if mcp_latency is None else mcp_latency
+    ))
+    return anthropic, mcp
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--anthropic-port', type=int, default=8765)
+    parser.add_argument('--mcp-port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before each Anthropic answer')
+    parser.add_argument('--mcp-latency', type=float, default=None, help='Seconds before each MCP answer')
+    parser.add_argument('--scenario', choices=['text', 'tool_use'], default='text')
+    parser.add_argument('--chunks', type=int, default=20, help='Text deltas per streamed answer')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='Seconds between streamed deltas')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    anthropic, mcp = start_fake_servers(
+        args.anthropic_port, args.mcp_port, args.latency, args.mcp_latency,
+        args.scenario, args.chunks, args.chunk_delay
+    )
+    print(f"Fake Anthropic API: http://127.0.0.1:{anthropic.server_port}")
+    print(f"Fake MCP server:    http://127.0.0.1:{mcp.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
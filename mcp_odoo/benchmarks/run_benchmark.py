@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Chatbot throughput benchmark against local Anthropic and MCP stand-in servers.
+
+The active chatbot.config of the target database is pointed at the fake
+servers for the duration of the run (and restored afterwards): use a
+dedicated database, never a production one.
+
+HTTP mode drives a running Odoo server through its routes:
+
+    python run_benchmark.py http --url http://localhost:8069 -d bench --login admin --password admin \\
+        --target send_message --concurrency 8 --requests 200
+
+In-process mode loads the registry and calls the model entry points
+directly, which also measures the SQL queries per request:
+
+    python run_benchmark.py inprocess --odoo-path ~/odoo -c ~/odoo.conf -d bench \\
+        --target process_message_api --concurrency 8 --requests 200
+
+Targets: send_message, send_message_fast, stream_message (HTTP only),
+process_message_api, send_message_to_mcp.
+
+--http-client async runs the configuration on the asyncio HTTP client;
+async_benchmark.py compares both clients without Odoo.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from fake_servers import add_server_arguments, start_fake_servers
+
+HTTP_TARGETS = ['send_message', 'send_message_fast', 'stream_message', 'process_message_api', 'send_message_to_mcp']
+INPROCESS_TARGETS = ['process_message_api', 'send_message_to_mcp']
+
+# Settings forced on the active configuration so every request reaches the fake servers
+BENCHMARK_CONFIG = {
+    'api_key': 'sk-ant-benchmark',
+    'mcp_connected': True,
+    'tool_backend': 'mcp',
+    'processing_mode': 'sync',
+    'response_cache_enabled': False,
+    'tool_cache_enabled': False,
+    'rate_limit_enabled': False,
+    'daily_message_limit': 0,
+    'daily_user_message_limit': 0,
+    'http_client': 'sync',
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def rss_kb(pid):
+    """Resident memory of a process and its children (Odoo workers), in kB, Linux only."""
+    total = 0
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    for process_id in pids:
+        try:
+            with open(f'/proc/{process_id}/status') as status:
+                match = re.search(r'VmRSS:\s+(\d+)', status.read())
+                total += int(match.group(1)) if match else 0
+        except OSError:
+            pass
+    return total
+
+
+def run_load(call, concurrency, total_requests, warmup):
+    """
+    Call `call(worker_state)` total_requests times from `concurrency` threads.
+
+    Returns:
+        Dictionary of results: latencies (s, sorted), errors, wall time, extra metrics
+    """
+    for _i in range(warmup):
+        call({})
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+    queries = []
+    remaining = [total_requests]
+
+    def worker():
+        state = {}
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                query_count = call(state)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if query_count is not None:
+                    queries.append(query_count)
+
+    threads = [threading.Thread(target=worker) for _i in range(concurrency)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    latencies.sort()
+    return {'latencies': latencies, 'errors': errors, 'wall': wall, 'queries': queries}
+
+
+def report(args, result, extra=None):
+    latencies = result['latencies']
+    summary = {
+        'target': args.target,
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'http_client': args.http_client,
+        'requests': len(latencies),
+        'errors': len(result['errors']),
+        'req_per_s': round(len(latencies) / result['wall'], 2) if result['wall'] else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99': round(percentile(latencies, 0.99) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+    }
+    if result['queries']:
+        summary['queries_per_request'] = round(sum(result['queries']) / len(result['queries']), 1)
+    summary.update(extra or {})
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"{summary['target']} ({summary['mode']}, {summary['http_client']} client, concurrency {summary['concurrency']})")
+    print(f"  requests: {summary['requests']}  errors: {summary['errors']}  req/s: {summary['req_per_s']}")
+    print("  latency ms: " + '  '.join(f"{key} {value}" for key, value in summary['latency_ms'].items()))
+    for key in ('queries_per_request', 'memory_kb', 'peak_python_alloc_kb', 'server_rss_kb'):
+        if key in summary:
+            print(f"  {key}: {summary[key]}")
+    for error in sorted(set(result['errors']))[:5]:
+        print(f"  error: {error}")
+
+
+# ---------------------------------------------------------------- HTTP mode
+
+class OdooClient:
+    """JSON-RPC client keeping its own session cookie."""
+
+    def __init__(self, url, database, login, password):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.csrf_token = None
+        response = self.session.post(f'{self.url}/web/session/authenticate', json={
+            'jsonrpc': '2.0', 'method': 'call',
+            'params': {'db': database, 'login': login, 'password': password},
+        })
+        body = response.json()
+        if body.get('error') or not (body.get('result') or {}).get('uid'):
+            raise RuntimeError(f"Authentication failed: {body.get('error')}")
+
+    def json_call(self, route, params):
+        response = self.session.post(f'{self.url}{route}', json={
+            'jsonrpc': '2.0', 'method': 'call', 'id': uuid.uuid4().hex, 'params': params,
+        })
+        response.raise_for_status()
+        body = response.json()
+        if body.get('error'):
+            raise RuntimeError(body['error'].get('data', {}).get('message') or body['error'].get('message'))
+        return body.get('result')
+
+    def call_kw(self, model, method, args, kwargs=None):
+        return self.json_call(f'/web/dataset/call_kw/{model}/{method}', {
+            'model': model, 'method': method, 'args': args, 'kwargs': kwargs or {},
+        })
+
+    def stream(self, user_input, session_id):
+        if self.csrf_token is None:
+            page = self.session.get(f'{self.url}/web').text
+            match = re.search(r'csrf_token["\']?\s*:\s*["\']([0-9a-f]+o?[0-9]*)["\']', page)
+            self.csrf_token = match.group(1) if match else ''
+        response = self.session.post(f'{self.url}/api/chatbot/stream_message', data={
+            'user_input': user_input, 'session_id': session_id, 'csrf_token': self.csrf_token,
+        }, stream=True)
+        with response:
+            if response.status_code != 200:
+                raise RuntimeError(f'HTTP {response.status_code}: {response.text[:200]}')
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith('event: error'):
+                    raise RuntimeError('stream error event')
+
+
+def check_result(result):
+    if isinstance(result, dict) and (result.get('error') is True or result.get('success') is False):
+        raise RuntimeError(result.get('message') or result.get('error') or 'request failed')
+    return result
+
+
+def run_http(args, anthropic_url, mcp_url):
+    admin = OdooClient(args.url, args.database, args.login, args.password)
+    config = admin.call_kw('chatbot.config', 'get_active_config', [])
+    config_id = config[0] if isinstance(config, list) else config
+    fields = list(BENCHMARK_CONFIG) + ['anthropic_api_url', 'mcp_server_url']
+    original = admin.call_kw('chatbot.config', 'read', [[config_id], fields])[0]
+    original.pop('id', None)
+    admin.call_kw('chatbot.config', 'write', [[config_id], dict(
+        BENCHMARK_CONFIG, anthropic_api_url=anthropic_url, mcp_server_url=mcp_url
+    )])
+
+    def call(state):
+        client = state.get('client')
+        if client is None:
+            client = state['client'] = OdooClient(args.url, args.database, args.login, args.password)
+            state['session_id'] = uuid.uuid4().hex[:12]
+        if args.target in ('send_message', 'send_message_fast'):
+            check_result(client.json_call(f'/api/chatbot/{args.target}', {
+                'user_input': args.message, 'session_id': state['session_id'],
+            }))
+        elif args.target == 'stream_message':
+            client.stream(args.message, state['session_id'])
+        elif args.target == 'process_message_api':
+            check_result(client.call_kw('chatbot.wizard', 'process_message_api', [args.message], {
+                'session_id': state['session_id'],
+            }))
+        else:
+            check_result(client.call_kw('mcp.service', 'send_message_to_mcp', [
+                [{'role': 'user', 'content': args.message}]
+            ]))
+
+    memory_before = rss_kb(args.server_pid) if args.server_pid else None
+    try:
+        result = run_load(call, args.concurrency, args.requests, args.warmup)
+    finally:
+        if not args.keep_config:
+            admin.call_kw('chatbot.config', 'write', [[config_id], original])
+    extra = {}
+    if args.server_pid:
+        extra['server_rss_kb'] = {'before': memory_before, 'after': rss_kb(args.server_pid)}
+    return result, extra
+
+
+# ---------------------------------------------------------- in-process mode
+
+def run_inprocess(args, anthropic_url, mcp_url):
+    if args.odoo_path:
+        sys.path.insert(0, os.path.expanduser(args.odoo_path))
+    import odoo
+    from odoo import api, SUPERUSER_ID
+    from odoo.modules.registry import Registry
+
+    odoo.tools.config.parse_config(['-c', os.path.expanduser(args.odoo_config)] if args.odoo_config else [])
+    registry = Registry(args.database)
+
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        uid = env['res.users'].search([('login', '=', args.login)], limit=1).id or SUPERUSER_ID
+        config = env['chatbot.config'].get_active_config()
+        original = config.read(list(BENCHMARK_CONFIG) + ['anthropic_api_url', 'mcp_server_url'])[0]
+        original.pop('id', None)
+        config.write(dict(BENCHMARK_CONFIG, anthropic_api_url=anthropic_url, mcp_server_url=mcp_url))
+
+    def call(state):
+        session_id = state.setdefault('session_id', uuid.uuid4().hex[:12])
+        with registry.cursor() as cr:
+            env = api.Environment(cr, uid, {})
+            queries_before = cr.sql_log_count
+            if args.target == 'process_message_api':
+                check_result(env['chatbot.wizard'].process_message_api(args.message, session_id=session_id))
+            else:
+                env['mcp.service'].send_message_to_mcp([{'role': 'user', 'content': args.message}])
+            return cr.sql_log_count - queries_before
+
+    tracemalloc.start()
+    try:
+        result = run_load(call, args.concurrency, args.requests, args.warmup)
+    finally:
+        if not args.keep_config:
+            with registry.cursor() as cr:
+                api.Environment(cr, SUPERUSER_ID, {})['chatbot.config'].get_active_config().write(original)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        'memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_python_alloc_kb': round(peak / 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['http', 'inprocess'])
+    parser.add_argument('--target', default='process_message_api', choices=HTTP_TARGETS)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=2, help='Sequential requests not measured')
+    parser.add_argument('--message', default='Show me the latest partners')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--url', default='http://localhost:8069', help='Odoo URL (http mode)')
+    parser.add_argument('--server-pid', type=int, help='Odoo server PID, to report its memory (http mode, Linux)')
+    parser.add_argument('--odoo-path', help='Odoo source directory (in-process mode)')
+    parser.add_argument('-c', '--odoo-config', help='Odoo configuration file (in-process mode)')
+    parser.add_argument('--anthropic-url', help='Use this Anthropic stand-in instead of starting one')
+    parser.add_argument('--mcp-url', help='Use this MCP stand-in instead of starting one')
+    parser.add_argument('--keep-config', action='store_true', help='Do not restore the chatbot configuration')
+    parser.add_argument('--http-client', choices=['sync', 'async'], default='sync',
+                        help='HTTP client of the chatbot configuration during the run')
+    parser.add_argument('--json', action='store_true', help='Print the summary as one JSON line')
+    add_server_arguments(parser)
+    parser.set_defaults(anthropic_port=0, mcp_port=0)
+    args = parser.parse_args()
+
+    BENCHMARK_CONFIG['http_client'] = args.http_client
+    if args.mode == 'inprocess' and args.target not in INPROCESS_TARGETS:
+        parser.error(f"In-process mode supports {', '.join(INPROCESS_TARGETS)}")
+    if not (args.anthropic_url and args.mcp_url):
+        anthropic, mcp = start_fake_servers(
+            args.anthropic_port, args.mcp_port, args.latency, args.mcp_latency,
+            args.scenario, args.chunks, args.chunk_delay
+        )
+        args.anthropic_url = args.anthropic_url or f'http://127.0.0.1:{anthropic.server_port}'
+        args.mcp_url = args.mcp_url or f'http://127.0.0.1:{mcp.server_port}'
+
+    runner = run_http if args.mode == 'http' else run_inprocess
+    result, extra = runner(args, args.anthropic_url, args.mcp_url)
+    report(args, result, extra)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,22 @@
-from odoo import http
-from odoo.http import request
+from odoo import api, http
+from odoo.http import request, Response
+from odoo.modules.registry import Registry
+from odoo.addons.mcp_odoo.models.chatbot_rate_limit import RateLimitError
+from odoo.addons.mcp_odoo.models.chatbot_trace import span
+import json
 import logging
+import math
+import time
+import uuid
 
 _logger = logging.getLogger(__name__)
 
+# Délai conseillé (secondes) avant de réinterroger /api/chatbot/poll
+POLL_RETRY_AFTER = 2
+
 class ChatbotController(http.Controller):
     
-    def _process_message(self, user_input, fast_mode=False):
+    def _process_message(self, user_input, fast_mode=False, session_id=None, bypass_cache=False):
         """Méthode interne pour traiter les messages"""
         if not user_input or not user_input.strip():
             return {
@@ -15,28 +25,44 @@ class ChatbotController(http.Controller):
             }
             
         try:
+            # Récupérer la configuration active
+            config = request.env['chatbot.config'].get_active_config()
+            config.check_daily_limit()
+            wait = config.check_rate_limit()
+
             # Créer l'enregistrement du message utilisateur
             message = request.env['chatbot.message'].create({
-                'user_input': user_input.strip(),
-                'timestamp': request.env['chatbot.message']._fields['timestamp'].default()
+                'user_message': user_input.strip(),
+                'session_id': session_id or str(uuid.uuid4())[:12],
+                'config_id': config.id,
+                'status': 'sent'
             })
             
-            # Récupérer la configuration active
-            config = request.env['chatbot.config'].search([('active', '=', True)], limit=1)
-            
-            if not config:
-                bot_response = "KO Aucune configuration active trouvée"
-                _logger.warning("Aucune configuration chatbot active trouvée")
-            elif not config.api_key:
+            if not config.sudo().api_key:
                 bot_response = "KO Clé API Anthropic non configurée"
                 _logger.warning("Clé API Anthropic manquante dans la configuration")
+                message.write({'bot_response': bot_response, 'status': 'error', 'error_message': bot_response})
+                api_result = {}
+            elif config.processing_mode == 'queued' or wait:
+                # Le worker HTTP est libéré : la réponse sera récupérée via /api/chatbot/poll
+                message._enqueue(delay=wait)
+                return {
+                    'success': True,
+                    'queued': True,
+                    'message_id': message.id,
+                    'session_id': message.session_id,
+                    'status': message.status
+                }
             else:
-                # Utiliser le service Anthropic commun avec le mode rapide
-                anthropic_service = request.env['anthropic.service']
-                bot_response = anthropic_service.call_anthropic_api(user_input.strip(), config, fast_mode=fast_mode)
-            
-            # Mettre à jour le message avec la réponse du bot
-            message.write({'bot_response': bot_response})
+                # Utiliser le service Anthropic commun (cache de réponses inclus)
+                api_result = message._generate_response(bypass_cache=bypass_cache)
+                if not api_result.get('success'):
+                    return {
+                        'success': False,
+                        'message_id': message.id,
+                        'error': message.error_message
+                    }
+                bot_response = message.bot_response
             
             mode_label = "RAPIDE" if fast_mode else "normal"
             _logger.info(f"Message chatbot {mode_label} traité avec succès (ID: {message.id})")
@@ -44,9 +70,12 @@ class ChatbotController(http.Controller):
             result = {
                 'success': True,
                 'message_id': message.id,
+                'session_id': message.session_id,
                 'user_input': user_input.strip(),
                 'bot_response': bot_response,
-                'timestamp': message.timestamp.isoformat()
+                'cached': api_result.get('cached', False),
+                'coalesced': api_result.get('coalesced', False),
+                'timestamp': message.create_date.isoformat()
             }
             
             if fast_mode:
@@ -54,6 +83,13 @@ class ChatbotController(http.Controller):
                 
             return result
             
+        except RateLimitError as e:
+            return {
+                'success': False,
+                'status': 429,
+                'retry_after': e.retry_after,
+                'error': str(e)
+            }
         except Exception as e:
             _logger.error(f"Erreur lors du traitement du message chatbot: {str(e)}")
             return {
@@ -62,38 +98,39 @@ class ChatbotController(http.Controller):
             }
     
     @http.route('/api/chatbot/send_message', type='json', auth='user', methods=['POST'])
-    def send_message(self, user_input, fast_mode=False):
+    def send_message(self, user_input, fast_mode=False, session_id=None, bypass_cache=False):
         """API pour envoyer un message au chatbot et recevoir la réponse"""
-        return self._process_message(user_input, fast_mode)
+        return self._process_message(user_input, fast_mode, session_id=session_id, bypass_cache=bypass_cache)
 
-    @http.route('/api/chatbot/get_messages', type='json', auth='user', methods=['GET'])
-    def get_messages(self, limit=10):
-        """Récupérer les derniers messages"""
+    @http.route('/api/chatbot/get_messages', type='json', auth='user', methods=['GET', 'POST'])
+    def get_messages(self, limit=10, session_id=None, before=None, after=None):
+        """Récupérer l'historique par pages (pagination par curseur)
+
+        `before` : curseur d'une page précédente, pour les messages plus anciens ;
+        `after` : dernier curseur connu ('latest'), pour ne récupérer que les nouveaux messages.
+        """
         try:
-            # Validation des paramètres
-            limit = min(max(int(limit), 1), 100)  # Entre 1 et 100
-            
-            messages = request.env['MCP_Odoo.message'].search(
-                [], 
-                order='timestamp desc', 
-                limit=limit
+            page = request.env['chatbot.message'].get_history_page(
+                session_id=session_id, before=before, after=after, limit=limit
             )
-            
-            result = []
-            for msg in messages:
-                result.append({
-                    'id': msg.id,
-                    'user_input': msg.user_input,
-                    'bot_response': msg.bot_response,
-                    'timestamp': msg.timestamp.isoformat() if msg.timestamp else None
-                })
-            
-            _logger.info(f"Récupération de {len(result)} messages chatbot")
+            result = [{
+                'id': msg['id'],
+                'session_id': msg['session_id'],
+                'user_input': msg['user_message'],
+                'bot_response': msg['bot_response'],
+                'status': msg['status'],
+                'response_time': msg['response_time'],
+                'timestamp': msg['create_date'],
+                'cursor': msg['cursor'],
+            } for msg in page['messages']]
             
             return {
                 'success': True,
                 'messages': result,
-                'total': len(result)
+                'total': len(result),
+                'has_more': page['has_more'],
+                'cursor': page['cursor'],
+                'latest': page['latest'],
             }
             
         except Exception as e:
@@ -103,7 +140,173 @@ class ChatbotController(http.Controller):
                 'error': str(e)
             }
 
+    @http.route('/api/chatbot/statistics', type='json', auth='user', methods=['GET', 'POST'])
+    def get_statistics(self, scope='user', days=None):
+        """Statistiques d'utilisation pré-agrégées
+
+        `scope` : 'user' pour l'utilisateur courant, 'all' (administrateurs) pour
+        le total de l'organisation et le détail par utilisateur.
+        """
+        if scope == 'all':
+            if not request.env.user.has_group('base.group_system'):
+                return {'success': False, 'error': 'Accès refusé'}
+            statistics = request.env['chatbot.usage.stat'].sudo().get_dashboard_statistics(days=days)
+        else:
+            statistics = request.env['chatbot.usage.stat'].sudo().get_statistics(user=request.env.user, days=days)
+        return {
+            'success': True,
+            'statistics': statistics
+        }
+
+    @http.route('/api/chatbot/poll', type='json', auth='user', methods=['POST'])
+    def poll_messages(self, message_ids, timeout=None):
+        """Statut des messages en file, renvoyé immédiatement
+
+        La route n'attend jamais : un worker HTTP et une connexion à la base
+        ne sont pas bloqués par client en attente. Les réponses sont poussées
+        sur le bus ; sans bus, le client réinterroge après `retry_after`
+        secondes. `timeout` est accepté pour compatibilité et ignoré.
+        """
+        messages = request.env['chatbot.message'].get_message_status(message_ids)
+        result = {
+            'success': True,
+            'messages': messages
+        }
+        if any(msg['status'] == 'sent' for msg in messages):
+            result['retry_after'] = POLL_RETRY_AFTER
+        return result
+
     @http.route('/api/chatbot/send_message_fast', type='json', auth='user', methods=['POST'])
-    def send_message_fast(self, user_input):
+    def send_message_fast(self, user_input, session_id=None, bypass_cache=False):
         """API RAPIDE pour envoyer un message au chatbot - sans post-traitement"""
-        return self._process_message(user_input, fast_mode=True)
\ No newline at end of file
+        return self._process_message(user_input, fast_mode=True, session_id=session_id, bypass_cache=bypass_cache)
+
+    @http.route('/api/chatbot/stream_message', type='http', auth='user', methods=['POST'])
+    def stream_message(self, user_input=None, session_id=None, **kwargs):
+        """API streaming (SSE) : renvoie la réponse du chatbot au fil de la génération"""
+        if not user_input or not user_input.strip():
+            return request.make_json_response(
+                {'success': False, 'error': 'Message vide non autorisé'}, status=400
+            )
+
+        try:
+            config = request.env['chatbot.config'].get_active_config()
+            config.check_daily_limit()
+            wait = config.check_rate_limit()
+            message = request.env['chatbot.message'].create({
+                'user_message': user_input.strip(),
+                'session_id': session_id or str(uuid.uuid4())[:12],
+                'config_id': config.id,
+                'status': 'sent'
+            })
+        except RateLimitError as e:
+            return request.make_json_response(
+                {'success': False, 'error': str(e), 'retry_after': e.retry_after},
+                status=429,
+                headers=[('Retry-After', str(math.ceil(e.retry_after)))]
+            )
+        except Exception as e:
+            _logger.error(f"Erreur lors de la préparation du streaming chatbot: {str(e)}")
+            return request.make_json_response({'success': False, 'error': str(e)}, status=400)
+
+        if config.processing_mode == 'queued' or wait:
+            # Mode file d'attente (ou limite de débit atteinte) : pas de streaming,
+            # le client interroge /api/chatbot/poll
+            message._enqueue(delay=wait)
+            return request.make_json_response(
+                {'success': True, 'queued': True, 'message_id': message.id}, status=202
+            )
+
+        # Le corps de la réponse est consommé après la fermeture du curseur de
+        # la requête : le générateur travaille donc avec son propre curseur.
+        events = self._stream_events(
+            request.env.cr.dbname, request.env.uid, dict(request.env.context), message.id
+        )
+        return Response(
+            events,
+            mimetype='text/event-stream',
+            headers=[('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')],
+            direct_passthrough=True
+        )
+
+    def _stream_events(self, dbname, uid, context, message_id):
+        """Générateur SSE : relaie les événements Anthropic puis enregistre la réponse"""
+        start_time = time.time()
+        with Registry(dbname).cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            message = env['chatbot.message'].browse(message_id)
+            config = message.config_id
+            try:
+                yield self._format_sse('start', {'message_id': message_id})
+                with env['chatbot.trace']._trace(message, name='chatbot.stream'):
+                    try:
+                        with span('history'):
+                            history, summary = env['chatbot.session'].sudo()._get_context(
+                                message.session_id, config, message.id
+                            )
+                        events = env['anthropic.service'].stream_chat_completion(
+                            messages=history + [{
+                                'role': 'user',
+                                'content': message.user_message
+                            }],
+                            model=config.model_name,
+                            temperature=config.temperature,
+                            max_tokens=config.max_tokens,
+                            conversation_summary=summary
+                        )
+                        for event in events:
+                            if event['type'] == 'text':
+                                yield self._format_sse('delta', {'text': event['text']})
+                            elif event['type'] == 'tool':
+                                yield self._format_sse('tool', {'name': event['name']})
+                            elif event['type'] == 'done':
+                                response_time = time.time() - start_time
+                                with span('db.write'):
+                                    message.write({
+                                        'bot_response': event['message'],
+                                        'status': 'processed',
+                                        'response_time': response_time,
+                                        'usage_data': json.dumps(event.get('usage', {})),
+                                        # Modèle ayant répondu (modèle de repli après un basculement)
+                                        **env['chatbot.model.price']._get_usage_values(
+                                            event.get('model') or config.model_name,
+                                            event.get('usage'), event.get('cost')
+                                        )
+                                    })
+                                    env['chatbot.rate.bucket'].sudo()._consume_tokens(config, event.get('usage', {}))
+                                    cr.commit()
+                                yield self._format_sse('done', {
+                                    'message_id': message_id,
+                                    'response_time': response_time,
+                                    'usage': event.get('usage', {})
+                                })
+                    except Exception as e:
+                        error_msg = str(e)
+                        _logger.error(f"Erreur lors du streaming chatbot: {error_msg}")
+                        cr.rollback()
+                        message.write({
+                            'bot_response': error_msg,
+                            'status': 'error',
+                            'error_message': error_msg,
+                            'response_time': time.time() - start_time
+                        })
+                        cr.commit()
+                        yield self._format_sse('error', {'message': error_msg})
+            except GeneratorExit:
+                # Client déconnecté : le message ne doit pas rester « envoyé »
+                cr.rollback()
+                if message.status == 'sent':
+                    _logger.info(f"Streaming chatbot interrompu par le client (message {message_id})")
+                    message.write({
+                        'bot_response': 'Client disconnected',
+                        'status': 'error',
+                        'error_message': 'Client disconnected before the end of the answer',
+                        'response_time': time.time() - start_time
+                    })
+                    cr.commit()
+                raise
+
+    @staticmethod
+    def _format_sse(event, data):
+        """Formate un événement server-sent events"""
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
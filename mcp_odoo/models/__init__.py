@@ -1,7 +1,21 @@
 # -*- coding: utf-8 -*-
 from . import base_service
+from . import chatbot_cache_validity
 from . import chatbot_config
 from . import chatbot_message
 from . import chatbot_wizard 
 from . import anthropic_service
-from . import mcp_service
\ No newline at end of file
+from . import mcp_service
+from . import chatbot_response_cache
+from . import chatbot_tool_cache
+from . import chatbot_session
+from . import chatbot_usage_counter
+from . import chatbot_rate_limit
+from . import chatbot_retention
+from . import chatbot_log_blob
+from . import chatbot_trace
+from . import chatbot_circuit_breaker
+from . import chatbot_single_flight
+from . import chatbot_batch
+from . import chatbot_usage_stat
+from . import chatbot_model_price
\ No newline at end of file
@@ -1,14 +1,86 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import json
 import logging
+import time
 import requests
-from datetime import timedelta
-from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Iterator, List, Optional, Union
 from odoo import models, fields, api
 from odoo.exceptions import UserError
-from .base_service import BaseService
+from .base_service import BaseService, pooled_request
+from .chatbot_circuit_breaker import upstream_key
+from .chatbot_session import estimate_tokens
+from .chatbot_trace import current_trace, span
 
 _logger = logging.getLogger(__name__)
 
+# Models whose cacheable prefix was found too short, logged once per worker
+_SHORT_PREFIX_MODELS = set()
+
+ANTHROPIC_API_URL = 'https://api.anthropic.com'
+DEFAULT_MAX_AGENT_TURNS = 5
+# Between the texts of successive agent turns, in the answer and in the stream
+TURN_SEPARATOR = '\n\n'
+MAX_ORM_TOOL_LIMIT = 100
+# Smallest prompt prefix Anthropic caches, in tokens: a breakpoint ending a
+# shorter prefix is ignored (no cache write, no cache read)
+MIN_CACHEABLE_TOKENS = 1024
+MIN_CACHEABLE_TOKENS_HAIKU = 2048
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the running summary of a conversation between an Odoo user and an AI assistant. "
+    "Keep the facts, record names and identifiers, figures, decisions and open questions the "
+    "assistant may need later; drop greetings and repetitions. Answer with the summary only."
+)
+
+
+def _send_tool_request(url, payload, timeout, pool_size, max_retries, breaker=None):
+    """POST a prepared tool call to the MCP server. Safe to run in a worker thread."""
+    def send():
+        return pooled_request(
+            'POST',
+            url,
+            pool_size=pool_size,
+            max_retries=max_retries,
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+            timeout=timeout
+        )
+    
+    try:
+        response = breaker.call(send) if breaker else send()
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise UserError(f'MCP Error: {response.status_code} - {response.text}')
+            
+    except Exception as e:
+        raise UserError(f'Tool execution error: {str(e)}')
+
+
+async def _send_tool_request_async(runner, url, payload, timeout, breaker=None):
+    """Same as _send_tool_request, as a coroutine run on the worker event loop."""
+    def send():
+        return runner.request(
+            'POST',
+            url,
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+            timeout=timeout
+        )
+    
+    try:
+        response = await (breaker.acall(send) if breaker else send())
+        
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise UserError(f'MCP Error: {response.status_code} - {response.text}')
+            
+    except Exception as e:
+        raise UserError(f'Tool execution error: {str(e)}')
+
 
 class AnthropicService(BaseService, models.Model):
     """Service for managing Anthropic API interactions."""
@@ -20,8 +92,19 @@ class AnthropicService(BaseService, models.Model):
     # Fields
     request_data = fields.Text('Request Data')
     response_data = fields.Text('Response Data')
+    request_body = fields.Binary('Request Body', attachment=False, help='Compressed structured request log')
+    response_body = fields.Binary('Response Body', attachment=False, help='Compressed structured response log')
     error_message = fields.Text('Error Message')
     success = fields.Boolean('Success', default=False)
+    turn_count = fields.Integer('Turns')
+    duration = fields.Float('Duration (s)')
+    hop_timings = fields.Text('Hop Timings', help='JSON list of per-hop timings in milliseconds')
+    model_name = fields.Char('Model', index=True)
+    input_tokens = fields.Integer('Input Tokens')
+    output_tokens = fields.Integer('Output Tokens')
+    cache_write_tokens = fields.Integer('Cache Write Tokens')
+    cache_read_tokens = fields.Integer('Cache Read Tokens')
+    cost = fields.Float('Estimated Cost (USD)', digits=(16, 6))
     
     @api.model
     def create_chat_completion(
@@ -29,7 +112,8 @@ class AnthropicService(BaseService, models.Model):
         messages: List[Dict[str, str]],
         model: str = 'claude-3-5-sonnet-20241022',
         temperature: float = 0.7,
-        max_tokens: int = 4096
+        max_tokens: int = 4096,
+        conversation_summary: str = ''
     ) -> Dict[str, Any]:
         """
         Create a chat completion using Anthropic API.
@@ -39,11 +123,477 @@ class AnthropicService(BaseService, models.Model):
             model: Model to use
             temperature: Sampling temperature
             max_tokens: Maximum tokens to generate
+            conversation_summary: Summary of the earlier turns of the conversation
             
         Returns:
             API response dictionary
         """
-        config = self.env['chatbot.config'].sudo().search([], limit=1)
+        events = self._run_agent_loop(
+            messages, model, temperature, max_tokens, conversation_summary=conversation_summary
+        )
+        for event in events:
+            if event['type'] == 'done':
+                return {
+                    'success': True,
+                    'message': event['message'],
+                    'usage': event['usage'],
+                    'cost': event['cost'],
+                    'model': event['model'],
+                    'turns': event['turns'],
+                    'tool_models': event['tool_models']
+                }
+    
+    @api.model
+    def stream_chat_completion(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str = 'claude-3-5-sonnet-20241022',
+        temperature: float = 0.7,
+        max_tokens: int = 4096,
+        conversation_summary: str = ''
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a chat completion using the Anthropic server-sent events API.
+        
+        Text deltas are yielded as soon as they are received. When Claude asks
+        for tools, they are executed and the conversation continues in a new
+        streamed request, exactly like create_chat_completion.
+        
+        Args:
+            messages: List of message dictionaries
+            model: Model to use
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate
+            conversation_summary: Summary of the earlier turns of the conversation
+            
+        Yields:
+            Event dictionaries: {'type': 'text', 'text'}, {'type': 'tool', 'name'}
+            and finally {'type': 'done', 'message', 'usage', 'cost', 'model', 'turns', 'tool_models'},
+            model being the one that answered (the fallback model after a downgrade)
+        """
+        return self._run_agent_loop(
+            messages, model, temperature, max_tokens,
+            stream=True, conversation_summary=conversation_summary
+        )
+    
+    @api.model
+    def call_api(self, user_input, config, bypass_cache=False, session_id=None,
+                 before_message_id=None, **kwargs):
+        """
+        Answer a user question, served from the response cache when possible.
+        
+        When a session is given, its earlier turns are replayed as
+        conversation history (trimmed to the history token budget).
+        Identical deterministic questions asked while one is being answered
+        wait for its answer ('coalesced' set in the result).
+        
+        Args:
+            user_input: The user question
+            config: chatbot.config to use
+            bypass_cache: Skip the response cache lookup and store
+            session_id: chatbot.message session the question belongs to
+            before_message_id: Only replay the turns older than this message
+            
+        Returns:
+            API response dictionary, with 'cached' set when served from cache
+        """
+        with span('history'):
+            history, summary = self.env['chatbot.session'].sudo()._get_context(
+                session_id, config, before_message_id
+            )
+        cache = self.env['chatbot.response.cache'].sudo()
+        # Answers depending on earlier turns are not reusable for another conversation
+        use_cache = (
+            not history
+            and not summary
+            and config.response_cache_enabled
+            and not bypass_cache
+            and not self.env.context.get('chatbot_bypass_cache')
+        )
+        if use_cache:
+            with span('cache.lookup') as attributes:
+                entry = cache._lookup(user_input, config)
+                attributes['hit'] = bool(entry)
+            if entry:
+                return {
+                    'success': True,
+                    'message': entry.response,
+                    'usage': {},
+                    'cached': True
+                }
+        
+        def complete():
+            return self.create_chat_completion(
+                messages=history + [{
+                    'role': 'user',
+                    'content': user_input
+                }],
+                model=config.model_name,
+                temperature=config.temperature,
+                max_tokens=config.max_tokens,
+                conversation_summary=summary
+            )
+        
+        # Identical deterministic questions in flight share a single Anthropic call
+        flights = self.env['chatbot.single.flight']
+        key = flights._get_key(user_input, config) if not history and not summary else None
+        stored = False
+        if key:
+            with span('coalesce') as attributes:
+                result, stored = flights._run(key, user_input, config, complete)
+                attributes['coalesced'] = bool(result.get('coalesced'))
+        else:
+            result = complete()
+        if use_cache and result.get('success') and not stored:
+            with span('cache.store'):
+                cache._store(user_input, config, result)
+        result['cached'] = False
+        return result
+    
+    @api.model
+    def call_anthropic_api(self, user_input, config, fast_mode=False, **kwargs):
+        """
+        Answer a single user question and return the response text only.
+        
+        Returns:
+            Response text
+        """
+        return self.call_api(user_input, config, **kwargs).get('message', '')
+    
+    def _run_agent_loop(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        stream: bool = False,
+        conversation_summary: str = ''
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Agent loop engine: call Claude, run the requested tools, repeat.
+        
+        Headers, system prompt and tool schemas are prepared once and reused
+        for every hop. The loop is bounded by the configured maximum number of
+        turns and total token budget, and the whole exchange is logged as a
+        single anthropic.service trace with per-hop timings.
+        
+        Args:
+            messages: List of message dictionaries
+            model: Model to use
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens to generate per turn
+            stream: Use the server-sent events API and yield text deltas
+            conversation_summary: Summary of the earlier turns of the conversation
+            
+        Yields:
+            Event dictionaries, the last one being {'type': 'done', ...}
+        """
+        with span('prompt'):
+            config, headers, system_prompt, tools = self._prepare_completion_request(conversation_summary)
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+        max_turns = config.max_agent_turns or DEFAULT_MAX_AGENT_TURNS
+        token_budget = config.max_total_tokens
+        
+        breakers = self.env['chatbot.circuit.breaker'].sudo()
+        prices = self.env['chatbot.model.price']
+        messages = list(messages)
+        # Text of every turn: what Claude says before calling tools is part of the answer too
+        texts = []
+        usage = {}
+        cost = 0.0
+        hops = []
+        tool_models = set()
+        start_time = time.monotonic()
+        payload = None
+        
+        try:
+            for turn in range(1, max_turns + 1):
+                # Downgraded to the fallback model while the circuit of the model is open
+                hop_model = breakers._route_model(config, model)
+                payload = self._build_payload(
+                    messages, hop_model, temperature, max_tokens, system_prompt, tools, stream=stream
+                )
+                hop_start = time.monotonic()
+                with span('anthropic.hop', turn=turn, stream=stream):
+                    if stream:
+                        data = yield from self._stream_hop(
+                            payload, headers, config, separator=TURN_SEPARATOR if texts else ''
+                        )
+                    else:
+                        data = self._post_hop(payload, headers, config)
+                hop = {'turn': turn, 'llm_ms': round((time.monotonic() - hop_start) * 1000, 1)}
+                if hop_model != model:
+                    hop['model'] = hop_model
+                hops.append(hop)
+                self._merge_usage(usage, data.get('usage', {}))
+                # Priced per hop: a fallback hop is billed at the fallback model price
+                cost += prices._compute_cost(hop_model, data.get('usage'))
+                
+                # Process the response
+                content = data.get('content', [])
+                tool_calls = [item for item in content if item.get('type') == 'tool_use']
+                turn_text = ''.join(
+                    item.get('text', '') for item in content if item.get('type') == 'text'
+                )
+                if turn_text:
+                    texts.append(turn_text)
+                
+                if not tool_calls:
+                    # Log the exchange (last request holds the whole conversation)
+                    with span('db.write'):
+                        self._log_exchange(
+                            config, True, payload, data,
+                            turn_count=turn,
+                            duration=time.monotonic() - start_time,
+                            hop_timings=json.dumps(hops),
+                            **prices._get_usage_values(hop_model, usage, cost)
+                        )
+                    yield {
+                        'type': 'done',
+                        'message': TURN_SEPARATOR.join(texts),
+                        'usage': usage,
+                        'cost': cost,
+                        'model': hop_model,
+                        'turns': turn,
+                        'tool_models': sorted(tool_models)
+                    }
+                    return
+                
+                if turn == max_turns:
+                    raise UserError(f'Maximum number of agent turns ({max_turns}) reached')
+                total_tokens = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+                if token_budget and total_tokens >= token_budget:
+                    raise UserError(f'Token budget exceeded ({total_tokens}/{token_budget} tokens)')
+                
+                # Execute the tools and continue the conversation with their results
+                tool_start = time.monotonic()
+                with span('tools', count=len(tool_calls)):
+                    tool_results = self._run_tool_calls(tool_calls, config=config)
+                hop['tool_ms'] = round((time.monotonic() - tool_start) * 1000, 1)
+                hop['tools'] = [call.get('name') for call in tool_calls]
+                tool_models.update(
+                    call['input']['model'] for call in tool_calls
+                    if isinstance(call.get('input'), dict) and call['input'].get('model')
+                )
+                messages += [{
+                    'role': 'assistant',
+                    'content': content
+                }, {
+                    'role': 'user',
+                    'content': tool_results
+                }]
+        except requests.exceptions.RequestException as e:
+            error_msg = f'Network error: {str(e)}'
+            self._write_loop_error(config, payload, error_msg, hops, start_time, model, usage, cost)
+            raise UserError(error_msg)
+        except UserError as e:
+            self._write_loop_error(config, payload, str(e), hops, start_time, model, usage, cost)
+            raise
+        except Exception as e:
+            error_msg = f'Unexpected error: {str(e)}'
+            self._write_loop_error(config, payload, error_msg, hops, start_time, model, usage, cost)
+            raise UserError(error_msg)
+    
+    def _write_loop_error(self, config, payload, error_msg, hops, start_time, model=None, usage=None, cost=None):
+        """Log a failed agent loop, with the tokens spent by its completed hops."""
+        # Billed to the model of the last hop, the fallback one after a downgrade
+        model = (payload or {}).get('model') or model
+        self._log_exchange(
+            config, False, payload,
+            error_message=error_msg,
+            turn_count=len(hops),
+            duration=time.monotonic() - start_time,
+            hop_timings=json.dumps(hops),
+            **self.env['chatbot.model.price']._get_usage_values(model, usage, cost)
+        )
+    
+    def _get_messages_url(self, config) -> str:
+        """Messages API endpoint of a configuration (a local stand-in server when benchmarking)."""
+        return f"{(config.sudo().anthropic_api_url or ANTHROPIC_API_URL).rstrip('/')}/v1/messages"
+    
+    def _get_batches_url(self, config) -> str:
+        """Message Batches API endpoint of a configuration."""
+        return f"{(config.sudo().anthropic_api_url or ANTHROPIC_API_URL).rstrip('/')}/v1/messages/batches"
+    
+    def _send_to_anthropic(self, payload, headers, config, stream=False):
+        """
+        POST a Messages API request through the circuit breaker of its model.
+        
+        Returns:
+            requests response (streamed when asked)
+            
+        Raises:
+            CircuitOpenError: when the model keeps failing or answering too slowly
+        """
+        url = self._get_messages_url(config)
+        return self.env['chatbot.circuit.breaker'].sudo()._call(
+            config,
+            f"anthropic:{payload.get('model')}",
+            lambda: self._http_post(url, json=payload, headers=headers, timeout=30, config=config, stream=stream)
+        )
+    
+    def _post_hop(self, payload, headers, config) -> Dict[str, Any]:
+        """
+        Run one blocking Messages API call.
+        
+        Returns:
+            Decoded response body
+        """
+        response = self._send_to_anthropic(payload, headers, config)
+        if response.status_code != 200:
+            raise UserError(f'API Error: {response.status_code} - {response.text}')
+        return response.json()
+    
+    def _stream_hop(self, payload, headers, config, separator=''):
+        """
+        Run one streamed Messages API call, yielding text and tool events.
+        
+        Args:
+            separator: Text streamed before the first text of the call, to
+                separate it from the text of the previous turns
+        
+        Returns:
+            Response body rebuilt from the stream (content, stop_reason, usage)
+        """
+        response = self._send_to_anthropic(payload, headers, config, stream=True)
+        if response.status_code != 200:
+            raise UserError(f'API Error: {response.status_code} - {response.text}')
+        
+        content = []
+        stop_reason = None
+        usage = {}
+        with response:
+            for event in self._iter_sse_events(response):
+                event_type = event.get('type')
+                if event_type == 'message_start':
+                    usage.update(event.get('message', {}).get('usage') or {})
+                elif event_type == 'content_block_start':
+                    block = dict(event.get('content_block', {}))
+                    if block.get('type') == 'tool_use':
+                        block['partial_json'] = ''
+                        yield {'type': 'tool', 'name': block.get('name')}
+                    content.append(block)
+                elif event_type == 'content_block_delta':
+                    delta = event.get('delta', {})
+                    block = content[event.get('index', len(content) - 1)]
+                    if delta.get('type') == 'text_delta':
+                        text = delta.get('text', '')
+                        block['text'] = block.get('text', '') + text
+                        if text:
+                            yield {'type': 'text', 'text': separator + text}
+                            separator = ''
+                    elif delta.get('type') == 'input_json_delta':
+                        block['partial_json'] += delta.get('partial_json', '')
+                elif event_type == 'message_delta':
+                    stop_reason = event.get('delta', {}).get('stop_reason')
+                    # output_tokens in message_delta is cumulative for the turn
+                    usage.update(event.get('usage') or {})
+                elif event_type == 'error':
+                    raise UserError(f"API Error: {event.get('error', {}).get('message')}")
+        
+        for block in content:
+            if block.get('type') == 'tool_use':
+                partial_json = block.pop('partial_json')
+                block['input'] = json.loads(partial_json) if partial_json else {}
+        return {'content': content, 'stop_reason': stop_reason, 'usage': usage}
+    
+    @staticmethod
+    def _iter_sse_events(response) -> Iterator[Dict[str, Any]]:
+        """
+        Decode a server-sent events body into JSON payloads.
+        
+        Args:
+            response: Streamed requests response
+            
+        Yields:
+            Decoded 'data:' payloads
+        """
+        data_lines = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                if line.startswith('data:'):
+                    data_lines.append(line[5:].strip())
+                continue
+            if data_lines:
+                yield json.loads('\n'.join(data_lines))
+                data_lines = []
+        if data_lines:
+            yield json.loads('\n'.join(data_lines))
+    
+    @staticmethod
+    def _merge_usage(total: Dict[str, int], usage: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Add the token counters of a usage block into an accumulator.
+        
+        Returns:
+            The accumulator
+        """
+        for key, value in (usage or {}).items():
+            if isinstance(value, int):
+                total[key] = total.get(key, 0) + value
+        return total
+    
+    def _prepare_completion_request(self, conversation_summary=''):
+        """
+        Prepare the parts of a Messages API request that do not change between hops.
+        
+        Args:
+            conversation_summary: Summary of the earlier turns of the conversation
+            
+        Returns:
+            Tuple (config, headers, system prompt, tool definitions)
+        """
+        config = self.env['chatbot.config'].sudo().get_active_config()
+        headers = self._get_api_headers(config)
+        
+        # Define available tools if a tool backend is available
+        tools = []
+        if config._tools_available():
+            tools = self._get_tool_definitions()
+        
+        # Build system prompt with Odoo context
+        if not config.prompt_caching:
+            return config, headers, self._build_system_prompt(config, conversation_summary), tools
+        
+        # Prompt caching: the cached prefix covers the tools, then the static
+        # system prompt; the per-user context comes after the breakpoint.
+        # A breakpoint is only set where the prefix reaches the minimum size
+        # the model caches.
+        headers['anthropic-beta'] += ',prompt-caching-2024-07-31'
+        static_prompt = self._build_static_system_prompt(config)
+        minimum = self._get_min_cacheable_tokens(config.model_name)
+        tools_tokens = estimate_tokens(json.dumps(tools)) if tools else 0
+        prefix_tokens = tools_tokens + estimate_tokens(static_prompt)
+        static_block = {'type': 'text', 'text': static_prompt}
+        if prefix_tokens >= minimum:
+            static_block['cache_control'] = {'type': 'ephemeral'}
+        elif config.model_name not in _SHORT_PREFIX_MODELS:
+            _SHORT_PREFIX_MODELS.add(config.model_name)
+            _logger.info(
+                f"Prompt caching has no effect on {config.model_name}: the static prompt and tools "
+                f"(about {prefix_tokens} tokens) are shorter than the {minimum} tokens it caches"
+            )
+        system_prompt = [static_block, {
+            'type': 'text',
+            'text': self._build_context_prompt(conversation_summary)
+        }]
+        if tools and tools_tokens >= minimum:
+            tools[-1] = dict(tools[-1], cache_control={'type': 'ephemeral'})
+        return config, headers, system_prompt, tools
+    
+    @api.model
+    def _get_min_cacheable_tokens(self, model):
+        """Smallest prompt prefix the model caches, in tokens."""
+        return MIN_CACHEABLE_TOKENS_HAIKU if 'haiku' in (model or '') else MIN_CACHEABLE_TOKENS
+    
+    def _get_api_headers(self, config) -> Dict[str, str]:
+        """
+        Build the Messages API headers of a configuration.
+        
+        Returns:
+            Headers dictionary
+        """
         if not config or not config.api_key:
             raise UserError('Anthropic API key not configured')
         
@@ -54,76 +604,134 @@ class AnthropicService(BaseService, models.Model):
             'anthropic-version': '2023-06-01',
             'anthropic-beta': 'tools-2024-04-04'
         })
+        return headers
+    
+    def _summarize_conversation(self, summary: str, turns: List[Dict[str, Any]], config) -> str:
+        """
+        Fold conversation turns into a running summary.
         
-        # Build system prompt with Odoo context
-        system_prompt = self._build_system_prompt()
+        Uses a single tool-less call to the summary model; the previous
+        summary is rewritten rather than appended to so its size stays bounded.
         
-        # Define available tools if MCP is connected
-        tools = []
-        config = self.env['chatbot.config'].get_active_config()
-        if config.mcp_connected:
-            tools = [
-                {
-                    "name": "search_odoo_records",
-                    "description": "Search for records in Odoo database",
-                    "input_schema": {
-                        "type": "object",
-                        "properties": {
-                            "model": {
-                                "type": "string",
-                                "description": "Odoo model name (e.g., 'crm.lead', 'res.partner')"
-                            },
-                            "domain": {
-                                "type": "array",
-                                "description": "Search domain (e.g., [['name', 'ilike', 'test']])",
-                                "default": []
-                            },
-                            "fields": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "Fields to retrieve",
-                                "default": ["name", "id"]
-                            },
-                            "limit": {
-                                "type": "integer",
-                                "description": "Maximum number of records",
-                                "default": 10
-                            },
-                            "order": {
-                                "type": "string",
-                                "description": "Sort order (e.g., 'create_date desc')",
-                                "default": "id desc"
-                            }
+        Args:
+            summary: Current summary (empty for the first fold)
+            turns: Turns to fold, oldest first ({'user_message', 'bot_response'})
+            config: Active chatbot.config
+            
+        Returns:
+            Updated summary text
+        """
+        config = config.sudo()
+        transcript = '\n\n'.join(
+            f"User: {turn['user_message']}\nAssistant: {turn['bot_response']}" for turn in turns
+        )
+        prompt = f"""Current summary:
+{summary or '(none)'}
+
+New conversation turns:
+{transcript}
+
+Rewrite the summary so that it covers the current summary and the new turns."""
+        payload = self._build_payload(
+            [{'role': 'user', 'content': prompt}],
+            config.summary_model,
+            0.0,
+            config.summary_max_tokens,
+            SUMMARY_SYSTEM_PROMPT,
+            []
+        )
+        data = self._post_hop(payload, self._get_api_headers(config), config)
+        text = ''.join(
+            item.get('text', '') for item in data.get('content', []) if item.get('type') == 'text'
+        ).strip()
+        if not text:
+            raise UserError('Empty conversation summary')
+        return text
+    
+    def _get_tool_definitions(self) -> List[Dict[str, Any]]:
+        """
+        Tool schemas exposed to Claude when a tool backend is available.
+        
+        Returns:
+            List of tool definitions
+        """
+        return [
+            {
+                "name": "search_odoo_records",
+                "description": "Search for records in Odoo database",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "model": {
+                            "type": "string",
+                            "description": "Odoo model name (e.g., 'crm.lead', 'res.partner')"
                         },
-                        "required": ["model"]
-                    }
-                },
-                {
-                    "name": "read_odoo_record",
-                    "description": "Read specific fields from an Odoo record",
-                    "input_schema": {
-                        "type": "object",
-                        "properties": {
-                            "model": {
-                                "type": "string",
-                                "description": "Odoo model name"
-                            },
-                            "record_id": {
-                                "type": "integer",
-                                "description": "Record ID"
-                            },
-                            "fields": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "Fields to read"
-                            }
+                        "domain": {
+                            "type": "array",
+                            "description": "Search domain (e.g., [['name', 'ilike', 'test']])",
+                            "default": []
                         },
-                        "required": ["model", "record_id", "fields"]
-                    }
+                        "fields": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Fields to retrieve",
+                            "default": ["name", "id"]
+                        },
+                        "limit": {
+                            "type": "integer",
+                            "description": "Maximum number of records",
+                            "default": 10
+                        },
+                        "order": {
+                            "type": "string",
+                            "description": "Sort order (e.g., 'create_date desc')",
+                            "default": "id desc"
+                        }
+                    },
+                    "required": ["model"]
                 }
-            ]
+            },
+            {
+                "name": "read_odoo_record",
+                "description": "Read specific fields from an Odoo record",
+                "input_schema": {
+                    "type": "object",
+                    "properties": {
+                        "model": {
+                            "type": "string",
+                            "description": "Odoo model name"
+                        },
+                        "record_id": {
+                            "type": "integer",
+                            "description": "Record ID"
+                        },
+                        "fields": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Fields to read"
+                        }
+                    },
+                    "required": ["model", "record_id", "fields"]
+                }
+            }
+        ]
+    
+    def _build_payload(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        system_prompt: Union[str, List[Dict[str, Any]]],
+        tools: List[Dict[str, Any]],
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Build the Messages API payload.
         
-        # Prepare payload
+        Returns:
+            Payload dictionary
+        """
         payload = {
             'model': model,
             'messages': messages,
@@ -131,139 +739,57 @@ class AnthropicService(BaseService, models.Model):
             'temperature': temperature,
             'max_tokens': max_tokens
         }
+        if stream:
+            payload['stream'] = True
         
         # Add tools if available
         if tools:
             payload['tools'] = tools
             # Let Claude decide when to use tools
             payload['tool_choice'] = {'type': 'auto'}
-        
-        # Log request
-        service_record = self.create({
-            'request_data': str(payload),
-            'success': False
-        })
-        
-        try:
-            # Make API request
-            response = requests.post(
-                'https://api.anthropic.com/v1/messages',
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Update service record
-                service_record.write({
-                    'response_data': str(data),
-                    'success': True
-                })
-                
-                # Process the response
-                result_text = ""
-                tool_calls = []
-                
-                content = data.get('content', [])
-                for item in content:
-                    if item.get('type') == 'text':
-                        result_text += item.get('text', '')
-                    elif item.get('type') == 'tool_use':
-                        tool_calls.append(item)
-                
-                # If there are tool calls, execute them
-                if tool_calls:
-                    tool_results = []
-                    for tool_call in tool_calls:
-                        tool_name = tool_call.get('name')
-                        tool_input = tool_call.get('input', {})
-                        tool_id = tool_call.get('id')
-                        
-                        try:
-                            # Execute the tool
-                            tool_result = self._execute_tool(tool_name, tool_input)
-                            tool_results.append({
-                                'type': 'tool_result',
-                                'tool_use_id': tool_id,
-                                'content': str(tool_result)
-                            })
-                        except Exception as e:
-                            tool_results.append({
-                                'type': 'tool_result',
-                                'tool_use_id': tool_id,
-                                'content': f"Error: {str(e)}",
-                                'is_error': True
-                            })
-                    
-                    # Continue the conversation with tool results
-                    messages_with_tools = messages + [{
-                        'role': 'assistant',
-                        'content': content
-                    }, {
-                        'role': 'user',
-                        'content': tool_results
-                    }]
-                    
-                    # Make another API call with tool results
-                    return self.create_chat_completion(
-                        messages=messages_with_tools,
-                        model=model,
-                        temperature=temperature,
-                        max_tokens=max_tokens
-                    )
-                
-                # Return the text response
-                return {
-                    'success': True,
-                    'message': result_text,
-                    'usage': data.get('usage', {})
-                }
-            else:
-                error_msg = f'API Error: {response.status_code} - {response.text}'
-                service_record.write({
-                    'error_message': error_msg,
-                    'success': False
-                })
-                raise UserError(error_msg)
-                
-        except requests.exceptions.RequestException as e:
-            error_msg = f'Network error: {str(e)}'
-            service_record.write({
-                'error_message': error_msg,
-                'success': False
-            })
-            raise UserError(error_msg)
-        except Exception as e:
-            error_msg = f'Unexpected error: {str(e)}'
-            service_record.write({
-                'error_message': error_msg,
-                'success': False
-            })
-            raise UserError(error_msg)
+        return payload
     
-    def _build_system_prompt(self) -> str:
+    def _build_system_prompt(self, config=None, conversation_summary='') -> str:
         """
         Build system prompt with Odoo context.
         
+        Args:
+            config: Active chatbot.config, looked up when not given
+            conversation_summary: Summary of the earlier turns of the conversation
+            
         Returns:
             System prompt string
         """
-        user = self.env.user
-        company = user.company_id
-        config = self.env['chatbot.config'].get_active_config()
+        config = config or self.env['chatbot.config'].get_active_config()
+        context_prompt = self._build_context_prompt(conversation_summary)
+        return f"{self._build_static_system_prompt(config)}\n\n{context_prompt}"
+    
+    def _build_static_system_prompt(self, config) -> str:
+        """
+        Build the part of the system prompt shared by every user and request.
+        
+        It must not contain anything user or request specific so that it
+        can be served from the Anthropic prompt cache.
         
-        # Check if MCP is connected
+        Args:
+            config: Active chatbot.config
+            
+        Returns:
+            System prompt string
+        """
+        # Describe the tools when a tool backend is available
         mcp_instructions = ""
-        if config.mcp_connected:
-            mcp_instructions = """
-You have DIRECT ACCESS to the Odoo database through the MCP server. You can:
-- Search records: Use search_records(model, domain, fields, limit)
-- Create records: Use create_record(model, values)
-- Update records: Use update_record(model, record_id, values)
-- Delete records: Use delete_record(model, record_id)
-- Execute methods: Use execute_method(model, method, args)
+        if config._tools_available():
+            source = (
+                "directly, with the access rights of the current user" if config.tool_backend == 'orm'
+                else "through the MCP server"
+            )
+            mcp_instructions = f"""
+You can READ the Odoo database {source}, with two tools:
+- search_odoo_records(model, domain, fields, limit, order): search records and return the requested fields
+- read_odoo_record(model, record_id, fields): read fields of one record by its ID
+
+These tools are read-only: you cannot create, update or delete records, nor run methods.
 
 Common Odoo models:
 - crm.lead: CRM leads and opportunities
@@ -272,17 +798,12 @@ Common Odoo models:
 - account.move: Invoices and bills
 - product.product: Products
 
-When users ask about Odoo data, ALWAYS use the tools to query the database directly instead of saying you cannot access it. For example:
+When users ask about Odoo data, ALWAYS use the tools to query the database instead of saying you cannot access it. For example:
 - To find the latest lead: use search_odoo_records with model='crm.lead', order='create_date desc', limit=1
 - To get partner details: use read_odoo_record with model='res.partner', record_id=ID, fields=['name', 'email', 'phone']
 """
         
         return f"""You are an AI assistant integrated with Odoo ERP system.
-
-Current context:
-- User: {user.name}
-- Company: {company.name}
-- Language: {user.lang or 'en_US'}
 {mcp_instructions}
 You have access to Odoo's business context and can help with:
 - Answering questions about business data
@@ -292,9 +813,168 @@ You have access to Odoo's business context and can help with:
 
 Always provide helpful, accurate, and contextual responses."""
     
+    def _build_context_prompt(self, conversation_summary='') -> str:
+        """
+        Build the per-user part of the system prompt.
+        
+        Args:
+            conversation_summary: Summary of the earlier turns of the conversation
+            
+        Returns:
+            Context string
+        """
+        user = self.env.user
+        company = user.company_id
+        context = f"""Current context:
+- User: {user.name}
+- Company: {company.name}
+- Language: {user.lang or 'en_US'}"""
+        if conversation_summary:
+            context += f"\n\nSummary of the earlier part of this conversation:\n{conversation_summary}"
+        return context
+    
+    def _run_tool_calls(self, tool_calls: List[Dict[str, Any]], config=None) -> List[Dict[str, Any]]:
+        """
+        Execute the tool_use blocks of an assistant turn.
+        
+        Calls are prepared sequentially and looked up in the tool result
+        cache. In-process (ORM) calls run on the request thread; remote MCP
+        calls are dispatched concurrently, on the worker event loop with the
+        asyncio HTTP client or on a bounded thread pool otherwise. Results
+        are returned in the original tool_use order.
+        
+        Args:
+            tool_calls: tool_use content blocks returned by Claude
+            config: Active chatbot.config, looked up when not given
+            
+        Returns:
+            tool_result content blocks, in the same order
+        """
+        config = config or self.env['chatbot.config'].get_active_config()
+        pool_size, max_retries = self._get_http_pool_settings(config)
+        timeout = config.tool_timeout or 30
+        tool_cache = self.env['chatbot.tool.cache'].sudo()
+        breakers = self.env['chatbot.circuit.breaker'].sudo()
+        
+        trace = current_trace()
+        outcomes = [None] * len(tool_calls)
+        prepared = {}
+        cache_keys = {}
+        remote = []
+        for i, tool_call in enumerate(tool_calls):
+            try:
+                backend, target, payload = self._prepare_tool_call(
+                    tool_call.get('name'), tool_call.get('input', {}), config=config
+                )
+            except Exception as e:
+                outcomes[i] = e
+                continue
+            prepared[i] = (backend, target, payload)
+            
+            # Serve repeated tool calls from the tool result cache
+            if config.tool_cache_enabled:
+                cache_keys[i] = tool_cache._make_key(self._get_tool_cache_scope(backend), target, payload, config)
+                with span('tool.cache', name=tool_call.get('name')) as attributes:
+                    cached = tool_cache._get(cache_keys[i], config)
+                    attributes['hit'] = cached is not None
+                if cached is not None:
+                    outcomes[i] = cached
+                    cache_keys.pop(i)
+                    continue
+            
+            if backend == 'orm':
+                try:
+                    with span('tool', name=tool_call.get('name'), backend='orm'):
+                        outcomes[i] = self._execute_orm_tool(target, payload)
+                except Exception as e:
+                    outcomes[i] = UserError(f'Tool execution error: {str(e)}')
+            else:
+                remote.append(i)
+        
+        runner = self._get_async_runner(config) if remote else None
+        
+        # Remote calls are timed in the thread that runs them
+        send_requests = {
+            i: trace.wrap('tool', _send_tool_request, name=tool_calls[i].get('name'), backend='mcp')
+            if trace else _send_tool_request
+            for i in remote
+        }
+        
+        # Circuit breakers are looked up here: the threads have no database access
+        remote_breakers = {i: breakers._get(config, upstream_key('mcp', prepared[i][1])) for i in remote}
+        
+        max_workers = min(max(config.max_tool_concurrency, 1), len(remote))
+        if runner:
+            # All the calls in flight together, each bounded by the tool timeout
+            send_async = {
+                i: trace.wrap_async('tool', _send_tool_request_async, name=tool_calls[i].get('name'), backend='mcp')
+                if trace else _send_tool_request_async
+                for i in remote
+            }
+            results = runner.gather([
+                send_async[i](runner, *prepared[i][1:], timeout, breaker=remote_breakers[i])
+                for i in remote
+            ], timeout)
+            for i, result in zip(remote, results):
+                if isinstance(result, asyncio.TimeoutError):
+                    result = UserError(f'Tool execution error: timed out after {timeout}s')
+                outcomes[i] = result
+        elif max_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chatbot_tool')
+            try:
+                futures = {
+                    i: executor.submit(
+                        send_requests[i], *prepared[i][1:], timeout, pool_size, max_retries,
+                        breaker=remote_breakers[i]
+                    )
+                    for i in remote
+                }
+                # Per-call deadline, measured from dispatch
+                deadline = time.monotonic() + timeout
+                for i, future in futures.items():
+                    try:
+                        outcomes[i] = future.result(timeout=max(deadline - time.monotonic(), 0))
+                    except FutureTimeoutError:
+                        outcomes[i] = UserError(f'Tool execution error: timed out after {timeout}s')
+                    except Exception as e:
+                        outcomes[i] = e
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for i in remote:
+                try:
+                    outcomes[i] = send_requests[i](
+                        *prepared[i][1:], timeout, pool_size, max_retries, breaker=remote_breakers[i]
+                    )
+                except Exception as e:
+                    outcomes[i] = e
+        if remote:
+            breakers._publish(breaker.key for breaker in remote_breakers.values() if breaker)
+        
+        for i, key in cache_keys.items():
+            if not isinstance(outcomes[i], Exception):
+                tool_cache._set(key, prepared[i][2].get('model'), outcomes[i], config)
+        
+        tool_results = []
+        for tool_call, outcome in zip(tool_calls, outcomes):
+            if isinstance(outcome, Exception):
+                tool_results.append({
+                    'type': 'tool_result',
+                    'tool_use_id': tool_call.get('id'),
+                    'content': f"Error: {str(outcome)}",
+                    'is_error': True
+                })
+            else:
+                tool_results.append({
+                    'type': 'tool_result',
+                    'tool_use_id': tool_call.get('id'),
+                    'content': str(outcome)
+                })
+        return tool_results
+    
     def _execute_tool(self, tool_name: str, tool_input: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Execute a tool call through MCP server.
+        Execute a tool call, in-process or through the MCP server.
         
         Args:
             tool_name: Name of the tool to execute
@@ -304,13 +984,97 @@ Always provide helpful, accurate, and contextual responses."""
             Tool execution result
         """
         config = self.env['chatbot.config'].get_active_config()
+        backend, target, payload = self._prepare_tool_call(tool_name, tool_input, config=config)
+        
+        key = None
+        tool_cache = self.env['chatbot.tool.cache'].sudo()
+        if config.tool_cache_enabled:
+            key = tool_cache._make_key(self._get_tool_cache_scope(backend), target, payload, config)
+            result = tool_cache._get(key, config)
+            if result is not None:
+                return result
+        
+        if backend == 'orm':
+            try:
+                result = self._execute_orm_tool(target, payload)
+            except Exception as e:
+                raise UserError(f'Tool execution error: {str(e)}')
+        else:
+            pool_size, max_retries = self._get_http_pool_settings(config)
+            breakers = self.env['chatbot.circuit.breaker'].sudo()
+            breaker = breakers._get(config, upstream_key('mcp', target))
+            try:
+                result = _send_tool_request(
+                    target, payload, config.tool_timeout or 30, pool_size, max_retries, breaker=breaker
+                )
+            finally:
+                if breaker:
+                    breakers._publish([breaker.key])
+        if key:
+            tool_cache._set(key, payload.get('model'), result, config)
+        return result
+    
+    def _get_tool_cache_scope(self, backend: str) -> str:
+        """
+        Sharing scope of tool results: remote MCP calls use the shared MCP
+        credentials, in-process calls depend on the current user's access rights.
+        """
+        return f'orm:{self.env.uid}' if backend == 'orm' else 'mcp'
+    
+    def _prepare_tool_call(self, tool_name: str, tool_input: Dict[str, Any], config=None):
+        """
+        Choose the backend of a tool call and build its request.
+        
+        The in-process backend is used when selected and the model exists in
+        this database; otherwise the call goes to the remote MCP server.
+        
+        Args:
+            tool_name: Name of the tool to execute
+            tool_input: Tool parameters
+            config: Active chatbot.config, looked up when not given
+            
+        Returns:
+            Tuple (backend, target, payload): ('orm', tool name, payload)
+            or ('mcp', url, payload)
+        """
+        config = config or self.env['chatbot.config'].get_active_config()
+        if config.tool_backend == 'orm' and tool_input.get('model') in self.env:
+            if tool_name not in ('search_odoo_records', 'read_odoo_record'):
+                raise UserError(f'Unknown tool: {tool_name}')
+            _url, payload = self._map_tool_input(tool_name, tool_input, '')
+            return 'orm', tool_name, payload
+        if config.tool_backend == 'orm' and not config.mcp_connected:
+            raise UserError(f"Unknown model: {tool_input.get('model')}")
+        url, payload = self._prepare_tool_request(tool_name, tool_input, config=config)
+        return 'mcp', url, payload
+    
+    def _prepare_tool_request(self, tool_name: str, tool_input: Dict[str, Any], config=None):
+        """
+        Map a tool call to its MCP endpoint.
+        
+        Args:
+            tool_name: Name of the tool to execute
+            tool_input: Tool parameters
+            config: Active chatbot.config, looked up when not given
+            
+        Returns:
+            Tuple (url, payload)
+        """
+        config = config or self.env['chatbot.config'].get_active_config()
         if not config.mcp_connected:
             raise UserError('MCP not connected')
+        return self._map_tool_input(tool_name, tool_input, config.mcp_server_url)
+    
+    def _map_tool_input(self, tool_name: str, tool_input: Dict[str, Any], server_url: str):
+        """
+        Normalize tool parameters into an MCP request.
         
-        
+        Returns:
+            Tuple (url, payload)
+        """
         # Map tool names to MCP endpoints
         if tool_name == 'search_odoo_records':
-            url = f"{config.mcp_server_url.rstrip('/')}/search"
+            url = f"{server_url.rstrip('/')}/search"
             payload = {
                 'model': tool_input.get('model'),
                 'domain': tool_input.get('domain', []),
@@ -319,7 +1083,7 @@ Always provide helpful, accurate, and contextual responses."""
                 'order': tool_input.get('order', 'id desc')
             }
         elif tool_name == 'read_odoo_record':
-            url = f"{config.mcp_server_url.rstrip('/')}/read"
+            url = f"{server_url.rstrip('/')}/read"
             payload = {
                 'model': tool_input.get('model'),
                 'ids': [tool_input.get('record_id')],
@@ -327,32 +1091,37 @@ Always provide helpful, accurate, and contextual responses."""
             }
         else:
             raise UserError(f'Unknown tool: {tool_name}')
+        return url, payload
+    
+    def _execute_orm_tool(self, tool_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a tool call directly through the ORM, under the access rights
+        of the requesting user (never as superuser).
         
-        # Execute the request
-        try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
+        Args:
+            tool_name: search_odoo_records or read_odoo_record
+            payload: Normalized tool parameters
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise UserError(f'MCP Error: {response.status_code} - {response.text}')
-                
-        except Exception as e:
-            raise UserError(f'Tool execution error: {str(e)}')
-    
-    
-    @api.autovacuum
-    def _gc_old_records(self):
-        """Clean up old service records (keep last 7 days)."""
-        days_to_keep = 7
-        domain = [
-            ('create_date', '<', fields.Datetime.now() - timedelta(days=days_to_keep))
-        ]
-        records = self.search(domain)
-        records.unlink()
-        _logger.info(f'Cleaned up {len(records)} old Anthropic service records')
\ No newline at end of file
+        Returns:
+            Tool execution result
+        """
+        model = self.env[payload['model']].sudo(False)
+        # The domain, order and ids come from the model: a query error must
+        # not abort the transaction the agent loop keeps using
+        with self.env.cr.savepoint():
+            if tool_name == 'search_odoo_records':
+                fields_list = [name for name in (payload.get('fields') or ['name', 'id']) if name in model._fields]
+                fields_list = fields_list or ['display_name']
+                limit = min(int(payload.get('limit') or 10), MAX_ORM_TOOL_LIMIT)
+                records = model.search_read(
+                    payload.get('domain') or [],
+                    fields_list,
+                    limit=limit,
+                    order=payload.get('order') or 'id desc'
+                )
+                return {'success': True, 'model': payload['model'], 'count': len(records), 'records': records}
+            
+            fields_list = [name for name in (payload.get('fields') or []) if name in model._fields]
+            fields_list = fields_list or ['display_name']
+            records = model.browse([record_id for record_id in payload['ids'] if record_id]).exists()
+            return {'success': True, 'model': payload['model'], 'records': records.read(fields_list)}
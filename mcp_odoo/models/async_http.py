@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio client of the chatbot upstream calls (Anthropic, MCP server).
+
+Each worker process runs one event loop in a daemon thread. The request
+threads hand their HTTP calls over to it and wait for the outcome, so the
+Odoo API stays synchronous. Many calls can then be in flight at the same
+time without a thread each: tool calls fan out, batch jobs are polled
+together, streamed answers are read on the loop and consumed line by line.
+
+httpx is used when it is installed. Otherwise the calls run on a bounded
+thread pool behind the same interface: the API and the concurrency limits
+are the same, only the thread saving is lost.
+
+This module does not depend on Odoo (it is also loaded by the benchmarks).
+Responses mimic the part of the requests API used by the services, and
+network errors are raised as requests exceptions, so the error handling and
+the circuit breakers work the same on both paths.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import queue
+import threading
+from json import loads as json_loads
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 32
+
+# End of a streamed body, in the queue between the loop and the reading thread
+_END = object()
+
+
+def _translate_error(error):
+    """requests exception equivalent to an httpx error."""
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(error))
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(error))
+    return requests.exceptions.RequestException(str(error))
+
+
+class AsyncResponse:
+    """Buffered HTTP response."""
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = dict(headers or {})
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json_loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} Error', response=self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class AsyncStreamResponse(AsyncResponse):
+    """Streamed HTTP response read on the event loop and consumed from a request thread."""
+
+    def __init__(self, runner, method, url, timeout, **kwargs):
+        self._lines = queue.Queue()
+        self._future = runner.submit(runner._stream(self._lines, method, url, timeout=timeout, **kwargs))
+        # Wait for the status line; the error bodies are read in full
+        status_code, headers, content = self._get(timeout)
+        super().__init__(status_code, content, headers)
+
+    def _get(self, timeout=None):
+        try:
+            item = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self.close()
+            raise requests.exceptions.Timeout('Read timed out')
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def iter_lines(self, decode_unicode=False):
+        """Lines of the body, without their line break."""
+        while True:
+            line = self._get()
+            if line is _END:
+                return
+            yield line if decode_unicode else line.encode()
+
+    def close(self):
+        self._future.cancel()
+
+
+class AsyncRunner:
+    """Event loop of a worker process, with its shared HTTP client."""
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.loop = asyncio.new_event_loop()
+        self.stats = {'requests': 0, 'in_flight': 0, 'max_in_flight': 0, 'errors': 0}
+        self._client = None
+        self._slots = None
+        self._executor = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run_loop, name='chatbot_asyncio', daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def backend(self):
+        return 'httpx' if httpx else 'threads'
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the loop from another thread (concurrent future)."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the loop and wait for its result.
+
+        Raises:
+            requests.exceptions.Timeout: when it did not end in time (it is cancelled)
+        """
+        future = self.submit(coroutine)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise requests.exceptions.Timeout(f'No answer after {timeout}s')
+
+    def gather(self, coroutines, timeout):
+        """
+        Run coroutines concurrently, each bounded by timeout.
+
+        Returns:
+            List of results, in order; a failed call gives its exception
+            (TimeoutError when it timed out)
+        """
+        async def bounded(coroutine):
+            return await asyncio.wait_for(coroutine, timeout)
+
+        async def run_all():
+            return await asyncio.gather(*(bounded(c) for c in coroutines), return_exceptions=True)
+
+        return self.run(run_all())
+
+    def _count(self, delta, error=False):
+        with self._lock:
+            if delta > 0:
+                self.stats['requests'] += 1
+            self.stats['in_flight'] += delta
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+            if error:
+                self.stats['errors'] += 1
+
+    def _get_slots(self):
+        # Calls beyond the connection limit wait here rather than in the
+        # client pool, whose bookkeeping grows with the queued requests
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        return self._slots
+
+    def _get_client(self):
+        # Created on the loop, at its first use
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ))
+        return self._client
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_connections, thread_name_prefix='chatbot_async_http'
+                )
+                self._session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.max_connections)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def _blocking_request(self, method, url, **kwargs):
+        response = self._get_session().request(method, url, **kwargs)
+        return AsyncResponse(response.status_code, response.content, response.headers)
+
+    async def request(self, method, url, headers=None, json=None, timeout=30):
+        """
+        Send an HTTP request and read its whole body.
+
+        Returns:
+            AsyncResponse
+
+        Raises:
+            requests.exceptions.RequestException: on network errors and timeouts
+        """
+        self._count(1)
+        failed = False
+        try:
+            if httpx is None:
+                self._get_session()
+                return await self.loop.run_in_executor(self._executor, functools.partial(
+                    self._blocking_request, method, url, headers=headers, json=json, timeout=timeout
+                ))
+            try:
+                async with self._get_slots():
+                    response = await self._get_client().request(
+                        method, url, headers=headers, json=json, timeout=timeout
+                    )
+            except httpx.HTTPError as e:
+                raise _translate_error(e) from e
+            return AsyncResponse(response.status_code, response.content, response.headers)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._count(-1, error=failed)
+
+    def stream(self, method, url, headers=None, json=None, timeout=30):
+        """
+        Send an HTTP request whose body is read line by line (called from a request thread).
+
+        Returns:
+            Response with status_code, text (error bodies) and iter_lines()
+        """
+        if httpx is None:
+            return self._get_session().request(
+                method, url, headers=headers, json=json, timeout=timeout, stream=True
+            )
+        return AsyncStreamResponse(self, method, url, timeout, headers=headers, json=json)
+
+    async def _stream(self, lines, method, url, timeout=30, **kwargs):
+        """Read a streamed body on the loop into a queue: status, then lines, then _END."""
+        self._count(1)
+        failed = False
+        try:
+            async with self._get_slots(), self._get_client().stream(method, url, timeout=timeout, **kwargs) as response:
+                content = await response.aread() if response.status_code != 200 else b''
+                lines.put((response.status_code, response.headers, content))
+                if response.status_code == 200:
+                    async for line in response.aiter_lines():
+                        lines.put(line)
+            lines.put(_END)
+        except httpx.HTTPError as e:
+            failed = True
+            lines.put(_translate_error(e))
+        except Exception as e:
+            failed = True
+            lines.put(e)
+            raise
+        finally:
+            self._count(-1, error=failed)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, backend=self.backend, max_connections=self.max_connections)
+
+
+_RUNNER_LOCK = threading.Lock()
+_RUNNER = [None, None]
+
+
+def get_runner(max_connections=DEFAULT_MAX_CONNECTIONS):
+    """
+    Event loop runner of this worker process.
+
+    The connection limit is the one of the first call; a forked worker
+    starts its own loop (the parent's thread does not survive the fork).
+    """
+    with _RUNNER_LOCK:
+        runner, pid = _RUNNER
+        if runner is None or pid != os.getpid():
+            runner = AsyncRunner(max_connections)
+            _RUNNER[:] = [runner, os.getpid()]
+        return runner
+
+
+def get_runner_stats():
+    """Statistics of the runner of this worker process, None when it has not started."""
+    with _RUNNER_LOCK:
+        runner, pid = _RUNNER
+    if runner is None or pid != os.getpid():
+        return None
+    return runner.get_stats()
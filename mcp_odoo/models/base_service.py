@@ -1,28 +1,242 @@
 # -*- coding: utf-8 -*-
+import base64
+import json
+import os
+import random
+import re
+import threading
+import zlib
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
 from odoo import api, models
 import logging
 
+from .async_http import get_runner, get_runner_stats
+from .chatbot_circuit_breaker import CircuitOpenError, upstream_key
+
 _logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 1
+
+# Méthodes relancées sur toute erreur de connexion ; les autres (POST) ne le
+# sont que si la requête n'a pas pu partir, pour ne jamais l'exécuter deux fois
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'})
+
+# Clés dont la valeur n'est jamais journalisée
+REDACTED_KEYS = {
+    'api_key', 'x-api-key', 'authorization', 'password', 'odoo_password',
+    'secret', 'access_token', 'refresh_token',
+}
+REDACTED_VALUE = '***'
+_SECRET_RE = re.compile(r'sk-ant-[A-Za-z0-9_\-]+')
+
+# Blocs de la requête stockés une seule fois (par empreinte) dans chatbot.log.blob
+LOG_BLOCK_KEYS = ('system', 'tools')
+
+# Sessions HTTP partagées par worker : une session (et donc un pool de
+# connexions keep-alive) par hôte distant et par taille de pool.
+_POOL_LOCK = threading.Lock()
+_POOL_SESSIONS = {}
+_POOL_STATS = {'session_hits': 0, 'session_misses': 0, 'retries': 0}
+_POOL_PID = [None]
+
+
+def _get_pooled_session(url, pool_size=DEFAULT_POOL_SIZE):
+    """Session keep-alive du worker pour l'hôte de l'URL (sans accès ORM)"""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, pool_size)
+    with _POOL_LOCK:
+        if _POOL_PID[0] != os.getpid():
+            # Worker forké : ne jamais partager les sockets du parent
+            _POOL_SESSIONS.clear()
+            _POOL_PID[0] = os.getpid()
+        session = _POOL_SESSIONS.get(key)
+        if session is not None:
+            _POOL_STATS['session_hits'] += 1
+            return session
+        _POOL_STATS['session_misses'] += 1
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount(f"{parts.scheme}://", adapter)
+        _POOL_SESSIONS[key] = session
+        return session
+
+
+def _is_connect_error(error):
+    """Vrai si l'erreur est survenue à l'ouverture de la connexion, avant l'envoi de la requête"""
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+
+def pooled_request(method, url, pool_size=DEFAULT_POOL_SIZE, max_retries=DEFAULT_MAX_RETRIES, **kwargs):
+    """Requête HTTP via le pool du worker, utilisable hors environnement Odoo
+    (par exemple depuis un thread d'exécution parallèle des outils).
+
+    Une requête non idempotente (POST) n'est relancée que si la connexion
+    n'a pas pu être ouverte : coupée en cours d'échange, elle a pu être
+    traitée par le serveur (appel Anthropic facturé, écriture MCP)."""
+    session = _get_pooled_session(url, pool_size)
+    attempt = 0
+    while True:
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            raise
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= max_retries:
+                raise
+            if method.upper() not in IDEMPOTENT_METHODS and not _is_connect_error(e):
+                raise
+            attempt += 1
+            with _POOL_LOCK:
+                _POOL_STATS['retries'] += 1
+            _logger.info(f"Connexion réinitialisée vers {url}, nouvelle tentative ({attempt}): {e}")
+
+
+def redact_secrets(value):
+    """Copie d'une structure JSON sans clés API ni mots de passe"""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED_VALUE if str(key).lower() in REDACTED_KEYS and val else redact_secrets(val)
+            for key, val in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact_secrets(item) for item in value]
+    if isinstance(value, str):
+        return _SECRET_RE.sub(REDACTED_VALUE, value)
+    return value
+
+
+def compress_log(value):
+    """Sérialise en JSON puis compresse (zlib, base64) un corps de requête ou de réponse"""
+    raw = json.dumps(value, default=str, separators=(',', ':')).encode()
+    return base64.b64encode(zlib.compress(raw, 6))
+
+
+def decompress_log(value):
+    """Inverse de compress_log"""
+    if not value:
+        return None
+    return json.loads(zlib.decompress(base64.b64decode(value)))
+
+
 class BaseService(models.AbstractModel):
     """Classe de base abstraite pour les services chatbot"""
     _name = 'base.service'
     _description = 'Service de base pour les intégrations chatbot'
     
     @api.model
-    def _make_api_request(self, url, headers, data, timeout=30):
+    def _get_http_pool_settings(self, config=None):
+        """Retourne (taille du pool, nombre de relances) pour une configuration"""
+        pool_size = DEFAULT_POOL_SIZE
+        max_retries = DEFAULT_MAX_RETRIES
+        if config:
+            pool_size = config.http_pool_size or DEFAULT_POOL_SIZE
+            max_retries = max(config.http_max_retries, 0)
+        return pool_size, max_retries
+
+    @api.model
+    def _get_async_runner(self, config=None):
+        """Boucle d'événements du worker si la configuration utilise le client asyncio, sinon None"""
+        if config and config.http_client == 'async':
+            return get_runner(config.async_max_connections)
+        return None
+
+    @api.model
+    def _get_http_session(self, url, pool_size=DEFAULT_POOL_SIZE):
+        """Retourne la session keep-alive du worker pour l'hôte de l'URL"""
+        return _get_pooled_session(url, pool_size)
+
+    @api.model
+    def _http_request(self, method, url, headers=None, json=None, timeout=30, config=None, **kwargs):
+        """Requête HTTP via le pool du worker.
+
+        Les erreurs de connexion (typiquement une connexion keep-alive fermée
+        par le serveur pendant son inactivité) sont relancées sur une nouvelle
+        connexion ; les timeouts ne le sont jamais.
+
+        Avec le client asyncio, la requête est confiée à la boucle d'événements
+        du worker et le thread appelant attend son résultat ; une réponse en
+        streaming est lue sur la boucle et consommée ligne à ligne.
+        """
+        runner = self._get_async_runner(config)
+        if runner:
+            if kwargs.get('stream'):
+                return runner.stream(method, url, headers=headers, json=json, timeout=timeout)
+            return runner.run(
+                runner.request(method, url, headers=headers, json=json, timeout=timeout),
+                timeout=timeout + 5
+            )
+        pool_size, max_retries = self._get_http_pool_settings(config)
+        return pooled_request(
+            method, url, pool_size=pool_size, max_retries=max_retries,
+            headers=headers, json=json, timeout=timeout, **kwargs
+        )
+
+    @api.model
+    def _http_post(self, url, headers=None, json=None, timeout=30, config=None, **kwargs):
+        """POST via le pool du worker"""
+        return self._http_request('POST', url, headers=headers, json=json, timeout=timeout, config=config, **kwargs)
+
+    @api.model
+    def get_http_pool_stats(self):
+        """Statistiques de réutilisation des pools HTTP du worker courant"""
+        hosts = []
+        with _POOL_LOCK:
+            stats = dict(_POOL_STATS, pid=_POOL_PID[0])
+            sessions = list(_POOL_SESSIONS.items())
+        for (scheme, netloc, pool_size), session in sessions:
+            requests_count = connections = 0
+            adapter = session.get_adapter(f"{scheme}://{netloc}")
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is not None:
+                    requests_count += pool.num_requests
+                    connections += pool.num_connections
+            hosts.append({
+                'host': f"{scheme}://{netloc}",
+                'pool_size': pool_size,
+                'requests': requests_count,
+                'connections_opened': connections,
+                'pool_hits': max(requests_count - connections, 0),
+                'pool_misses': connections,
+            })
+        stats['hosts'] = hosts
+        stats['pool_hits'] = sum(h['pool_hits'] for h in hosts)
+        stats['pool_misses'] = sum(h['pool_misses'] for h in hosts)
+        stats['async'] = get_runner_stats()
+        return stats
+
+    @api.model
+    def _make_api_request(self, url, headers, data, timeout=30, config=None):
         """Méthode commune pour faire des requêtes API"""
-        import requests
-        
-        try:
-            response = requests.post(
+        def send():
+            return self._http_post(
                 url,
                 headers=headers,
                 json=data,
-                timeout=timeout
+                timeout=timeout,
+                config=config
             )
+
+        try:
+            if config:
+                # Un disjoncteur par serveur distant, ex. mcp:https://mcp.example.com
+                response = self.env['chatbot.circuit.breaker'].sudo()._call(
+                    config, upstream_key(self._name.split('.')[0], url), send
+                )
+            else:
+                response = send()
             response.raise_for_status()
             return response.json()
+        except CircuitOpenError as e:
+            _logger.warning(f"Appel API à {url} non effectué: {e}")
+            return {"error": str(e)}
         except requests.exceptions.Timeout:
             _logger.error(f"Timeout lors de l'appel API à {url}")
             return {"error": "Timeout lors de l'appel API"}
@@ -37,6 +251,63 @@ class BaseService(models.AbstractModel):
             "Content-Type": content_type,
             "Authorization": f"Bearer {api_key}" if api_key else ""
         }
+
+    @api.model
+    def _get_log_values(self, config, request=None, response=None, success=True):
+        """Corps à journaliser selon le mode de journalisation de la configuration.
+
+        - full : JSON lisible dans request_data / response_data ;
+        - structured : corps compressés, blocs répétés (prompt système, outils)
+          remplacés par leur empreinte ; toutes les erreurs et un échantillon
+          des succès ;
+        - errors : corps des erreurs uniquement.
+
+        Les secrets sont masqués dans tous les modes.
+        """
+        mode = config.log_mode if config else 'structured'
+        if mode == 'full':
+            return {
+                'request_data': json.dumps(redact_secrets(request), indent=2, default=str) if request else False,
+                'response_data': json.dumps(redact_secrets(response), indent=2, default=str) if response else False,
+            }
+        if success and (mode == 'errors' or random.random() >= (config.log_sample_rate if config else 0.0)):
+            return {}
+        values = {}
+        if request:
+            values['request_body'] = compress_log(self._store_log_blocks(redact_secrets(request)))
+        if response:
+            values['response_body'] = compress_log(redact_secrets(response))
+        return values
+
+    @api.model
+    def _store_log_blocks(self, request):
+        """Remplace les blocs répétés de la requête par une référence à chatbot.log.blob"""
+        if not isinstance(request, dict):
+            return request
+        request = dict(request)
+        blobs = self.env['chatbot.log.blob'].sudo()
+        for key in LOG_BLOCK_KEYS:
+            if request.get(key):
+                request[key] = {'$ref': blobs._store(key, request[key])}
+        return request
+
+    @api.model
+    def _log_exchange(self, config, success, request=None, response=None, **values):
+        """Crée l'enregistrement de journal d'un échange (un seul INSERT, en fin d'échange)"""
+        values.update(self._get_log_values(config, request, response, success))
+        values['success'] = success
+        return self.sudo().create(values)
+
+    def get_log_bodies(self):
+        """Corps journalisés de l'enregistrement, décompressés et blocs résolus"""
+        self.ensure_one()
+        request = decompress_log(self.request_body)
+        if isinstance(request, dict):
+            blobs = self.env['chatbot.log.blob'].sudo()
+            for key in LOG_BLOCK_KEYS:
+                if isinstance(request.get(key), dict) and '$ref' in request[key]:
+                    request[key] = blobs._load(request[key]['$ref'])
+        return {'request': request, 'response': decompress_log(self.response_body)}
     
     @api.model
     def _log_api_call(self, service_name, user_input, response):
@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import string
+from odoo import models, fields, api
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools.safe_eval import safe_eval
+from .chatbot_config import CLAUDE_MODELS
+from .chatbot_session import estimate_tokens
+
+_logger = logging.getLogger(__name__)
+
+# Message Batches API limit
+MAX_BATCH_REQUESTS = 100000
+# Target records read, and results imported, per chunk
+BATCH_CHUNK_SIZE = 1000
+
+BATCH_SYSTEM_PROMPT = (
+    "You are an AI assistant integrated with Odoo ERP system, processing business records in bulk. "
+    "Each request is independent: answer with the requested output only, without greetings or comments."
+)
+
+
+class ChatbotBatchJob(models.Model):
+    """
+    Offline job answering many prompts through the Anthropic Message Batches API.
+
+    Prompts are built from the records of a model with a template, submitted
+    as a single batch, and the answers are written back to a field of the
+    records once the batch has ended (polled by a cron). Batched requests
+    are billed at half the price of interactive ones.
+    """
+
+    _name = 'chatbot.batch.job'
+    _description = 'Chatbot Batch Job'
+    _order = 'id desc'
+
+    name = fields.Char(
+        string='Name',
+        required=True
+    )
+
+    state = fields.Selection(
+        selection=[
+            ('draft', 'Draft'),
+            ('in_progress', 'In Progress'),
+            ('canceling', 'Canceling'),
+            ('importing', 'Importing Results'),
+            ('done', 'Done'),
+            ('canceled', 'Canceled'),
+        ],
+        string='Status',
+        default='draft',
+        required=True,
+        index=True
+    )
+
+    config_id = fields.Many2one(
+        'chatbot.config',
+        string='Configuration',
+        required=True,
+        ondelete='restrict',
+        default=lambda self: self.env['chatbot.config'].get_active_config()
+    )
+
+    model_name = fields.Selection(
+        selection=CLAUDE_MODELS,
+        string='Claude Model',
+        required=True,
+        default='claude-3-5-haiku-20241022'
+    )
+
+    temperature = fields.Float(
+        string='Temperature',
+        default=0.0
+    )
+
+    max_tokens = fields.Integer(
+        string='Max Tokens',
+        default=1024,
+        help='Maximum tokens of each answer'
+    )
+
+    instructions = fields.Text(
+        string='Instructions',
+        help='System instructions shared by every prompt of the job, e.g. '
+             '"Summarize the lead in 3 sentences for a sales manager."'
+    )
+
+    res_model = fields.Char(
+        string='Model',
+        help='Technical name of the records to process, e.g. crm.lead'
+    )
+
+    domain = fields.Char(
+        string='Domain',
+        default='[]',
+        help='Records of the model to process'
+    )
+
+    prompt_template = fields.Text(
+        string='Prompt Template',
+        help='Prompt of each record, with {field_name} placeholders, e.g. "Lead: {name}\\nNotes: {description}"'
+    )
+
+    result_field = fields.Char(
+        string='Result Field',
+        help='Text field of the records receiving the answers (leave empty to keep them on the job only)'
+    )
+
+    item_ids = fields.One2many(
+        'chatbot.batch.item',
+        'job_id',
+        string='Prompts'
+    )
+
+    item_count = fields.Integer(
+        string='Prompts',
+        compute='_compute_item_count'
+    )
+
+    batch_id = fields.Char(
+        string='Anthropic Batch ID',
+        readonly=True,
+        copy=False
+    )
+
+    results_url = fields.Char(
+        string='Results URL',
+        readonly=True,
+        copy=False
+    )
+
+    submitted_at = fields.Datetime(
+        string='Submitted At',
+        readonly=True,
+        copy=False
+    )
+
+    ended_at = fields.Datetime(
+        string='Ended At',
+        readonly=True,
+        copy=False
+    )
+
+    processing_count = fields.Integer(string='Processing', readonly=True, copy=False)
+    succeeded_count = fields.Integer(string='Succeeded', readonly=True, copy=False)
+    errored_count = fields.Integer(string='Errored', readonly=True, copy=False)
+    canceled_count = fields.Integer(string='Canceled', readonly=True, copy=False)
+    expired_count = fields.Integer(string='Expired', readonly=True, copy=False)
+
+    input_tokens = fields.Integer(
+        string='Input Tokens',
+        readonly=True,
+        copy=False
+    )
+
+    output_tokens = fields.Integer(
+        string='Output Tokens',
+        readonly=True,
+        copy=False
+    )
+
+    error_message = fields.Text(
+        string='Error',
+        readonly=True,
+        copy=False
+    )
+
+    def _compute_item_count(self):
+        counts = dict(self.env['chatbot.batch.item']._read_group(
+            [('job_id', 'in', self.ids)], ['job_id'], ['__count']
+        ))
+        for job in self:
+            job.item_count = counts.get(job, 0)
+
+    @api.constrains('res_model', 'result_field', 'prompt_template')
+    def _check_target(self):
+        """Validate the target model, result field and template placeholders."""
+        for job in self:
+            if not job.res_model:
+                continue
+            if job.res_model not in self.env:
+                raise ValidationError(f'Unknown model: {job.res_model}')
+            if job.result_field:
+                field = self.env[job.res_model]._fields.get(job.result_field)
+                if not field or field.type not in ('char', 'text', 'html'):
+                    raise ValidationError(f'{job.result_field} is not a text field of {job.res_model}')
+            job._get_template_fields()
+
+    @api.constrains('max_tokens', 'temperature')
+    def _check_generation(self):
+        """Validate the generation settings."""
+        for job in self:
+            if job.max_tokens < 1:
+                raise ValidationError('Max tokens must be at least 1')
+            if not 0 <= job.temperature <= 1:
+                raise ValidationError('Temperature must be between 0 and 1')
+
+    def _get_template_fields(self):
+        """
+        Fields used by the prompt template.
+
+        Only plain field names are accepted as placeholders, so a template
+        cannot reach anything but the values read from the records.
+        """
+        self.ensure_one()
+        model_fields = self.env[self.res_model]._fields
+        names = []
+        for _literal, name, _spec, _conversion in string.Formatter().parse(self.prompt_template or ''):
+            if name is None:
+                continue
+            if name not in model_fields:
+                raise ValidationError(f'Invalid placeholder {{{name}}}: not a field of {self.res_model}')
+            if name not in names:
+                names.append(name)
+        return names
+
+    @api.model
+    def _format_value(self, value):
+        """Template value of a field read with read()."""
+        if value is False or value is None:
+            return ''
+        if isinstance(value, tuple) and len(value) == 2:
+            # Many2one: (id, display name)
+            return value[1]
+        return value
+
+    def action_prepare(self):
+        """(Re)build the prompts of the job from the records of its model."""
+        for job in self:
+            if job.state != 'draft':
+                raise UserError('Only draft jobs can be prepared')
+            if not job.res_model or not job.prompt_template:
+                raise UserError('Set the model and the prompt template first')
+            names = job._get_template_fields()
+            job.item_ids.unlink()
+            records = self.env[job.res_model].search(safe_eval(job.domain or '[]'))
+            if len(records) > MAX_BATCH_REQUESTS:
+                raise UserError(f'A batch is limited to {MAX_BATCH_REQUESTS} prompts ({len(records)} records)')
+            for start in range(0, len(records), BATCH_CHUNK_SIZE):
+                chunk = records[start:start + BATCH_CHUNK_SIZE]
+                job.add_prompts([
+                    {
+                        'res_id': values['id'],
+                        'prompt': job.prompt_template.format_map({
+                            name: self._format_value(values[name]) for name in names
+                        }),
+                    }
+                    for values in chunk.read(names)
+                ])
+                chunk.invalidate_recordset()
+        return True
+
+    def add_prompts(self, prompts):
+        """
+        Add prompts to a draft job (programmatic use).
+
+        Args:
+            prompts: List of prompt strings, or of {'prompt', 'res_id'} dictionaries
+
+        Returns:
+            Created chatbot.batch.item records
+        """
+        self.ensure_one()
+        if self.state != 'draft':
+            raise UserError('Prompts can only be added to draft jobs')
+        return self.env['chatbot.batch.item'].create([
+            dict({'prompt': prompt} if isinstance(prompt, str) else prompt, job_id=self.id)
+            for prompt in prompts
+        ])
+
+    def _build_system_prompt(self):
+        """
+        System prompt shared by every request of the job, cached when prompt
+        caching is on and it is long enough for the model to cache it.
+        """
+        self.ensure_one()
+        text = BATCH_SYSTEM_PROMPT
+        if self.instructions:
+            text += f"\n\n{self.instructions}"
+        block = {'type': 'text', 'text': text}
+        minimum = self.env['anthropic.service']._get_min_cacheable_tokens(self.model_name)
+        if self.config_id.prompt_caching and estimate_tokens(text) >= minimum:
+            block['cache_control'] = {'type': 'ephemeral'}
+        return [block]
+
+    def action_submit(self):
+        """Submit the prompts of the job as one Message Batches API batch."""
+        service = self.env['anthropic.service']
+        for job in self:
+            if job.state != 'draft':
+                raise UserError('Only draft jobs can be submitted')
+            config = job.config_id.sudo()
+            items = job.item_ids
+            if not items:
+                raise UserError('The job has no prompts')
+            if len(items) > MAX_BATCH_REQUESTS:
+                raise UserError(f'A batch is limited to {MAX_BATCH_REQUESTS} prompts')
+            system_prompt = job._build_system_prompt()
+            requests_data = []
+            for item in items:
+                params = service._build_payload(
+                    [{'role': 'user', 'content': item.prompt}],
+                    job.model_name, job.temperature, job.max_tokens, system_prompt, []
+                )
+                requests_data.append({'custom_id': f'item-{item.id}', 'params': params})
+            response = service._http_post(
+                service._get_batches_url(config),
+                json={'requests': requests_data},
+                headers=service._get_api_headers(config),
+                timeout=120,
+                config=config
+            )
+            if response.status_code != 200:
+                raise UserError(f'API Error: {response.status_code} - {response.text}')
+            job.write(dict(
+                job._get_batch_values(response.json()),
+                state='in_progress',
+                submitted_at=fields.Datetime.now(),
+                error_message=False
+            ))
+        return True
+
+    def _get_batch_values(self, data):
+        """Job values of a Message Batches API batch object."""
+        counts = data.get('request_counts') or {}
+        return {
+            'batch_id': data.get('id'),
+            'results_url': data.get('results_url') or False,
+            'processing_count': counts.get('processing', 0),
+            'succeeded_count': counts.get('succeeded', 0),
+            'errored_count': counts.get('errored', 0),
+            'canceled_count': counts.get('canceled', 0),
+            'expired_count': counts.get('expired', 0),
+        }
+
+    def action_refresh(self):
+        """Poll the batch now (the cron does it periodically)."""
+        for job in self.filtered(lambda j: j.state in ('in_progress', 'canceling', 'importing')):
+            job._poll()
+        return True
+
+    def action_cancel(self):
+        """Cancel the job; answers already generated are still imported."""
+        service = self.env['anthropic.service']
+        for job in self:
+            if job.state == 'draft':
+                job.state = 'canceled'
+                continue
+            if job.state != 'in_progress':
+                raise UserError('Only draft or in progress jobs can be canceled')
+            config = job.config_id.sudo()
+            response = service._http_post(
+                f"{service._get_batches_url(config)}/{job.batch_id}/cancel",
+                headers=service._get_api_headers(config),
+                timeout=60,
+                config=config
+            )
+            if response.status_code != 200:
+                raise UserError(f'API Error: {response.status_code} - {response.text}')
+            job.write(dict(job._get_batch_values(response.json()), state='canceling'))
+        return True
+
+    def _fetch_batch_responses(self):
+        """
+        Fetch together the batch objects of the jobs using the asyncio HTTP client.
+
+        Returns:
+            Dictionary {job id: response, or the exception of the request}
+        """
+        service = self.env['anthropic.service']
+        runner = None
+        requests_by_job = {}
+        for job in self.filtered(lambda j: j.state in ('in_progress', 'canceling')):
+            config = job.config_id.sudo()
+            job_runner = service._get_async_runner(config)
+            if job_runner:
+                runner = job_runner
+                requests_by_job[job.id] = runner.request(
+                    'GET',
+                    f"{service._get_batches_url(config)}/{job.batch_id}",
+                    headers=service._get_api_headers(config),
+                    timeout=60
+                )
+        if not requests_by_job:
+            return {}
+        responses = runner.gather(list(requests_by_job.values()), 60)
+        return {
+            job_id: UserError('Batch status request timed out') if isinstance(response, asyncio.TimeoutError) else response
+            for job_id, response in zip(requests_by_job, responses)
+        }
+
+    def _poll(self, response=None):
+        """
+        Refresh the status of the batch, and import its results once it has ended.
+
+        Args:
+            response: Batch object response already fetched, requested when None
+        """
+        self.ensure_one()
+        if self.state in ('in_progress', 'canceling'):
+            service = self.env['anthropic.service']
+            config = self.config_id.sudo()
+            if isinstance(response, Exception):
+                raise response
+            if response is None:
+                response = service._http_request(
+                    'GET',
+                    f"{service._get_batches_url(config)}/{self.batch_id}",
+                    headers=service._get_api_headers(config),
+                    timeout=60,
+                    config=config
+                )
+            if response.status_code != 200:
+                raise UserError(f'API Error: {response.status_code} - {response.text}')
+            data = response.json()
+            values = self._get_batch_values(data)
+            if data.get('processing_status') == 'ended':
+                values.update(state='importing', ended_at=fields.Datetime.now())
+            self.write(values)
+        if self.state == 'importing':
+            self._import_results()
+
+    def _import_results(self):
+        """
+        Import the results file of an ended batch.
+
+        The file is streamed and imported in chunks, committed one by one
+        outside of tests: an interrupted import resumes where it stopped
+        since only pending prompts are updated.
+        """
+        self.ensure_one()
+        service = self.env['anthropic.service']
+        config = self.config_id.sudo()
+        if not self.results_url:
+            raise UserError('The batch has no results file')
+        response = service._http_request(
+            'GET',
+            self.results_url,
+            headers=service._get_api_headers(config),
+            timeout=300,
+            config=config,
+            stream=True
+        )
+        if response.status_code != 200:
+            raise UserError(f'API Error: {response.status_code} - {response.text}')
+        rows = []
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                rows.append(self._parse_result(json.loads(line)))
+                if len(rows) >= BATCH_CHUNK_SIZE:
+                    self._save_results(rows)
+                    rows = []
+        if rows:
+            self._save_results(rows)
+
+        self.env.cr.execute("""
+            SELECT COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0)
+              FROM chatbot_batch_item
+             WHERE job_id = %s
+        """, (self.id,))
+        input_tokens, output_tokens = self.env.cr.fetchone()
+        self.write({
+            'state': 'canceled' if self.canceled_count and not self.succeeded_count else 'done',
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+        })
+        _logger.info(f"Chatbot batch job {self.id} imported ({self.succeeded_count} answers)")
+
+    @api.model
+    def _parse_result(self, line):
+        """
+        Item values of a line of a results file.
+
+        Returns:
+            Tuple (item id, state, response, error message, input tokens, output tokens)
+        """
+        item_id = int(str(line.get('custom_id', '')).rsplit('-', 1)[-1])
+        result = line.get('result') or {}
+        result_type = result.get('type')
+        if result_type == 'succeeded':
+            message = result.get('message') or {}
+            usage = message.get('usage') or {}
+            text = ''.join(
+                block.get('text', '') for block in message.get('content', []) if block.get('type') == 'text'
+            )
+            input_tokens = (
+                usage.get('input_tokens', 0)
+                + usage.get('cache_creation_input_tokens', 0)
+                + usage.get('cache_read_input_tokens', 0)
+            )
+            return item_id, 'succeeded', text, None, input_tokens, usage.get('output_tokens', 0)
+        error = ((result.get('error') or {}).get('error') or result.get('error') or {}).get('message')
+        state = result_type if result_type in ('errored', 'canceled', 'expired') else 'errored'
+        return item_id, state, None, error or state, 0, 0
+
+    def _save_results(self, rows):
+        """Write a chunk of results to the pending prompts, then to the target records."""
+        self.ensure_one()
+        item_ids, states, responses, errors, input_tokens, output_tokens = map(list, zip(*rows))
+        self.env['chatbot.batch.item'].flush_model()
+        self.env.cr.execute("""
+            UPDATE chatbot_batch_item AS item
+               SET state = v.state, response = v.response, error_message = v.error_message,
+                   input_tokens = v.input_tokens, output_tokens = v.output_tokens
+              FROM unnest(%s::int[], %s::varchar[], %s::text[], %s::varchar[], %s::int[], %s::int[])
+                   AS v(id, state, response, error_message, input_tokens, output_tokens)
+             WHERE item.id = v.id AND item.job_id = %s AND item.state = 'pending'
+         RETURNING item.id
+        """, (item_ids, states, responses, errors, input_tokens, output_tokens, self.id))
+        updated = {item_id for (item_id,) in self.env.cr.fetchall()}
+        self.env['chatbot.batch.item'].invalidate_model()
+
+        if self.res_model and self.result_field and updated:
+            by_record = {}
+            for item in self.env['chatbot.batch.item'].browse(sorted(updated)):
+                if item.state == 'succeeded' and item.res_id:
+                    by_record[item.res_id] = item.response
+            targets = self.env[self.res_model].browse(list(by_record)).exists()
+            for record in targets:
+                record.write({self.result_field: by_record[record.id]})
+            targets.flush_recordset()
+        self._commit()
+
+    @api.model
+    def _commit(self):
+        """Commit an imported chunk, except in tests where the transaction is shared."""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _cron_poll_batches(self):
+        """Poll the submitted jobs and import the results of the ended ones."""
+        jobs = self.search([('state', 'in', ('in_progress', 'canceling', 'importing'))])
+        # Statuses of the asyncio configurations are requested all at once
+        try:
+            responses = jobs._fetch_batch_responses()
+        except Exception as e:
+            _logger.warning(f"Chatbot batch statuses not prefetched: {e}")
+            responses = {}
+        for job in jobs:
+            try:
+                job._poll(responses.get(job.id))
+            except Exception as e:
+                _logger.error(f"Chatbot batch job {job.id} poll failed: {e}")
+                self.env.cr.rollback()
+                job.write({'error_message': str(e)})
+            self._commit()
+        return len(jobs)
+
+
+class ChatbotBatchItem(models.Model):
+    """Prompt of a batch job and its answer."""
+
+    _name = 'chatbot.batch.item'
+    _description = 'Chatbot Batch Prompt'
+    _order = 'id'
+    _log_access = False
+
+    job_id = fields.Many2one(
+        'chatbot.batch.job',
+        string='Job',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+
+    res_id = fields.Integer(
+        string='Record ID',
+        help='Record of the job model receiving the answer'
+    )
+
+    prompt = fields.Text(
+        string='Prompt',
+        required=True
+    )
+
+    state = fields.Selection(
+        selection=[
+            ('pending', 'Pending'),
+            ('succeeded', 'Succeeded'),
+            ('errored', 'Errored'),
+            ('canceled', 'Canceled'),
+            ('expired', 'Expired'),
+        ],
+        string='Status',
+        default='pending',
+        required=True
+    )
+
+    response = fields.Text(
+        string='Response'
+    )
+
+    error_message = fields.Char(
+        string='Error'
+    )
+
+    input_tokens = fields.Integer(
+        string='Input Tokens'
+    )
+
+    output_tokens = fields.Integer(
+        string='Output Tokens'
+    )
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ChatbotCacheValidity(models.AbstractModel):
+    """
+    Read-time validity of the cached answers and tool results.
+
+    A cache entry records, for each Odoo model its content was read from, a
+    change stamp of the model's table: the number of rows inserted, updated
+    and deleted according to the PostgreSQL statistics. The entry is only
+    served while these stamps are unchanged, so a change made by any worker
+    invalidates it without the writing transaction touching the caches.
+
+    The statistics are published by PostgreSQL shortly after the commit of
+    a change (usually within a second, at most about ten seconds): that is
+    the staleness window, on top of which the entry TTL still applies. The
+    uncommitted changes of the current transaction are counted too. With
+    track_counts disabled the stamps never change and only the TTL applies.
+    """
+
+    _name = 'chatbot.cache.validity'
+    _description = 'Chatbot Cache Validity'
+
+    @api.model
+    def _get_stamps(self, model_names):
+        """
+        Change stamps of the tables of the given models.
+
+        Models without a local table (read through the MCP server only) are
+        not stamped.
+
+        Returns:
+            Dictionary {model name: stamp}
+        """
+        tables = {}
+        for name in model_names or ():
+            model = self.env.get(name)
+            if model is not None and not model._abstract and model._auto:
+                model.flush_model()
+                tables[name] = model._table
+        if not tables:
+            return {}
+        self.env.cr.execute("""
+            SELECT t.name,
+                   COALESCE(pg_stat_get_tuples_inserted(c.oid) + pg_stat_get_tuples_updated(c.oid)
+                            + pg_stat_get_tuples_deleted(c.oid) + pg_stat_get_xact_tuples_inserted(c.oid)
+                            + pg_stat_get_xact_tuples_updated(c.oid) + pg_stat_get_xact_tuples_deleted(c.oid), 0)
+              FROM unnest(%s::text[], %s::text[]) AS t(name, tablename)
+              LEFT JOIN pg_class c ON c.oid = to_regclass(t.tablename)
+        """, (list(tables), list(tables.values())))
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _dump(self, model_names):
+        """Stamps of the given models, serialized to be stored on a cache entry."""
+        return json.dumps(self._get_stamps(model_names), sort_keys=True)
+
+    @api.model
+    def _is_valid(self, stamps):
+        """
+        Whether none of the models of a serialized stamp set changed since.
+
+        Args:
+            stamps: Value returned by _dump when the entry was stored (empty
+                for entries read from no Odoo model)
+        """
+        stamps = json.loads(stamps) if stamps else {}
+        if not stamps:
+            return True
+        return self._get_stamps(list(stamps)) == stamps
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Seconds between two reads of the states published by the other workers
+SYNC_INTERVAL = 5.0
+
+DEFAULT_SETTINGS = {
+    'failure_rate': 0.5,
+    'slow_call_seconds': 15.0,
+    'slow_rate': 0.5,
+    'min_calls': 5,
+    'window': 60,
+    'open_seconds': 30,
+}
+
+
+class CircuitOpenError(UserError):
+    """Raised without calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def upstream_key(kind, url):
+    """Circuit breaker key of a remote server, e.g. mcp:https://mcp.example.com"""
+    parts = urlsplit(url)
+    return f'{kind}:{parts.scheme}://{parts.netloc}'
+
+
+def is_upstream_failure(status_code):
+    """Whether an HTTP status means the upstream is failing (not the request)."""
+    return status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream in this worker.
+
+    Closed: calls go through and their outcome is kept for a sliding window.
+    When enough calls failed, or were slower than the slow call threshold,
+    the circuit opens and calls fail immediately. Once the open delay has
+    elapsed, one probe call is let through (half-open): its success closes
+    the circuit, its failure opens it again.
+
+    Thread-safe and without ORM access, so it can guard the calls made from
+    tool execution threads. Opening and closing are published to the
+    chatbot.circuit.breaker table by the request thread.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.changed_at = 0.0
+        self.last_error = ''
+        self.dirty = False
+        self.synced_at = 0.0
+        self._probing = False
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _open(self, now, error=''):
+        self.state = OPEN
+        self.open_until = now + self.settings['open_seconds']
+        self.changed_at = now
+        self.last_error = error or self.last_error
+        self.dirty = True
+        self._probing = False
+        self._calls.clear()
+        _logger.warning(f"Circuit breaker {self.key} opened for {self.settings['open_seconds']}s: {self.last_error}")
+
+    def _close(self, now):
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.changed_at = now
+        self.dirty = True
+        self._probing = False
+        self._calls.clear()
+        _logger.info(f"Circuit breaker {self.key} closed")
+
+    def retry_after(self):
+        """Seconds before a call can be admitted, 0 when it would be right now."""
+        with self._lock:
+            if self.state == OPEN:
+                return max(self.open_until - time.time(), 0.0)
+            return 1.0 if self.state == HALF_OPEN and self._probing else 0.0
+
+    def is_open(self):
+        """Whether a call would be rejected right now."""
+        return self.retry_after() > 0
+
+    def before_call(self):
+        """
+        Admit a call, or fail fast.
+
+        Raises:
+            CircuitOpenError: while the circuit is open or its probe call is running
+        """
+        with self._lock:
+            now = time.time()
+            if self.state == OPEN:
+                if now < self.open_until:
+                    retry_after = self.open_until - now
+                    raise CircuitOpenError(
+                        f'{self.key} is unavailable, please retry in {math.ceil(retry_after)} seconds',
+                        retry_after
+                    )
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(f'{self.key} is recovering, please retry in a moment', 1.0)
+                self._probing = True
+
+    def record(self, success, duration, error=''):
+        """Account the outcome of an admitted call (duration in seconds)."""
+        with self._lock:
+            now = time.time()
+            slow = duration >= self.settings['slow_call_seconds']
+            if not success or slow:
+                self.last_error = error or f'slow call ({duration:.1f}s)'
+            if self.state == HALF_OPEN:
+                if success and not slow:
+                    self._close(now)
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            self._calls.append((now, not success, slow))
+            while self._calls and self._calls[0][0] < now - self.settings['window']:
+                self._calls.popleft()
+            count = len(self._calls)
+            if count < self.settings['min_calls']:
+                return
+            failures = sum(1 for _t, failed, _slow in self._calls if failed)
+            slow_calls = sum(1 for _t, _failed, slow in self._calls if slow)
+            if failures / count >= self.settings['failure_rate'] or slow_calls / count >= self.settings['slow_rate']:
+                self._open(now)
+
+    def call(self, func):
+        """Run an HTTP call through the breaker; func returns a requests response."""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            response = func()
+        except requests.exceptions.RequestException as e:
+            self.record(False, time.monotonic() - start, str(e))
+            raise
+        except Exception:
+            # Not an upstream failure, but the call (and a probe) is over
+            self.record(True, time.monotonic() - start)
+            raise
+        self.record(
+            not is_upstream_failure(response.status_code),
+            time.monotonic() - start,
+            f'HTTP {response.status_code}'
+        )
+        return response
+
+    async def acall(self, func):
+        """Same as call, for a coroutine function run on the event loop."""
+        self.before_call()
+        start = time.monotonic()
+        try:
+            response = await func()
+        except requests.exceptions.RequestException as e:
+            self.record(False, time.monotonic() - start, str(e))
+            raise
+        except asyncio.CancelledError:
+            # Cancelled by the caller's deadline: a timeout of the upstream
+            self.record(False, time.monotonic() - start, 'timed out')
+            raise
+        except Exception:
+            self.record(True, time.monotonic() - start)
+            raise
+        self.record(
+            not is_upstream_failure(response.status_code),
+            time.monotonic() - start,
+            f'HTTP {response.status_code}'
+        )
+        return response
+
+    def snapshot(self):
+        """Values to publish after a state change, None when already published."""
+        with self._lock:
+            if not self.dirty:
+                return None
+            self.dirty = False
+            return {
+                'state': self.state,
+                'open_until': self.open_until,
+                'changed_at': self.changed_at,
+                'last_error': (self.last_error or '')[:500],
+            }
+
+    def apply_remote(self, state, open_until, changed_at):
+        """Adopt a state published by another worker, when more recent than ours."""
+        with self._lock:
+            if changed_at <= self.changed_at:
+                return
+            self.state = state if state in (OPEN, CLOSED) else CLOSED
+            self.open_until = open_until or 0.0
+            self.changed_at = changed_at
+            self._probing = False
+            self._calls.clear()
+
+
+_BREAKERS_LOCK = threading.Lock()
+_BREAKERS = {}
+_BREAKERS_PID = [None]
+
+
+def get_breaker(key):
+    """Circuit breaker of an upstream in this worker."""
+    with _BREAKERS_LOCK:
+        if _BREAKERS_PID[0] != os.getpid():
+            # Forked worker: start from a blank state, synced from the database
+            _BREAKERS.clear()
+            _BREAKERS_PID[0] = os.getpid()
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            breaker = _BREAKERS[key] = CircuitBreaker(key)
+        return breaker
+
+
+class ChatbotCircuitBreaker(models.Model):
+    """
+    Circuit breaker states shared by the workers.
+
+    Each worker decides from its own calls and publishes the opening and
+    closing of a circuit here; the others read the table every few seconds,
+    so an upstream found down by one worker is skipped by all of them
+    instead of each waiting for its own timeouts.
+    """
+
+    _name = 'chatbot.circuit.breaker'
+    _description = 'Chatbot Circuit Breaker'
+    _rec_name = 'upstream'
+    _order = 'upstream'
+    _log_access = False
+
+    upstream = fields.Char(
+        string='Upstream',
+        required=True,
+        index=True,
+        help='anthropic:<model> or mcp:<server URL>'
+    )
+
+    state = fields.Selection(
+        selection=[
+            (CLOSED, 'Closed'),
+            (OPEN, 'Open'),
+        ],
+        string='State',
+        default=CLOSED,
+        required=True
+    )
+
+    open_until = fields.Float(
+        string='Open Until',
+        help='Epoch time after which a probe call is let through'
+    )
+
+    changed_at = fields.Float(
+        string='Changed At',
+        help='Epoch time of the last state change'
+    )
+
+    last_error = fields.Char(
+        string='Last Error'
+    )
+
+    _sql_constraints = [
+        ('upstream_uniq', 'unique(upstream)', 'A circuit breaker already exists for this upstream.'),
+    ]
+
+    @api.model
+    def _get_settings(self, config):
+        """Thresholds of a configuration."""
+        return {
+            'failure_rate': config.breaker_failure_rate,
+            'slow_call_seconds': config.breaker_slow_call_seconds or DEFAULT_SETTINGS['slow_call_seconds'],
+            'slow_rate': config.breaker_slow_rate,
+            'min_calls': max(config.breaker_min_calls, 1),
+            'window': config.breaker_window_seconds or DEFAULT_SETTINGS['window'],
+            'open_seconds': config.breaker_open_seconds or DEFAULT_SETTINGS['open_seconds'],
+        }
+
+    @api.model
+    def _get(self, config, key):
+        """
+        Circuit breaker of an upstream, refreshed from the other workers when stale.
+
+        Returns:
+            CircuitBreaker, or None when circuit breaking is disabled
+        """
+        if not config.circuit_breaker_enabled:
+            return None
+        breaker = get_breaker(key)
+        breaker.settings = self._get_settings(config)
+        if time.time() - breaker.synced_at >= SYNC_INTERVAL:
+            self._sync([breaker])
+        return breaker
+
+    @api.model
+    def _sync(self, breakers):
+        """
+        Publish the state changes of breakers and read the ones of the other workers.
+
+        Runs in its own short transaction: the state of an upstream must be
+        published even when the failing request is rolled back.
+        """
+        if not breakers:
+            return
+        try:
+            with Registry(self.env.cr.dbname).cursor() as cr:
+                for breaker in breakers:
+                    values = breaker.snapshot()
+                    if values:
+                        cr.execute("""
+                            INSERT INTO chatbot_circuit_breaker (upstream, state, open_until, changed_at, last_error)
+                            VALUES (%(upstream)s, %(state)s, %(open_until)s, %(changed_at)s, %(last_error)s)
+                            ON CONFLICT (upstream) DO UPDATE
+                               SET state = EXCLUDED.state, open_until = EXCLUDED.open_until,
+                                   changed_at = EXCLUDED.changed_at, last_error = EXCLUDED.last_error
+                             WHERE chatbot_circuit_breaker.changed_at < EXCLUDED.changed_at
+                        """, dict(values, upstream=breaker.key))
+                by_key = {breaker.key: breaker for breaker in breakers}
+                cr.execute("""
+                    SELECT upstream, state, open_until, changed_at
+                      FROM chatbot_circuit_breaker
+                     WHERE upstream IN %s
+                """, (tuple(by_key),))
+                for upstream, state, open_until, changed_at in cr.fetchall():
+                    by_key[upstream].apply_remote(state, open_until, changed_at or 0.0)
+        except Exception as e:
+            _logger.warning(f"Chatbot circuit breaker sync failed: {e}")
+        now = time.time()
+        for breaker in breakers:
+            breaker.synced_at = now
+
+    @api.model
+    def _call(self, config, key, func):
+        """
+        Run an HTTP call through the circuit breaker of an upstream.
+
+        Args:
+            config: Active chatbot.config
+            key: Upstream key (see upstream_key)
+            func: Callable doing the request and returning the response
+
+        Returns:
+            The response
+
+        Raises:
+            CircuitOpenError: when the circuit is open (func is not called)
+        """
+        breaker = self._get(config, key)
+        if breaker is None:
+            return func()
+        try:
+            return breaker.call(func)
+        finally:
+            if breaker.dirty:
+                self._sync([breaker])
+
+    @api.model
+    def _publish(self, keys):
+        """Publish the state changes made by calls run outside of the request thread."""
+        self._sync([breaker for breaker in map(get_breaker, set(keys)) if breaker.dirty])
+
+    @api.model
+    def _route_model(self, config, model):
+        """
+        Model to send the next Anthropic call to.
+
+        When the circuit of the requested model is open (failing or too slow)
+        and a fallback model is configured, the call is downgraded to it.
+
+        Returns:
+            Model name
+        """
+        fallback = config.fallback_model
+        if not (config.circuit_breaker_enabled and config.fallback_model_enabled and fallback and fallback != model):
+            return model
+        if self._get(config, f'anthropic:{model}').is_open():
+            _logger.info(f"Chatbot model {model} unavailable, falling back to {fallback}")
+            return fallback
+        return model
+
+    @api.model
+    def _get_anthropic_wait(self, config):
+        """
+        Seconds before the configured model (or its fallback) can be called.
+
+        Returns:
+            0 when a call would be admitted right now
+        """
+        model = self._route_model(config, config.model_name)
+        breaker = self._get(config, f'anthropic:{model}')
+        return breaker.retry_after() if breaker else 0.0
+
+    def action_reset(self):
+        """Close the selected circuits in every worker."""
+        now = time.time()
+        self.write({'state': CLOSED, 'open_until': 0.0, 'changed_at': now})
+        return True
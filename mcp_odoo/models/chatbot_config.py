@@ -1,11 +1,21 @@
 # -*- coding: utf-8 -*-
 import logging
+import math
 import requests
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.exceptions import ValidationError, UserError
+from .chatbot_rate_limit import RateLimitError
 
 _logger = logging.getLogger(__name__)
 
+CLAUDE_MODELS = [
+    ('claude-3-5-sonnet-20241022', 'Claude 3.5 Sonnet (Recommended)'),
+    ('claude-3-5-haiku-20241022', 'Claude 3.5 Haiku (Fast)'),
+    ('claude-3-opus-20240229', 'Claude 3 Opus (Powerful)'),
+    ('claude-3-sonnet-20240229', 'Claude 3 Sonnet'),
+    ('claude-3-haiku-20240307', 'Claude 3 Haiku'),
+]
+
 
 class ChatbotConfig(models.Model):
     """Configuration model for Anthropic chatbot integration."""
@@ -21,6 +31,14 @@ class ChatbotConfig(models.Model):
         default='MCP Configuration'
     )
     
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+        index=True,
+        help='Company using this configuration; leave empty to share it with every company '
+             'that has no configuration of its own'
+    )
+    
     # API Configuration
     api_key = fields.Char(
         string='Anthropic API Key',
@@ -29,6 +47,13 @@ class ChatbotConfig(models.Model):
         help='Your Anthropic API key (starts with sk-ant-)'
     )
     
+    anthropic_api_url = fields.Char(
+        string='Anthropic API URL',
+        default='https://api.anthropic.com',
+        groups='base.group_system',
+        help='Base URL of the Anthropic API; only change it to target a proxy or a local benchmark server'
+    )
+    
     # MCP Server Configuration
     mcp_server_url = fields.Char(
         string='MCP Server URL',
@@ -66,13 +91,7 @@ class ChatbotConfig(models.Model):
     )
     
     model_name = fields.Selection(
-        selection=[
-            ('claude-3-5-sonnet-20241022', 'Claude 3.5 Sonnet (Recommended)'),
-            ('claude-3-5-haiku-20241022', 'Claude 3.5 Haiku (Fast)'),
-            ('claude-3-opus-20240229', 'Claude 3 Opus (Powerful)'),
-            ('claude-3-sonnet-20240229', 'Claude 3 Sonnet'),
-            ('claude-3-haiku-20240307', 'Claude 3 Haiku'),
-        ],
+        selection=CLAUDE_MODELS,
         string='Model',
         default='claude-3-5-sonnet-20241022',
         required=True,
@@ -98,6 +117,306 @@ class ChatbotConfig(models.Model):
         help='Timeout for API requests in seconds'
     )
     
+    # Request Processing
+    processing_mode = fields.Selection(
+        selection=[
+            ('sync', 'Synchronous'),
+            ('queued', 'Queued (Background)'),
+        ],
+        string='Processing Mode',
+        default='sync',
+        required=True,
+        help='Queued: messages are answered by a background runner and the HTTP worker is released immediately'
+    )
+    
+    queue_concurrency = fields.Integer(
+        string='Queue Concurrency',
+        default=4,
+        help='Number of queued messages processed in parallel by the background runner'
+    )
+    
+    # Prompt Caching
+    prompt_caching = fields.Boolean(
+        string='Prompt Caching',
+        default=True,
+        help='Mark the static system prompt and the tool schemas as cacheable by Anthropic'
+    )
+    
+    prompt_cache_hit_ratio = fields.Float(
+        string='Prompt Cache Hit Ratio',
+        compute='_compute_prompt_cache_hit_ratio',
+        help='Share of today\'s input tokens read from the Anthropic prompt cache'
+    )
+    
+    # Response Cache
+    response_cache_enabled = fields.Boolean(
+        string='Response Cache',
+        default=True,
+        help='Serve repeated questions from the response cache instead of calling Anthropic'
+    )
+    
+    response_cache_scope = fields.Selection(
+        selection=[
+            ('user', 'Per User'),
+            ('company', 'Per Company'),
+        ],
+        string='Cache Sharing',
+        default='user',
+        required=True,
+        help='Share cached answers between the users of a company, or keep them per user. '
+             'Answers are only shared when no tool is available (ORM backend or connected MCP server): '
+             'tool results depend on the access rights of the asker, so answers stay per user then, '
+             'at the cost of a lower hit rate'
+    )
+    
+    response_cache_ttl = fields.Integer(
+        string='Cache TTL (seconds)',
+        default=3600,
+        help='How long a cached answer stays valid'
+    )
+    
+    response_cache_max_entries = fields.Integer(
+        string='Cache Max Entries',
+        default=1000,
+        help='Least recently used answers are evicted beyond this number'
+    )
+    
+    response_cache_similarity = fields.Float(
+        string='Cache Similarity Threshold',
+        default=0.0,
+        help='Minimum trigram similarity (0-1) to reuse the answer of a close question (0 = exact match only)'
+    )
+    
+    # Conversation History
+    history_token_budget = fields.Integer(
+        string='History Token Budget',
+        default=4000,
+        help='Estimated tokens of earlier session turns replayed with each question (0 = single-turn)'
+    )
+    
+    summary_model = fields.Selection(
+        selection=CLAUDE_MODELS,
+        string='Summary Model',
+        default='claude-3-5-haiku-20241022',
+        required=True,
+        help='Model used to summarize the turns that no longer fit in the history budget'
+    )
+    
+    summary_max_tokens = fields.Integer(
+        string='Summary Max Tokens',
+        default=500,
+        help='Maximum size of the stored conversation summary'
+    )
+    
+    # Agent Loop
+    max_agent_turns = fields.Integer(
+        string='Max Agent Turns',
+        default=5,
+        help='Maximum number of model calls (tool hops included) for a single question'
+    )
+    
+    max_total_tokens = fields.Integer(
+        string='Max Total Tokens',
+        default=50000,
+        help='Input + output token budget for all the hops of a single question (0 = unlimited)'
+    )
+    
+    # Tool Execution
+    tool_backend = fields.Selection(
+        selection=[
+            ('mcp', 'Remote MCP Server'),
+            ('orm', 'In-Process (ORM)'),
+        ],
+        string='Tool Backend',
+        default='mcp',
+        required=True,
+        help='In-Process runs search/read tools directly in this database with the access rights of the '
+             'requesting user; models not installed here still go to the MCP server when it is connected'
+    )
+    
+    max_tool_concurrency = fields.Integer(
+        string='Max Tool Concurrency',
+        default=4,
+        help='Maximum number of tool calls of a single assistant turn executed in parallel (1 = sequential)'
+    )
+    
+    tool_timeout = fields.Integer(
+        string='Tool Timeout (seconds)',
+        default=30,
+        help='Timeout applied to each tool call sent to the MCP server'
+    )
+    
+    # Tool Result Cache
+    tool_cache_enabled = fields.Boolean(
+        string='Tool Result Cache',
+        default=True,
+        help='Reuse the result of identical tool calls for a short time instead of querying the MCP server again'
+    )
+    
+    tool_cache_ttl = fields.Integer(
+        string='Tool Cache TTL (seconds)',
+        default=30,
+        help='How long a tool result stays valid'
+    )
+    
+    tool_cache_max_entries = fields.Integer(
+        string='Tool Cache Max Entries',
+        default=500,
+        help='Maximum number of tool results kept in memory by each worker'
+    )
+    
+    tool_cache_db = fields.Boolean(
+        string='Share Tool Cache Between Workers',
+        default=False,
+        help='Also store tool results in the database so that every worker can reuse them'
+    )
+    
+    # HTTP Connection Pool
+    http_pool_size = fields.Integer(
+        string='HTTP Pool Size',
+        default=10,
+        help='Maximum number of keep-alive connections kept per remote host and per worker'
+    )
+    
+    http_max_retries = fields.Integer(
+        string='HTTP Retries on Reset',
+        default=1,
+        help='Number of times a request is retried on a connection error. POST requests are only retried when the connection could not be opened, as the server may have processed them (timeouts are never retried)'
+    )
+    
+    http_client = fields.Selection(
+        selection=[
+            ('sync', 'Blocking (requests)'),
+            ('async', 'Asyncio'),
+        ],
+        string='HTTP Client',
+        default='sync',
+        help='Asyncio: the upstream calls run on an event loop per worker, so tool calls, '
+             'batch polls and streamed answers are in flight together without a thread each'
+    )
+    
+    async_max_connections = fields.Integer(
+        string='Async Max Connections',
+        default=32,
+        help='Maximum number of connections opened by the event loop of a worker (asyncio client only)'
+    )
+    
+    # API Logging
+    log_mode = fields.Selection(
+        selection=[
+            ('structured', 'Structured (compressed, sampled)'),
+            ('errors', 'Errors Only'),
+            ('full', 'Full Text'),
+        ],
+        string='API Log Mode',
+        default='structured',
+        required=True,
+        help='Structured: request/response bodies are compressed, the system prompt and tool schemas are '
+             'stored once, bodies are kept for every error and a sample of successful calls. '
+             'Secrets are always redacted.'
+    )
+    
+    log_sample_rate = fields.Float(
+        string='Successful Calls Logged',
+        default=0.01,
+        help='Fraction (0-1) of successful calls whose bodies are logged in structured mode'
+    )
+    
+    # Tracing
+    tracing_enabled = fields.Boolean(
+        string='Latency Tracing',
+        default=True,
+        help='Record the duration of each phase of every chatbot request (config, prompt, Anthropic hops, tools, DB writes)'
+    )
+    
+    trace_export_path = fields.Char(
+        string='Trace Export File',
+        groups='base.group_system',
+        help='Also append the traces to this server file in the OpenTelemetry OTLP/JSON lines format'
+    )
+    
+    latency_p50 = fields.Float(
+        string='Latency p50 (ms)',
+        compute='_compute_latency_percentiles'
+    )
+    
+    latency_p95 = fields.Float(
+        string='Latency p95 (ms)',
+        compute='_compute_latency_percentiles'
+    )
+    
+    latency_p99 = fields.Float(
+        string='Latency p99 (ms)',
+        compute='_compute_latency_percentiles'
+    )
+    
+    # Usage statistics (last 30 days, every user)
+    stat_message_count = fields.Integer(
+        string='Messages (30 days)',
+        compute='_compute_usage_statistics'
+    )
+    
+    stat_success_rate = fields.Float(
+        string='Success Rate (30 days)',
+        compute='_compute_usage_statistics'
+    )
+    
+    stat_avg_response_time = fields.Float(
+        string='Average Response Time (s, 30 days)',
+        compute='_compute_usage_statistics'
+    )
+    
+    stat_session_count = fields.Integer(
+        string='Conversations (30 days)',
+        compute='_compute_usage_statistics'
+    )
+    
+    stat_token_count = fields.Integer(
+        string='Tokens (30 days)',
+        compute='_compute_usage_statistics'
+    )
+    
+    # Data Retention
+    retention_message_days = fields.Integer(
+        string='Keep Messages (days)',
+        default=0,
+        help='Conversation messages older than this are deleted automatically (0 = keep forever)'
+    )
+    
+    retention_service_log_days = fields.Integer(
+        string='Keep API Logs (days)',
+        default=7,
+        help='Anthropic and MCP request logs older than this are deleted automatically (0 = keep forever)'
+    )
+    
+    retention_batch_size = fields.Integer(
+        string='Deletion Batch Size',
+        default=1000,
+        help='Records deleted per transaction by the retention job'
+    )
+    
+    retention_archive = fields.Boolean(
+        string='Archive Before Deletion',
+        default=False,
+        help='Export aged records to gzip compressed JSON lines files before deleting them'
+    )
+    
+    retention_archive_path = fields.Char(
+        string='Archive Directory',
+        groups='base.group_system',
+        help='Server directory of the archive files (default: mcp_odoo_archive in the filestore)'
+    )
+    
+    last_retention_date = fields.Datetime(
+        string='Last Retention Run',
+        readonly=True
+    )
+    
+    last_retention_result = fields.Text(
+        string='Last Retention Result',
+        readonly=True
+    )
+    
     # System Settings
     active = fields.Boolean(
         string='Active',
@@ -129,23 +448,195 @@ class ChatbotConfig(models.Model):
         help='Maximum messages per day (0 = unlimited)'
     )
     
+    daily_user_message_limit = fields.Integer(
+        string='Daily Message Limit per User',
+        default=0,
+        help='Maximum messages per day and per user (0 = unlimited)'
+    )
+    
+    # Rate Limiting
+    rate_limit_enabled = fields.Boolean(
+        string='Rate Limiting',
+        default=False,
+        help='Limit the requests and Anthropic tokens per minute of each user, company and of the whole database'
+    )
+    
+    rate_limit_policy = fields.Selection(
+        selection=[
+            ('reject', 'Reject (HTTP 429)'),
+            ('queue', 'Queue Until Allowed'),
+        ],
+        string='When Limited',
+        default='reject',
+        required=True,
+        help='Reject over-limit requests, or hand them to the background runner which sends them once allowed'
+    )
+    
+    rate_user_req_per_minute = fields.Integer(
+        string='User Requests / Minute',
+        default=0,
+        help='0 = unlimited'
+    )
+    
+    rate_user_tok_per_minute = fields.Integer(
+        string='User Tokens / Minute',
+        default=0,
+        help='Anthropic input + output tokens (0 = unlimited)'
+    )
+    
+    rate_company_req_per_minute = fields.Integer(
+        string='Company Requests / Minute',
+        default=0,
+        help='0 = unlimited'
+    )
+    
+    rate_company_tok_per_minute = fields.Integer(
+        string='Company Tokens / Minute',
+        default=0,
+        help='Anthropic input + output tokens (0 = unlimited)'
+    )
+    
+    rate_global_req_per_minute = fields.Integer(
+        string='Global Requests / Minute',
+        default=0,
+        help='0 = unlimited'
+    )
+    
+    rate_global_tok_per_minute = fields.Integer(
+        string='Global Tokens / Minute',
+        default=0,
+        help='Anthropic input + output tokens (0 = unlimited)'
+    )
+    
+    # Request Coalescing
+    request_coalescing = fields.Boolean(
+        string='Request Coalescing',
+        default=True,
+        help='With a temperature of 0, identical questions asked while one is being answered wait for its '
+             'answer instead of calling Anthropic again'
+    )
+    
+    coalescing_across_workers = fields.Boolean(
+        string='Coalesce Across Workers',
+        default=False,
+        help='Also coalesce the requests handled by other Odoo workers (PostgreSQL advisory lock; '
+             'holds one database connection per request being answered). The answer is handed over '
+             'through the response cache, which must be enabled'
+    )
+    
+    coalescing_timeout = fields.Integer(
+        string='Coalescing Wait (s)',
+        default=60,
+        help='Maximum wait for the answer of an identical request before calling Anthropic'
+    )
+    
+    # Circuit Breaker
+    circuit_breaker_enabled = fields.Boolean(
+        string='Circuit Breaker',
+        default=True,
+        help='Stop calling Anthropic or the MCP server for a while when it keeps failing or answering too slowly, '
+             'instead of making every request wait for its timeout'
+    )
+    
+    breaker_failure_rate = fields.Float(
+        string='Failure Rate Threshold',
+        default=0.5,
+        help='Share of failed calls (network errors, HTTP 5xx and 429) within the window that opens the circuit'
+    )
+    
+    breaker_slow_call_seconds = fields.Float(
+        string='Slow Call (s)',
+        default=15.0,
+        help='Calls taking longer than this count as slow'
+    )
+    
+    breaker_slow_rate = fields.Float(
+        string='Slow Call Rate Threshold',
+        default=0.5,
+        help='Share of slow calls within the window that opens the circuit'
+    )
+    
+    breaker_min_calls = fields.Integer(
+        string='Minimum Calls',
+        default=5,
+        help='Calls needed within the window before the thresholds apply'
+    )
+    
+    breaker_window_seconds = fields.Integer(
+        string='Window (s)',
+        default=60,
+        help='Sliding window over which failures and slow calls are counted'
+    )
+    
+    breaker_open_seconds = fields.Integer(
+        string='Open Duration (s)',
+        default=30,
+        help='Time during which calls fail immediately before a probe call is let through'
+    )
+    
+    fallback_model_enabled = fields.Boolean(
+        string='Fallback Model',
+        default=False,
+        help='Send the requests to the fallback model while the circuit of the configured model is open'
+    )
+    
+    fallback_model = fields.Selection(
+        selection=CLAUDE_MODELS,
+        string='Fallback Model Name',
+        default='claude-3-5-haiku-20241022',
+        help='Faster model used while the configured model is failing or too slow'
+    )
+    
     message_count_today = fields.Integer(
         string='Messages Today',
         compute='_compute_message_count_today',
         help='Number of messages sent today'
     )
     
-    @api.depends('write_date')
     def _compute_message_count_today(self):
-        """Compute the number of messages sent today."""
+        """Read the number of messages sent today from the daily usage counter."""
+        counter = self.env['chatbot.usage.counter'].sudo()
         for record in self:
-            today_start = fields.Datetime.now().replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            count = self.env['chatbot.message'].search_count([
-                ('create_date', '>=', today_start)
-            ])
-            record.message_count_today = count
+            record.message_count_today = counter._get_count(record) if record.id else 0
+    
+    def _compute_latency_percentiles(self):
+        """Compute the request latency percentiles of the last 24 hours."""
+        total = self.env['chatbot.trace'].sudo().get_latency_percentiles(days=1)['total']
+        for record in self:
+            record.latency_p50 = total['p50']
+            record.latency_p95 = total['p95']
+            record.latency_p99 = total['p99']
+    
+    def _compute_usage_statistics(self):
+        """Read the organization-wide statistics of the last 30 days from the pre-aggregated table."""
+        stats = self.env['chatbot.usage.stat'].sudo().get_statistics(days=30)
+        for record in self:
+            record.stat_message_count = stats['total_messages']
+            record.stat_success_rate = stats['success_rate']
+            record.stat_avg_response_time = stats['avg_response_time']
+            record.stat_session_count = stats['sessions_count']
+            record.stat_token_count = stats['input_tokens'] + stats['output_tokens']
+    
+    def _compute_prompt_cache_hit_ratio(self):
+        """Compute the prompt cache hit ratio over today's messages."""
+        today_start = fields.Datetime.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        groups = self.env['chatbot.message']._read_group(
+            [('config_id', 'in', self.ids), ('create_date', '>=', today_start)],
+            ['config_id'],
+            ['cache_read_tokens:sum', 'cache_write_tokens:sum', 'input_tokens:sum']
+        )
+        tokens = {config.id: (read or 0, write or 0, uncached or 0) for config, read, write, uncached in groups}
+        for record in self:
+            cache_read, cache_creation, uncached = tokens.get(record.id, (0, 0, 0))
+            total = cache_read + cache_creation + uncached
+            record.prompt_cache_hit_ratio = cache_read / total if total else 0.0
+    
+    def _tools_available(self):
+        """Return whether Claude can be offered the Odoo tools."""
+        self.ensure_one()
+        return self.tool_backend == 'orm' or self.mcp_connected
     
     @api.constrains('api_key')
     def _check_api_key(self):
@@ -175,40 +666,196 @@ class ChatbotConfig(models.Model):
             if record.max_tokens < 1 or record.max_tokens > 100000:
                 raise ValidationError('Max tokens must be between 1 and 100,000')
     
-    @api.constrains('active')
+    @api.constrains('queue_concurrency')
+    def _check_queue_concurrency(self):
+        """Validate queue settings."""
+        for record in self:
+            if record.queue_concurrency < 1:
+                raise ValidationError('Queue concurrency must be at least 1')
+    
+    @api.constrains('response_cache_ttl', 'response_cache_max_entries', 'response_cache_similarity')
+    def _check_response_cache(self):
+        """Validate response cache settings."""
+        for record in self:
+            if record.response_cache_ttl < 1:
+                raise ValidationError('Cache TTL must be at least 1 second')
+            if record.response_cache_max_entries < 1:
+                raise ValidationError('Cache max entries must be at least 1')
+            if not 0 <= record.response_cache_similarity <= 1:
+                raise ValidationError('Cache similarity threshold must be between 0 and 1')
+    
+    @api.constrains('history_token_budget', 'summary_max_tokens')
+    def _check_conversation_history(self):
+        """Validate conversation history settings."""
+        for record in self:
+            if record.history_token_budget < 0:
+                raise ValidationError('History token budget cannot be negative')
+            if record.summary_max_tokens < 50:
+                raise ValidationError('Summary max tokens must be at least 50')
+    
+    @api.constrains(
+        'rate_user_req_per_minute', 'rate_user_tok_per_minute',
+        'rate_company_req_per_minute', 'rate_company_tok_per_minute',
+        'rate_global_req_per_minute', 'rate_global_tok_per_minute'
+    )
+    def _check_rate_limits(self):
+        """Validate rate limits."""
+        for record in self:
+            for scope in ('user', 'company', 'global'):
+                if record[f'rate_{scope}_req_per_minute'] < 0 or record[f'rate_{scope}_tok_per_minute'] < 0:
+                    raise ValidationError('Rate limits cannot be negative')
+    
+    @api.constrains('max_agent_turns', 'max_total_tokens')
+    def _check_agent_loop(self):
+        """Validate agent loop limits."""
+        for record in self:
+            if record.max_agent_turns < 1:
+                raise ValidationError('Max agent turns must be at least 1')
+            if record.max_total_tokens < 0:
+                raise ValidationError('Max total tokens cannot be negative')
+    
+    @api.constrains('max_tool_concurrency', 'tool_timeout')
+    def _check_tool_execution(self):
+        """Validate tool execution settings."""
+        for record in self:
+            if record.max_tool_concurrency < 1:
+                raise ValidationError('Max tool concurrency must be at least 1')
+            if record.tool_timeout < 1:
+                raise ValidationError('Tool timeout must be at least 1 second')
+    
+    @api.constrains('tool_cache_ttl', 'tool_cache_max_entries')
+    def _check_tool_cache(self):
+        """Validate tool cache settings."""
+        for record in self:
+            if record.tool_cache_ttl < 1:
+                raise ValidationError('Tool cache TTL must be at least 1 second')
+            if record.tool_cache_max_entries < 1:
+                raise ValidationError('Tool cache max entries must be at least 1')
+    
+    @api.constrains('http_pool_size', 'http_max_retries', 'async_max_connections')
+    def _check_http_pool(self):
+        """Validate HTTP pool settings."""
+        for record in self:
+            if record.http_pool_size < 1:
+                raise ValidationError('HTTP pool size must be at least 1')
+            if record.http_max_retries < 0:
+                raise ValidationError('HTTP retries cannot be negative')
+            if record.async_max_connections < 1:
+                raise ValidationError('Async max connections must be at least 1')
+    
+    @api.constrains('coalescing_timeout', 'coalescing_across_workers', 'response_cache_enabled')
+    def _check_coalescing_timeout(self):
+        """Validate the coalescing settings."""
+        for record in self:
+            if record.coalescing_timeout < 1:
+                raise ValidationError('Coalescing wait must be at least 1 second')
+            if record.coalescing_across_workers and not record.response_cache_enabled:
+                raise ValidationError('Coalescing across workers requires the response cache')
+    
+    @api.constrains(
+        'breaker_failure_rate', 'breaker_slow_rate', 'breaker_slow_call_seconds',
+        'breaker_min_calls', 'breaker_window_seconds', 'breaker_open_seconds'
+    )
+    def _check_circuit_breaker(self):
+        """Validate circuit breaker settings."""
+        for record in self:
+            if not 0 < record.breaker_failure_rate <= 1 or not 0 < record.breaker_slow_rate <= 1:
+                raise ValidationError('Circuit breaker rates must be between 0 (excluded) and 1')
+            if record.breaker_slow_call_seconds <= 0:
+                raise ValidationError('Slow call threshold must be positive')
+            if record.breaker_min_calls < 1:
+                raise ValidationError('Circuit breaker minimum calls must be at least 1')
+            if record.breaker_window_seconds < 1 or record.breaker_open_seconds < 1:
+                raise ValidationError('Circuit breaker window and open duration must be at least 1 second')
+    
+    @api.constrains('log_sample_rate')
+    def _check_log_sample_rate(self):
+        """Validate the log sample rate."""
+        for record in self:
+            if not 0 <= record.log_sample_rate <= 1:
+                raise ValidationError('Log sample rate must be between 0 and 1')
+    
+    @api.constrains('retention_message_days', 'retention_service_log_days', 'retention_batch_size')
+    def _check_retention(self):
+        """Validate retention settings."""
+        for record in self:
+            if record.retention_message_days < 0 or record.retention_service_log_days < 0:
+                raise ValidationError('Retention days cannot be negative')
+            if record.retention_batch_size < 1:
+                raise ValidationError('Deletion batch size must be at least 1')
+    
+    @api.constrains('active', 'company_id')
     def _check_single_active(self):
-        """Ensure only one configuration is active."""
-        if self.active:
+        """Ensure only one configuration is active per company."""
+        for record in self.filtered('active'):
             other_active = self.search([
                 ('active', '=', True),
-                ('id', '!=', self.id)
+                ('company_id', '=', record.company_id.id),
+                ('id', '!=', record.id)
             ])
             if other_active:
                 other_active.write({'active': False})
     
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if {'active', 'company_id'} & set(vals):
+            self.env.registry.clear_cache()
+        return res
+    
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+    
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_active_config_id(self, company_id):
+        """
+        Active configuration of a company, cached until a configuration is
+        created, deleted, (de)activated or moved to another company.
+        
+        Args:
+            company_id: res.company id
+            
+        Returns:
+            chatbot.config id, or None when no configuration is active
+        """
+        configs = self.sudo().search([('active', '=', True), ('company_id', 'in', [company_id, False])])
+        config = configs.filtered(lambda c: c.company_id.id == company_id)[:1] or configs[:1]
+        return config.id or None
+    
     @api.model
     def get_active_config(self):
-        """Get the active configuration."""
-        config = self.search([('active', '=', True)], limit=1)
-        if not config:
-            config = self.search([], limit=1)
-            if config:
-                config.active = True
-        if not config:
-            # Créer une configuration par défaut si aucune n'existe
-            config = self.create({
-                'name': 'MCP Configuration',
-                'active': True,
-                'api_key': '',  # Empty by default, user must configure
-                'mcp_server_url': 'https://mpc-server-odoo.onrender.com',
-                'model_name': 'claude-3-5-sonnet-20241022',
-                'temperature': 0.7,
-                'max_tokens': 4096,
-                'timeout': 30,
-                'system_prompt_prefix': 'Vous êtes un assistant IA intégré à Odoo ERP.',
-                'daily_message_limit': 1000,
-            })
-        return config
+        """Get the active configuration of the current company."""
+        company_id = self.env.company.id
+        config_id = self._get_active_config_id(company_id)
+        if config_id:
+            return self.browse(config_id)
+        # Réactiver une configuration archivée (celle de la société en priorité)
+        configs = self.sudo().with_context(active_test=False).search([('company_id', 'in', [company_id, False])])
+        config = configs.filtered(lambda c: c.company_id.id == company_id)[:1] or configs[:1]
+        if config:
+            config.active = True
+            return self.browse(config.id)
+        # Créer une configuration par défaut si aucune n'existe
+        return self.browse(self.sudo().create({
+            'name': 'MCP Configuration',
+            'active': True,
+            'api_key': '',  # Empty by default, user must configure
+            'mcp_server_url': 'https://mpc-server-odoo.onrender.com',
+            'model_name': 'claude-3-5-sonnet-20241022',
+            'temperature': 0.7,
+            'max_tokens': 4096,
+            'timeout': 30,
+            'system_prompt_prefix': 'Vous êtes un assistant IA intégré à Odoo ERP.',
+            'daily_message_limit': 1000,
+        }).id)
     
     def test_connection(self):
         """Test the API connection."""
@@ -311,13 +958,42 @@ class ChatbotConfig(models.Model):
     def check_daily_limit(self):
         """Check if daily message limit has been reached."""
         config = self.get_active_config()
+        counter = self.env['chatbot.usage.counter'].sudo()
         if config.daily_message_limit > 0:
             if config.message_count_today >= config.daily_message_limit:
                 raise ValidationError(
                     f'Daily message limit ({config.daily_message_limit}) reached'
                 )
+        if config.daily_user_message_limit > 0:
+            if counter._get_count(config, self.env.user) >= config.daily_user_message_limit:
+                raise ValidationError(
+                    f'Daily message limit per user ({config.daily_user_message_limit}) reached'
+                )
         return True
     
+    def check_rate_limit(self):
+        """
+        Take a request from the rate limit buckets of the current user.
+        
+        In queued processing mode nothing is taken here: the background
+        runner takes the request when it sends it.
+        
+        Returns:
+            0 to process now, otherwise seconds to wait before sending (queue policy)
+            
+        Raises:
+            RateLimitError: when limited and the policy is to reject
+        """
+        config = self.get_active_config()
+        if config.processing_mode == 'queued':
+            return 0.0
+        wait = self.env['chatbot.rate.bucket'].sudo()._acquire(config)
+        if wait and config.rate_limit_policy == 'reject':
+            raise RateLimitError(
+                f'Rate limit exceeded, please retry in {math.ceil(wait)} seconds', wait
+            )
+        return wait
+    
     def name_get(self):
         """Custom name display."""
         result = []
@@ -342,8 +1018,6 @@ class ChatbotConfig(models.Model):
             raise ValidationError('MCP Server URL is required')
         
         try:
-            import requests
-            
             # Prepare connection data
             connection_data = {
                 'url': self.odoo_url.rstrip('/'),
@@ -354,11 +1028,12 @@ class ChatbotConfig(models.Model):
             
             # Send connection request to MCP server
             url = f"{self.mcp_server_url.rstrip('/')}/connect"
-            response = requests.post(
+            response = self.env['base.service']._http_post(
                 url,
                 json=connection_data,
                 headers={'Content-Type': 'application/json'},
-                timeout=30
+                timeout=30,
+                config=self
             )
             
             if response.status_code == 200:
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ChatbotLogBlob(models.Model):
+    """Request blocks (system prompt, tool schemas) shared by many API logs, stored once."""
+
+    _name = 'chatbot.log.blob'
+    _description = 'Chatbot Log Block'
+    _order = 'last_seen desc, id desc'
+    _rec_name = 'hash'
+    _log_access = False
+
+    hash = fields.Char(
+        string='Hash',
+        required=True,
+        index=True,
+        help='SHA-256 of the JSON encoded block'
+    )
+
+    kind = fields.Char(
+        string='Kind',
+        help='Request key of the block (system, tools)'
+    )
+
+    content = fields.Text(
+        string='Content',
+        help='JSON encoded block'
+    )
+
+    last_seen = fields.Date(
+        string='Last Seen',
+        index=True
+    )
+
+    _sql_constraints = [
+        ('hash_uniq', 'unique(hash)', 'This block is already stored.'),
+    ]
+
+    @api.model
+    def _store(self, kind, block):
+        """
+        Store a block if it is new.
+
+        The row is only rewritten once a day (last_seen), so a block used by
+        every request costs a no-op upsert.
+
+        Returns:
+            Hash referencing the block
+        """
+        content = json.dumps(block, sort_keys=True, default=str)
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        self.env.cr.execute("""
+            INSERT INTO chatbot_log_blob (hash, kind, content, last_seen)
+            VALUES (%s, %s, %s, (now() at time zone 'UTC')::date)
+            ON CONFLICT (hash) DO UPDATE
+               SET last_seen = EXCLUDED.last_seen
+             WHERE chatbot_log_blob.last_seen < EXCLUDED.last_seen
+        """, (digest, kind, content))
+        return digest
+
+    @api.model
+    def _load(self, digest):
+        """Return the block of a hash (None when garbage collected)."""
+        blob = self.search([('hash', '=', digest)], limit=1)
+        return json.loads(blob.content) if blob else None
+
+    @api.autovacuum
+    def _gc_unused_blocks(self):
+        """Remove the blocks no request used during the API log retention."""
+        config = self.env['chatbot.config'].sudo().get_active_config()
+        if not config.retention_service_log_days:
+            return
+        cutoff = fields.Date.today() - timedelta(days=config.retention_service_log_days + 1)
+        records = self.search([('last_seen', '<', cutoff)])
+        records.unlink()
+        _logger.info(f'Cleaned up {len(records)} unused chatbot log blocks')
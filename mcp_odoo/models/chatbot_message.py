@@ -1,11 +1,40 @@
 # -*- coding: utf-8 -*-
+import ast
+import json
+import math
+import time
 import uuid
 import logging
-from datetime import timedelta
-from odoo import models, fields, api
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from odoo import models, fields, api, SUPERUSER_ID
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+from odoo.tools import sql
+from .chatbot_trace import span
 
 _logger = logging.getLogger(__name__)
 
+# Seconds a queue runner keeps claiming new messages before handing over to the next cron run
+QUEUE_TIME_BUDGET = 240
+
+# Failed runs of a queued message before it is set in error, and seconds between them
+MAX_QUEUE_ATTEMPTS = 3
+QUEUE_RETRY_DELAY = 60
+
+# Largest page served by the history API
+MAX_HISTORY_PAGE = 100
+
+# Fields the usage statistics (chatbot.usage.stat) are computed from
+STAT_FIELDS = {
+    'status', 'response_time', 'config_id',
+    'input_tokens', 'output_tokens', 'cache_write_tokens', 'cache_read_tokens', 'cost',
+}
+
+# Fields of the history pushed to the user's bus channel (notification type below)
+BUS_FIELDS = ('session_id', 'user_message', 'bot_response', 'status', 'response_time', 'error_message', 'create_date')
+BUS_NOTIFICATION = 'mcp_odoo/message'
+
 
 class ChatbotMessage(models.Model):
     """Model to store chatbot conversation history."""
@@ -55,6 +84,31 @@ class ChatbotMessage(models.Model):
         ('error', 'Error')
     ], string='Status', default='draft', required=True)
     
+    queued = fields.Boolean(
+        string='Queued',
+        default=False,
+        index=True,
+        help='Waiting for the background runner to generate the response'
+    )
+    
+    retry_at = fields.Datetime(
+        string='Not Before',
+        help='Queued message held back by the rate limiter until this time'
+    )
+    
+    usage_counted = fields.Boolean(
+        string='Counted in Usage',
+        default=False,
+        copy=False,
+        help='Counted in the daily usage counters (chatbot.usage.counter)'
+    )
+    
+    queue_attempts = fields.Integer(
+        string='Queue Attempts',
+        default=0,
+        help='Runs of the background runner that failed on this message'
+    )
+    
     # Performance metrics
     response_time = fields.Float(
         string='Response Time (s)',
@@ -71,6 +125,37 @@ class ChatbotMessage(models.Model):
         help='JSON data about token usage'
     )
     
+    model_name = fields.Char(
+        string='Model',
+        index=True,
+        help='Model billed for the answer'
+    )
+    
+    input_tokens = fields.Integer(
+        string='Input Tokens',
+        help='Uncached input tokens, over every agent turn'
+    )
+    
+    output_tokens = fields.Integer(
+        string='Output Tokens'
+    )
+    
+    cache_write_tokens = fields.Integer(
+        string='Cache Write Tokens',
+        help='Input tokens written to the prompt cache'
+    )
+    
+    cache_read_tokens = fields.Integer(
+        string='Cache Read Tokens',
+        help='Input tokens read from the prompt cache'
+    )
+    
+    cost = fields.Float(
+        string='Estimated Cost (USD)',
+        digits=(16, 6),
+        help='Estimated from the token prices of chatbot.model.price'
+    )
+    
     # Computed fields
     conversation_date = fields.Date(
         string='Conversation Date',
@@ -78,6 +163,85 @@ class ChatbotMessage(models.Model):
         store=True
     )
     
+    def init(self):
+        # Keyset pagination of a user's history, over all sessions or in one session
+        sql.create_index(
+            self.env.cr, 'chatbot_message_user_history_idx', self._table,
+            ['user_id', 'create_date DESC', 'id DESC']
+        )
+        sql.create_index(
+            self.env.cr, 'chatbot_message_user_session_history_idx', self._table,
+            ['user_id', 'session_id', 'create_date DESC', 'id DESC']
+        )
+        # Spend per day, user and model
+        sql.create_index(
+            self.env.cr, 'chatbot_message_spend_idx', self._table,
+            ['create_date', 'user_id', 'model_name']
+        )
+        self._fill_usage_columns()
+    
+    def _fill_usage_columns(self):
+        """Fill the typed token columns of the messages logged before they existed."""
+        # usage_data is JSON since its first write with json.dumps; older messages
+        # stored a Python repr and keep empty usage columns. Their cost is
+        # estimated once the prices are loaded (chatbot.model.price._fill_missing_costs)
+        self.env.cr.execute("""
+            UPDATE chatbot_message m
+               SET model_name = u.model_name,
+                   input_tokens = COALESCE((u.usage->>'input_tokens')::int, 0),
+                   output_tokens = COALESCE((u.usage->>'output_tokens')::int, 0),
+                   cache_write_tokens = COALESCE((u.usage->>'cache_creation_input_tokens')::int, 0),
+                   cache_read_tokens = COALESCE((u.usage->>'cache_read_input_tokens')::int, 0)
+              FROM (
+                    SELECT message.id, message.usage_data::jsonb AS usage, config.model_name
+                      FROM chatbot_message message
+                      LEFT JOIN chatbot_config config ON config.id = message.config_id
+                     WHERE message.input_tokens IS NULL AND message.usage_data LIKE '{"%'
+                   ) u
+             WHERE m.id = u.id
+        """)
+        if self.env.cr.rowcount:
+            _logger.info(f"Filled the usage columns of {self.env.cr.rowcount} chatbot messages")
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        messages = super().create(vals_list)
+        self.env['chatbot.usage.counter']._increment(messages)
+        self.env['chatbot.usage.stat'].sudo()._record_create(messages)
+        messages._push_to_bus(BUS_FIELDS)
+        return messages
+    
+    def write(self, vals):
+        stats = self.env['chatbot.usage.stat'].sudo()
+        before = stats._snapshot(self) if STAT_FIELDS.intersection(vals) else None
+        result = super().write(vals)
+        if before is not None:
+            stats._record_write(before, self)
+        pushed = [name for name in BUS_FIELDS if name in vals]
+        if pushed:
+            self._push_to_bus(pushed)
+        return result
+    
+    def _push_to_bus(self, field_names):
+        """
+        Push the changed history fields of the messages to their user's bus channel.
+        
+        Only the given fields are sent (all of them for a new message), and
+        the bus delivers them once the transaction is committed.
+        
+        Args:
+            field_names: Names of the fields to send, among BUS_FIELDS
+        """
+        for message in self:
+            payload = {'id': message.id}
+            for name in field_names:
+                value = message[name]
+                payload[name] = fields.Datetime.to_string(value) if name == 'create_date' else value
+            if 'create_date' in field_names:
+                payload['cursor'] = self._format_history_cursor(message.create_date, message.id)
+            # bus.listener.mixin: the partner is the bus channel of its user
+            message.user_id.partner_id._bus_send(BUS_NOTIFICATION, payload)
+    
     @api.depends('create_date')
     def _compute_conversation_date(self):
         """Extract date from create_date for grouping."""
@@ -87,23 +251,302 @@ class ChatbotMessage(models.Model):
             else:
                 record.conversation_date = fields.Date.today()
     
+    def _generate_response(self, bypass_cache=False):
+        """
+        Call Anthropic for this message and store the response or the error.
+        
+        Args:
+            bypass_cache: Skip the response cache
+            
+        Returns:
+            call_api result dictionary ({'success': False, 'message'} on error)
+        """
+        self.ensure_one()
+        start_time = time.time()
+        with self.env['chatbot.trace']._trace(self):
+            with span('config'):
+                config = self.config_id or self.env['chatbot.config'].get_active_config()
+            try:
+                # Savepoint: a failed query leaves the transaction usable to store the error
+                with self.env.cr.savepoint():
+                    # Call Anthropic service (served from the response cache when possible)
+                    result = self.env['anthropic.service'].call_api(
+                        self.user_message, config, bypass_cache=bypass_cache,
+                        session_id=self.session_id, before_message_id=self.id
+                    )
+                    if not result.get('success'):
+                        raise UserError(result.get('message', 'Unknown error'))
+                    with span('db.write'):
+                        self.write({
+                            'bot_response': result.get('message', ''),
+                            'status': 'processed',
+                            'queued': False,
+                            'response_time': time.time() - start_time,
+                            'usage_data': json.dumps(result.get('usage', {})),
+                            # Billed to the model that answered, the fallback one after a downgrade
+                            **self.env['chatbot.model.price']._get_usage_values(
+                                result.get('model') or config.model_name, result.get('usage'), result.get('cost')
+                            )
+                        })
+                        self.env['chatbot.rate.bucket'].sudo()._consume_tokens(config, result.get('usage', {}))
+            except Exception as e:
+                error_msg = str(e)
+                _logger.error(f"Chatbot error: {error_msg}")
+                self.write({
+                    'bot_response': error_msg,
+                    'status': 'error',
+                    'queued': False,
+                    'error_message': error_msg,
+                    'response_time': time.time() - start_time
+                })
+                result = {'success': False, 'message': error_msg}
+        return result
+    
+    def _enqueue(self, delay=0):
+        """
+        Hand the messages over to the background runner.
+        
+        Args:
+            delay: Seconds to wait before sending them (rate limited)
+        """
+        retry_at = fields.Datetime.now() + timedelta(seconds=math.ceil(delay)) if delay else False
+        self.write({'status': 'sent', 'queued': True, 'retry_at': retry_at})
+        self.env.ref('mcp_odoo.ir_cron_chatbot_process_queue')._trigger(at=retry_at or None)
+        return True
+    
+    def _handle_queue_failure(self, error_msg):
+        """
+        Retry a queued message whose run failed, or set it in error after
+        MAX_QUEUE_ATTEMPTS runs so that it does not block the queue.
+        
+        Args:
+            error_msg: Error of the failed run
+        """
+        self.ensure_one()
+        # Another runner may have claimed it since the rollback of the failed run
+        self.env.cr.execute(
+            "SELECT queue_attempts FROM chatbot_message WHERE id = %s AND queued AND status = 'sent' FOR UPDATE",
+            (self.id,)
+        )
+        row = self.env.cr.fetchone()
+        if not row:
+            return
+        attempts = (row[0] or 0) + 1
+        if attempts >= MAX_QUEUE_ATTEMPTS:
+            _logger.error(f"Giving up on queued chatbot message {self.id} after {attempts} attempts: {error_msg}")
+            self.write({
+                'bot_response': error_msg,
+                'status': 'error',
+                'queued': False,
+                'error_message': error_msg,
+                'queue_attempts': attempts,
+            })
+        else:
+            self.write({'queue_attempts': attempts})
+            self._enqueue(delay=QUEUE_RETRY_DELAY * attempts)
+    
     @api.model
-    def get_conversation_history(self, session_id=None, limit=50):
+    def get_message_status(self, message_ids):
+        """
+        Status of the current user's messages, for polling clients.
+        
+        Returns:
+            List of {'id', 'status', 'bot_response', 'response_time'}
+        """
+        return self.search_read(
+            [('id', 'in', message_ids), ('user_id', '=', self.env.user.id)],
+            ['status', 'bot_response', 'error_message', 'response_time']
+        )
+    
+    @api.model
+    def _cron_process_queue(self):
+        """Generate the responses of queued messages with a pool of runner threads."""
+        config = self.env['chatbot.config'].get_active_config()
+        concurrency = max(config.queue_concurrency, 1)
+        dbname = self.env.cr.dbname
+        deadline = time.monotonic() + QUEUE_TIME_BUDGET
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chatbot_queue') as executor:
+            processed = sum(executor.map(
+                lambda _i: self._run_queue_worker(dbname, deadline), range(concurrency)
+            ))
+        _logger.info(f"Processed {processed} queued chatbot messages")
+        return processed
+    
+    @api.model
+    def _run_queue_worker(self, dbname, deadline):
+        """Claim and process queued messages one by one, each in its own transaction."""
+        processed = 0
+        while time.monotonic() < deadline:
+            with Registry(dbname).cursor() as cr:
+                # Row lock held until commit: concurrent runners skip the message
+                cr.execute("""
+                    SELECT id FROM chatbot_message
+                     WHERE queued AND status = 'sent'
+                       AND (retry_at IS NULL OR retry_at <= now() at time zone 'UTC')
+                     ORDER BY id
+                     LIMIT 1
+                       FOR UPDATE SKIP LOCKED
+                """)
+                row = cr.fetchone()
+                if not row:
+                    return processed
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                try:
+                    message = env['chatbot.message'].browse(row[0])
+                    user = message.user_id
+                    message = message.with_user(user).with_context(lang=user.lang)
+                    config = message.config_id or message.env['chatbot.config'].get_active_config()
+                    wait = (
+                        message.env['chatbot.circuit.breaker'].sudo()._get_anthropic_wait(config)
+                        or message.env['chatbot.rate.bucket'].sudo()._acquire(config)
+                    )
+                    if wait:
+                        # Anthropic unavailable or over the sender's rate limit: leave it
+                        # queued, other senders go first
+                        message._enqueue(delay=wait)
+                        continue
+                    message._generate_response()
+                    processed += 1
+                except Exception as e:
+                    # One failing message must not stop the runner nor be claimed again at once
+                    _logger.exception(f"Queued chatbot message {row[0]} failed")
+                    cr.rollback()
+                    env['chatbot.message'].browse(row[0])._handle_queue_failure(str(e))
+        return processed
+    
+    def _parse_usage_data(self):
+        """
+        Decode the token usage stored on the message.
+        
+        Returns:
+            Usage dictionary (empty when unknown)
+        """
+        self.ensure_one()
+        if not self.usage_data:
+            return {}
+        try:
+            return json.loads(self.usage_data)
+        except ValueError:
+            # Older messages stored the Python repr of the usage dictionary
+            try:
+                usage = ast.literal_eval(self.usage_data)
+            except (ValueError, SyntaxError):
+                return {}
+            return usage if isinstance(usage, dict) else {}
+    
+    @api.model
+    def get_conversation_history(self, session_id=None, limit=50, before=None):
         """
         Get conversation history for current user.
         
         Args:
             session_id: Optional session ID to filter
             limit: Maximum number of messages
+            before: Only messages older than this history cursor (next page)
+            
+        Returns:
+            Recordset of messages, newest first
+        """
+        rows = self._fetch_history(session_id=session_id, before=before, limit=limit)
+        return self.browse([row['id'] for row in rows])
+    
+    @api.model
+    def _fetch_history(self, session_id=None, before=None, after=None, limit=20):
+        """
+        Keyset page of the current user's messages, ordered on (create_date, id).
+        
+        The cursors carry the (create_date, id) position itself, so a page
+        can still be read after the message it was taken from is deleted,
+        and it is read from the history indexes: its cost does not depend
+        on how deep it is in the history.
+        
+        Args:
+            session_id: Optional session ID to filter
+            before: Messages older than this history cursor
+            after: Messages newer than this history cursor (oldest first)
+            limit: Page size
             
         Returns:
-            Recordset of messages
+            List of dictionaries with the history columns
         """
-        domain = [('user_id', '=', self.env.user.id)]
+        self.flush_model(['user_id', 'session_id', 'user_message', 'bot_response', 'status', 'response_time'])
+        conditions = ['user_id = %s']
+        params = [self.env.uid]
         if session_id:
-            domain.append(('session_id', '=', session_id))
+            conditions.append('session_id = %s')
+            params.append(session_id)
+        if before:
+            conditions.append('(create_date, id) < (%s, %s)')
+            params += self._parse_history_cursor(before)
+        if after:
+            conditions.append('(create_date, id) > (%s, %s)')
+            params += self._parse_history_cursor(after)
+        direction = 'ASC' if after and not before else 'DESC'
+        params.append(limit)
+        self.env.cr.execute(f"""
+            SELECT id, session_id, user_message, bot_response, status, response_time, create_date
+              FROM chatbot_message
+             WHERE {' AND '.join(conditions)}
+             ORDER BY create_date {direction}, id {direction}
+             LIMIT %s
+        """, params)
+        return self.env.cr.dictfetchall()
+    
+    @api.model
+    def _format_history_cursor(self, create_date, message_id):
+        """History cursor of a message: its (create_date, id) position, to the microsecond."""
+        return f"{create_date.strftime('%Y-%m-%d %H:%M:%S.%f')},{message_id}"
+    
+    @api.model
+    def _parse_history_cursor(self, cursor):
+        """
+        Position (create_date, id) of a history cursor.
         
-        return self.search(domain, limit=limit, order='create_date desc')
+        A bare message ID, as sent by older clients, is looked up instead.
+        
+        Raises:
+            UserError: when the cursor is malformed or its message was deleted
+        """
+        if isinstance(cursor, int) or str(cursor).isdigit():
+            self.env.cr.execute("SELECT create_date, id FROM chatbot_message WHERE id = %s", (int(cursor),))
+            row = self.env.cr.fetchone()
+            if not row:
+                raise UserError('This history page is no longer available, please reload the history')
+            return list(row)
+        create_date, _sep, message_id = str(cursor).rpartition(',')
+        try:
+            return [datetime.fromisoformat(create_date), int(message_id)]
+        except ValueError:
+            raise UserError(f'Invalid history cursor: {cursor}')
+    
+    @api.model
+    def get_history_page(self, session_id=None, before=None, after=None, limit=20):
+        """
+        History API of the chat widget (keyset pagination).
+        
+        Pass the 'cursor' of a page as `before` to get the next older page,
+        and the 'latest' cursor as `after` to fetch only the messages added
+        since. Each message carries its own 'cursor' as well.
+        
+        Returns:
+            {'messages': [...] newest first, 'has_more', 'cursor', 'latest'};
+            has_more refers to older messages, or to newer ones with `after`
+        """
+        limit = min(max(int(limit or 20), 1), MAX_HISTORY_PAGE)
+        rows = self._fetch_history(session_id=session_id, before=before, after=after, limit=limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after and not before:
+            rows.reverse()
+        for row in rows:
+            row['cursor'] = self._format_history_cursor(row['create_date'], row['id'])
+            row['create_date'] = fields.Datetime.to_string(row['create_date'])
+        return {
+            'messages': rows,
+            'has_more': has_more,
+            'cursor': rows[-1]['cursor'] if rows else before or False,
+            'latest': rows[0]['cursor'] if rows else after or False,
+        }
     
     @api.model
     def get_user_sessions(self):
@@ -123,45 +566,12 @@ class ChatbotMessage(models.Model):
     
     @api.model
     def get_statistics(self):
-        """Get usage statistics for current user."""
-        domain = [('user_id', '=', self.env.user.id)]
-        
-        # Basic counts
-        total_messages = self.search_count(domain)
-        processed_messages = self.search_count(
-            domain + [('status', '=', 'processed')]
-        )
-        error_messages = self.search_count(
-            domain + [('status', '=', 'error')]
-        )
-        
-        # Calculate average response time
-        processed_with_time = self.search(
-            domain + [
-                ('status', '=', 'processed'),
-                ('response_time', '>', 0)
-            ]
-        )
-        
-        avg_response_time = 0
-        if processed_with_time:
-            total_time = sum(processed_with_time.mapped('response_time'))
-            avg_response_time = total_time / len(processed_with_time)
-        
-        # Count unique sessions
-        sessions = self.read_group(domain, ['session_id'], ['session_id'])
+        """
+        Get usage statistics for current user.
         
-        return {
-            'total_messages': total_messages,
-            'processed_messages': processed_messages,
-            'error_messages': error_messages,
-            'avg_response_time': round(avg_response_time, 2),
-            'sessions_count': len(sessions),
-            'success_rate': (
-                round((processed_messages / total_messages) * 100, 1)
-                if total_messages > 0 else 0
-            )
-        }
+        Read from the pre-aggregated chatbot.usage.stat rows in one query.
+        """
+        return self.env['chatbot.usage.stat'].sudo().get_statistics(user=self.env.user)
     
     def action_view_details(self):
         """Open detailed view of the message."""
@@ -223,14 +633,9 @@ class ChatbotMessage(models.Model):
     
     @api.model
     def cleanup_old_messages(self, days=30):
-        """Clean up messages older than specified days."""
-        cutoff_date = fields.Datetime.now() - timedelta(days=days)
-        old_messages = self.search([
-            ('create_date', '<', cutoff_date)
-        ])
-        
-        count = len(old_messages)
-        old_messages.unlink()
+        """
+        Clean up messages older than specified days (batched, see chatbot.retention).
         
-        _logger.info(f"Cleaned up {count} old chatbot messages")
-        return count
\ No newline at end of file
+        Runs in the caller's transaction: the batches are committed with it.
+        """
+        return self.env['chatbot.retention']._purge(self._name, days, commit=False)['deleted']
\ No newline at end of file
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools
+
+
+class ChatbotModelPrice(models.Model):
+    """Token prices of the Claude models, used to estimate the cost of each call."""
+
+    _name = 'chatbot.model.price'
+    _description = 'Chatbot Model Price'
+    _rec_name = 'model_name'
+    _order = 'model_name'
+
+    model_name = fields.Char(
+        string='Model',
+        required=True,
+        help='Anthropic model identifier, e.g. claude-3-5-sonnet-20241022'
+    )
+
+    input_price = fields.Float(
+        string='Input (USD / MTok)',
+        digits=(16, 4),
+        help='Price of one million uncached input tokens'
+    )
+
+    output_price = fields.Float(
+        string='Output (USD / MTok)',
+        digits=(16, 4),
+        help='Price of one million output tokens'
+    )
+
+    cache_write_price = fields.Float(
+        string='Cache Write (USD / MTok)',
+        digits=(16, 4),
+        help='Price of one million input tokens written to the prompt cache'
+    )
+
+    cache_read_price = fields.Float(
+        string='Cache Read (USD / MTok)',
+        digits=(16, 4),
+        help='Price of one million input tokens read from the prompt cache'
+    )
+
+    _sql_constraints = [
+        ('model_name_uniq', 'unique(model_name)', 'A price is already defined for this model.'),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        prices = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return prices
+
+    def write(self, vals):
+        result = super().write(vals)
+        self.env.registry.clear_cache()
+        return result
+
+    def unlink(self):
+        result = super().unlink()
+        self.env.registry.clear_cache()
+        return result
+
+    @api.model
+    @tools.ormcache('model_name')
+    def _get_prices(self, model_name):
+        """
+        Prices of a model per token, cached per worker.
+
+        Returns:
+            Tuple (input, output, cache write, cache read), None when the model has no price
+        """
+        price = self.sudo().search([('model_name', '=', model_name)], limit=1)
+        if not price:
+            return None
+        return tuple(value / 1e6 for value in (
+            price.input_price, price.output_price, price.cache_write_price, price.cache_read_price
+        ))
+
+    @api.model
+    def _get_usage_values(self, model_name, usage, cost=None):
+        """
+        Typed usage columns of a message or log record.
+
+        Args:
+            model_name: Model billed for the usage
+            usage: Anthropic usage block (accumulated over the agent hops)
+            cost: Cost already computed hop by hop, estimated from the usage when None
+
+        Returns:
+            Dictionary of model_name, token columns and cost
+        """
+        usage = usage or {}
+        values = {
+            'model_name': model_name or False,
+            'input_tokens': int(usage.get('input_tokens') or 0),
+            'output_tokens': int(usage.get('output_tokens') or 0),
+            'cache_write_tokens': int(usage.get('cache_creation_input_tokens') or 0),
+            'cache_read_tokens': int(usage.get('cache_read_input_tokens') or 0),
+        }
+        values['cost'] = self._compute_cost(model_name, usage) if cost is None else cost
+        return values
+
+    @api.model
+    def _compute_cost(self, model_name, usage):
+        """
+        Estimated cost in USD of a usage block.
+
+        Returns:
+            Cost, 0 when the model has no price
+        """
+        prices = self._get_prices(model_name) if model_name else None
+        if not prices or not usage:
+            return 0.0
+        input_price, output_price, cache_write_price, cache_read_price = prices
+        return (
+            int(usage.get('input_tokens') or 0) * input_price
+            + int(usage.get('output_tokens') or 0) * output_price
+            + int(usage.get('cache_creation_input_tokens') or 0) * cache_write_price
+            + int(usage.get('cache_read_input_tokens') or 0) * cache_read_price
+        )
+
+    @api.model
+    def _fill_missing_costs(self):
+        """Estimate the cost of the messages whose tokens were filled from their usage_data."""
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE chatbot_message m
+               SET cost = (m.input_tokens * p.input_price + m.output_tokens * p.output_price
+                           + m.cache_write_tokens * p.cache_write_price
+                           + m.cache_read_tokens * p.cache_read_price) / 1e6
+              FROM chatbot_model_price p
+             WHERE m.cost IS NULL AND m.input_tokens IS NOT NULL AND p.model_name = m.model_name
+        """)
+        if self.env.cr.rowcount:
+            self.env['chatbot.message'].invalidate_model(['cost'])
+        return True
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import logging
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+
+class RateLimitError(UserError):
+    """Raised when a request is rejected by the chatbot rate limiter (HTTP 429)."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ChatbotRateBucket(models.Model):
+    """
+    Token buckets of the chatbot rate limiter.
+
+    Each bucket holds at most one minute of its limit and refills
+    continuously. Buckets are read and updated in their own short
+    transaction, with their rows locked in key order, so that the check is
+    atomic across workers without holding locks during Anthropic calls.
+    """
+
+    _name = 'chatbot.rate.bucket'
+    _description = 'Chatbot Rate Limit Bucket'
+    _rec_name = 'key'
+    _log_access = False
+
+    key = fields.Char(
+        string='Key',
+        required=True,
+        index=True,
+        help='Limited quantity and scope, e.g. req:user:7, tok:company:1, req:global'
+    )
+
+    level = fields.Float(
+        string='Available',
+        help='Requests or tokens available; negative while paying back the tokens of large answers'
+    )
+
+    updated_at = fields.Float(
+        string='Updated At',
+        help='Epoch time of the last refill'
+    )
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'A bucket already exists for this key.'),
+    ]
+
+    @api.model
+    def _get_limits(self, config, kind):
+        """
+        Buckets applying to the current user for a quantity.
+
+        Args:
+            config: Active chatbot.config
+            kind: 'req' (requests per minute) or 'tok' (tokens per minute)
+
+        Returns:
+            List of (bucket key, limit per minute), unlimited scopes excluded
+        """
+        limits = [
+            (f'{kind}:user:{self.env.uid}', config[f'rate_user_{kind}_per_minute']),
+            (f'{kind}:company:{self.env.company.id}', config[f'rate_company_{kind}_per_minute']),
+            (f'{kind}:global', config[f'rate_global_{kind}_per_minute']),
+        ]
+        return [(key, limit) for key, limit in limits if limit > 0]
+
+    @api.model
+    def _lock_buckets(self, cr, limits):
+        """
+        Lock and refill buckets, creating them full on first use.
+
+        Returns:
+            Tuple (levels by key, database epoch time)
+        """
+        keys = sorted(key for key, _limit in limits)
+        cr.execute("""
+            INSERT INTO chatbot_rate_bucket (key, level, updated_at)
+            SELECT unnest(%s::varchar[]), unnest(%s::float[]), extract(epoch FROM clock_timestamp())
+            ON CONFLICT (key) DO NOTHING
+        """, (keys, [float(dict(limits)[key]) for key in keys]))
+        cr.execute("""
+            SELECT key, level, updated_at, extract(epoch FROM clock_timestamp())
+              FROM chatbot_rate_bucket
+             WHERE key IN %s
+             ORDER BY key
+               FOR UPDATE
+        """, (tuple(keys),))
+        levels = {}
+        now = 0.0
+        for key, level, updated_at, now in cr.fetchall():
+            limit = dict(limits)[key]
+            levels[key] = min(float(limit), level + max(now - updated_at, 0.0) * limit / 60.0)
+        return levels, now
+
+    @api.model
+    def _save_buckets(self, cr, levels, now):
+        """Write back the levels of buckets locked by _lock_buckets."""
+        for key, level in levels.items():
+            cr.execute(
+                "UPDATE chatbot_rate_bucket SET level = %s, updated_at = %s WHERE key = %s",
+                (level, now, key)
+            )
+
+    @api.model
+    def _acquire(self, config):
+        """
+        Take one request from the buckets of the current user.
+
+        Token buckets are not charged here (the size of the answer is not
+        known yet); they only have to be out of debt.
+
+        Returns:
+            0 when admitted, otherwise the number of seconds to wait (nothing is taken)
+        """
+        if not config.rate_limit_enabled:
+            return 0.0
+        request_limits = self._get_limits(config, 'req')
+        token_limits = self._get_limits(config, 'tok')
+        if not request_limits and not token_limits:
+            return 0.0
+
+        with Registry(self.env.cr.dbname).cursor() as cr:
+            levels, now = self._lock_buckets(cr, request_limits + token_limits)
+            wait = max([0.0] + [
+                (1.0 - levels[key]) * 60.0 / limit
+                for key, limit in request_limits + token_limits
+                if levels[key] < 1.0
+            ])
+            if wait:
+                return wait
+            for key, _limit in request_limits:
+                levels[key] -= 1.0
+            self._save_buckets(cr, levels, now)
+        return 0.0
+
+    @api.model
+    def _consume_tokens(self, config, usage):
+        """Charge the Anthropic tokens of an answer to the token buckets of the current user."""
+        if not config.rate_limit_enabled:
+            return
+        token_limits = self._get_limits(config, 'tok')
+        tokens = (
+            usage.get('input_tokens', 0)
+            + usage.get('cache_creation_input_tokens', 0)
+            + usage.get('output_tokens', 0)
+        )
+        if not token_limits or not tokens:
+            return
+        try:
+            with Registry(self.env.cr.dbname).cursor() as cr:
+                levels, now = self._lock_buckets(cr, token_limits)
+                for key, limit in token_limits:
+                    # The debt is capped to one minute of the limit
+                    levels[key] = max(levels[key] - tokens, -float(limit))
+                self._save_buckets(cr, levels, now)
+        except Exception as e:
+            _logger.warning(f"Chatbot rate limiter token update failed: {e}")
+
+    @api.model
+    def action_reset_buckets(self):
+        """Refill every bucket."""
+        self.search([]).unlink()
+        return True
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Number of recent entries scanned by the similarity lookup
+SIMILARITY_CANDIDATES = 200
+
+
+class ChatbotResponseCache(models.Model):
+    """Cache of chatbot answers keyed on the normalized user question."""
+
+    _name = 'chatbot.response.cache'
+    _description = 'Chatbot Response Cache'
+    _order = 'last_hit_date desc, id desc'
+    _rec_name = 'normalized_input'
+
+    cache_key = fields.Char(
+        string='Cache Key',
+        required=True,
+        index=True
+    )
+
+    normalized_input = fields.Text(
+        string='Normalized Question',
+        required=True
+    )
+
+    model_name = fields.Char(
+        string='Model',
+        required=True
+    )
+
+    config_id = fields.Many2one(
+        'chatbot.config',
+        string='Configuration',
+        ondelete='cascade',
+        index=True
+    )
+
+    scope = fields.Char(
+        string='Scope',
+        required=True,
+        index=True,
+        help='User or company sharing this entry (e.g. user:7, company:1)'
+    )
+
+    response = fields.Text(
+        string='Response',
+        required=True
+    )
+
+    related_models = fields.Char(
+        string='Related Models',
+        help='Odoo models read by tools to build the answer; a change on them invalidates the entry'
+    )
+
+    model_stamps = fields.Char(
+        string='Model Stamps',
+        help='Change stamps of the related models when the answer was stored (see chatbot.cache.validity)'
+    )
+
+    hit_count = fields.Integer(
+        string='Hits',
+        default=0
+    )
+
+    last_hit_date = fields.Datetime(
+        string='Last Used',
+        default=fields.Datetime.now,
+        index=True
+    )
+
+    expires_at = fields.Datetime(
+        string='Expires At',
+        required=True,
+        index=True
+    )
+
+    _sql_constraints = [
+        ('cache_key_uniq', 'unique(cache_key)', 'A cache entry already exists for this key.'),
+    ]
+
+    @api.model
+    def _normalize_input(self, text):
+        """Normalize a question so that trivial variations share a cache entry."""
+        text = unicodedata.normalize('NFKC', text or '').lower()
+        text = re.sub(r'[^\w\s]', ' ', text)
+        return ' '.join(text.split())
+
+    @api.model
+    def _get_scope(self, config):
+        """
+        Return the sharing scope of the current user's entries.
+
+        Answers are only shared within a company when no tool can run: a
+        tool reads Odoo data with the access rights of the asker (ORM
+        backend) or of the MCP connection, which must not reach the other
+        users through the cache.
+        """
+        if config.response_cache_scope == 'company' and not config._tools_available():
+            return f'company:{self.env.company.id}'
+        return f'user:{self.env.uid}'
+
+    @api.model
+    def _config_fingerprint(self, config):
+        """Settings that change the answer; editing them makes old entries unreachable."""
+        return [
+            config.id,
+            config.temperature,
+            config.max_tokens,
+            config.system_prompt_prefix or '',
+            config.mcp_connected,
+            config.tool_backend,
+        ]
+
+    @api.model
+    def _make_key(self, normalized_input, config, scope):
+        """Build the exact-match key of a question."""
+        raw = json.dumps([
+            normalized_input, config.model_name, scope, self._config_fingerprint(config)
+        ])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @api.model
+    def _ngrams(self, text, size=3):
+        """Character n-grams used by the similarity lookup."""
+        padded = f' {text} '
+        return {padded[i:i + size] for i in range(max(len(padded) - size + 1, 1))}
+
+    @api.model
+    def _lookup(self, user_input, config):
+        """
+        Find a live cache entry for a question.
+
+        Exact match first; when a similarity threshold is configured, fall
+        back to the closest recent entry by character trigram similarity.
+        An entry whose related models changed since it was stored is a miss.
+
+        Returns:
+            chatbot.response.cache record (empty when missed)
+        """
+        normalized = self._normalize_input(user_input)
+        scope = self._get_scope(config)
+        now = fields.Datetime.now()
+        entry = self.search([
+            ('cache_key', '=', self._make_key(normalized, config, scope)),
+            ('expires_at', '>', now)
+        ], limit=1)
+
+        if not entry and config.response_cache_similarity > 0:
+            candidates = self.search([
+                ('config_id', '=', config.id),
+                ('model_name', '=', config.model_name),
+                ('scope', '=', scope),
+                ('expires_at', '>', now)
+            ], limit=SIMILARITY_CANDIDATES)
+            grams = self._ngrams(normalized)
+            best_score = 0.0
+            for candidate in candidates:
+                candidate_grams = self._ngrams(candidate.normalized_input)
+                score = len(grams & candidate_grams) / len(grams | candidate_grams)
+                if score > best_score:
+                    entry, best_score = candidate, score
+            if best_score < config.response_cache_similarity:
+                entry = self.browse()
+
+        if entry and not self.env['chatbot.cache.validity']._is_valid(entry.model_stamps):
+            entry = self.browse()
+        if entry:
+            entry.write({
+                'hit_count': entry.hit_count + 1,
+                'last_hit_date': now
+            })
+        return entry
+
+    @api.model
+    def _store(self, user_input, config, result):
+        """Store a successful answer and evict the least recently used entries."""
+        normalized = self._normalize_input(user_input)
+        scope = self._get_scope(config)
+        key = self._make_key(normalized, config, scope)
+        related_models = result.get('tool_models') or []
+        values = {
+            'response': result.get('message', ''),
+            'related_models': f",{','.join(related_models)}," if related_models else False,
+            'model_stamps': self.env['chatbot.cache.validity']._dump(related_models),
+            'last_hit_date': fields.Datetime.now(),
+            'expires_at': fields.Datetime.now() + timedelta(seconds=config.response_cache_ttl),
+        }
+        entry = self.search([('cache_key', '=', key)], limit=1)
+        if entry:
+            entry.write(values)
+        else:
+            entry = self.create(dict(
+                values,
+                cache_key=key,
+                normalized_input=normalized,
+                model_name=config.model_name,
+                config_id=config.id,
+                scope=scope
+            ))
+
+        self._evict(config.response_cache_max_entries)
+        return entry
+
+    @api.model
+    def _evict(self, max_entries):
+        """Delete expired entries and keep at most max_entries (LRU)."""
+        self.flush_model()
+        self.env.cr.execute("""
+            DELETE FROM chatbot_response_cache
+             WHERE expires_at <= (now() at time zone 'UTC')
+                OR id IN (
+                    SELECT id FROM chatbot_response_cache
+                     ORDER BY last_hit_date DESC NULLS LAST, id DESC
+                    OFFSET %s
+                )
+        """, (max(max_entries, 0),))
+        if self.env.cr.rowcount:
+            self.invalidate_model()
+
+    @api.model
+    def action_clear_cache(self):
+        """Remove every cached answer."""
+        self.search([]).unlink()
+        return True
+
+    @api.autovacuum
+    def _gc_expired_entries(self):
+        """Remove expired cache entries."""
+        records = self.search([('expires_at', '<=', fields.Datetime.now())])
+        records.unlink()
+        _logger.info(f'Cleaned up {len(records)} expired chatbot response cache entries')
\ No newline at end of file
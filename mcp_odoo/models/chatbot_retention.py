@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from odoo import models, fields, api, tools
+
+_logger = logging.getLogger(__name__)
+
+# Seconds a purge keeps deleting batches before leaving the rest to the next run
+RETENTION_TIME_BUDGET = 300
+
+
+class ChatbotRetention(models.AbstractModel):
+    """Retention engine: batched deletion of aged chatbot records, with optional archiving."""
+
+    _name = 'chatbot.retention'
+    _description = 'Chatbot Retention Engine'
+
+    @api.model
+    def _purge(self, model_name, days, batch_size=None, archive=None, time_budget=RETENTION_TIME_BUDGET,
+               config=None, where=None, params=(), commit=True):
+        """
+        Delete the records of a model created more than `days` days ago.
+
+        Records are deleted by batches of ids, each batch committed in its
+        own transaction from the cron, so that locks are short and memory
+        stays bounded. When archiving is enabled, each batch is appended to
+        a gzip compressed JSON lines file before it is deleted.
+
+        Args:
+            model_name: Model to purge
+            days: Retention in days (0 = keep forever)
+            batch_size: Records per batch, from the active configuration when not given
+            archive: Archive before deleting, from the active configuration when not given
+            time_budget: Seconds after which the remaining records are left to the next run
+            config: Configuration whose settings apply, the active one when not given
+            where: SQL condition restricting the purged records, e.g. to a configuration
+            params: Parameters of the condition
+            commit: Commit each batch; False when called from a request,
+                whose transaction must not be committed halfway
+
+        Returns:
+            Metrics dictionary (deleted, batches, archive, duration, done)
+        """
+        config = config or self.env['chatbot.config'].sudo().get_active_config()
+        batch_size = batch_size or config.retention_batch_size or 1000
+        archive = config.retention_archive if archive is None else archive
+        metrics = {'model': model_name, 'deleted': 0, 'batches': 0, 'archive': False, 'done': True}
+        if days <= 0:
+            return metrics
+
+        model = self.env[model_name].sudo().with_context(active_test=False)
+        cutoff = fields.Datetime.now() - timedelta(days=days)
+        start = time.monotonic()
+        archive_path = self._get_archive_file(config, model_name) if archive else None
+
+        condition = f' AND ({where})' if where else ''
+        while True:
+            self.env.cr.execute(
+                f'SELECT id FROM "{model._table}" WHERE create_date < %s{condition} ORDER BY id LIMIT %s',
+                (cutoff, *params, batch_size)
+            )
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if not ids:
+                break
+            records = model.browse(ids)
+            if archive_path:
+                self._archive_records(records, archive_path)
+                metrics['archive'] = archive_path
+            records.unlink()
+            if commit:
+                self._commit()
+                self.env.invalidate_all()
+            metrics['deleted'] += len(ids)
+            metrics['batches'] += 1
+            _logger.debug(f"Retention {model_name}: batch {metrics['batches']} deleted {len(ids)} records")
+            if len(ids) < batch_size:
+                break
+            if time.monotonic() - start > time_budget:
+                metrics['done'] = False
+                break
+
+        metrics['duration'] = round(time.monotonic() - start, 2)
+        _logger.info(
+            f"Retention {model_name}: deleted {metrics['deleted']} records older than {days} days "
+            f"in {metrics['batches']} batches ({metrics['duration']}s"
+            f"{', archived to ' + metrics['archive'] if metrics['archive'] else ''}"
+            f"{', incomplete' if not metrics['done'] else ''})"
+        )
+        return metrics
+
+    @api.model
+    def _commit(self):
+        """Commit the deleted batch, except in tests where the transaction is shared."""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _get_archive_file(self, config, model_name):
+        """Path of the archive file of this run, its directory created when needed."""
+        directory = config.retention_archive_path or os.path.join(
+            tools.config.filestore(self.env.cr.dbname), 'mcp_odoo_archive'
+        )
+        os.makedirs(directory, exist_ok=True)
+        stamp = fields.Datetime.now().strftime('%Y%m%d%H%M%S')
+        return os.path.join(directory, f"{model_name.replace('.', '_')}-{stamp}.jsonl.gz")
+
+    @api.model
+    def _archive_records(self, records, path):
+        """Append records to a gzip compressed JSON lines file (one gzip member per batch)."""
+        field_names = [
+            name for name, field in records._fields.items()
+            if field.store and field.type not in ('binary', 'one2many', 'many2many')
+        ]
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for values in records.read(field_names, load=None):
+                archive.write(json.dumps(values, default=str) + '\n')
+
+    @api.model
+    def _get_policies(self, config):
+        """
+        Retention of the records of a configuration.
+
+        Returns:
+            List of (model name, retention in days, SQL condition, parameters),
+            the condition selecting the records of the configuration
+        """
+        messages = 'SELECT id FROM chatbot_message WHERE config_id = %s'
+        return [
+            ('chatbot.message', config.retention_message_days, 'config_id = %s', (config.id,)),
+            ('chatbot.trace', config.retention_service_log_days, f'message_id IN ({messages})', (config.id,)),
+        ]
+
+    @api.model
+    def _get_shared_policies(self, configs):
+        """
+        Retention of the records no configuration owns: API logs, messages
+        and traces without configuration.
+
+        The longest retention of the configurations applies (keep forever as
+        soon as one of them does), so that no policy loses records it keeps.
+
+        Returns:
+            List of (model name, retention in days, SQL condition, parameters)
+        """
+        def longest(days):
+            return 0 if not days or 0 in days else max(days)
+
+        message_days = longest(configs.mapped('retention_message_days'))
+        log_days = longest(configs.mapped('retention_service_log_days'))
+        orphans = 'SELECT id FROM chatbot_message WHERE config_id IS NULL'
+        return [
+            ('anthropic.service', log_days, None, ()),
+            ('mcp.service', log_days, None, ()),
+            ('chatbot.message', message_days, 'config_id IS NULL', ()),
+            ('chatbot.trace', log_days, f'message_id IS NULL OR message_id IN ({orphans})', ()),
+        ]
+
+    @api.autovacuum
+    def _gc_expired_records(self):
+        """
+        Apply the retention policy of every configuration (archived ones
+        included) to its own records, then the shared policy to the records
+        of no configuration; the outcome is stored on each configuration.
+        """
+        configs = self.env['chatbot.config'].sudo().with_context(active_test=False).search([])
+        active_config = self.env['chatbot.config'].sudo().get_active_config()
+        results = []
+        for config in configs | active_config:
+            config_results = [
+                self._purge(model_name, days, config=config, where=where, params=params)
+                for model_name, days, where, params in self._get_policies(config)
+            ]
+            if config == active_config:
+                config_results += [
+                    self._purge(model_name, days, config=config, where=where, params=params)
+                    for model_name, days, where, params in self._get_shared_policies(configs | active_config)
+                ]
+            config.write({
+                'last_retention_date': fields.Datetime.now(),
+                'last_retention_result': '\n'.join(
+                    f"{m['model']}: {m['deleted']} deleted in {m['batches']} batches"
+                    f" ({m.get('duration', 0)}s){'' if m['done'] else ', to be continued'}"
+                    for m in config_results
+                ),
+            })
+            results += config_results
+        return results
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Maximum number of not yet summarized turns loaded to build the history window
+HISTORY_SCAN_LIMIT = 200
+
+# Fixed per-message overhead (role, separators) added by the token estimator
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_WORD_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+
+def estimate_tokens(text):
+    """
+    Fast local estimate of the number of tokens of a text.
+
+    Latin text averages about 4 characters per token while code, numbers and
+    non-Latin scripts are denser; taking the larger of the character and the
+    word/punctuation based estimates stays on the safe side for both.
+    """
+    if not text:
+        return 0
+    return max(len(text) // 4, len(_WORD_RE.findall(text))) + 1
+
+
+class ChatbotSession(models.Model):
+    """Conversation state of a chatbot session: incremental summary of its older turns."""
+
+    _name = 'chatbot.session'
+    _description = 'Chatbot Session'
+    _order = 'write_date desc, id desc'
+    _rec_name = 'session_id'
+
+    session_id = fields.Char(
+        string='Session ID',
+        required=True,
+        index=True
+    )
+
+    user_id = fields.Many2one(
+        'res.users',
+        string='User',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+
+    summary = fields.Text(
+        string='Summary',
+        help='Running summary of the turns that no longer fit in the history window'
+    )
+
+    summarized_message_id = fields.Integer(
+        string='Summarized Up To',
+        default=0,
+        help='Last chatbot.message folded into the summary'
+    )
+
+    summary_tokens = fields.Integer(
+        string='Summary Tokens',
+        help='Estimated size of the summary'
+    )
+
+    summary_pending = fields.Boolean(
+        string='Summary Pending',
+        default=False,
+        index=True,
+        help='The session outgrew its history budget: its older turns are folded into the summary in the background'
+    )
+
+    _sql_constraints = [
+        ('session_user_uniq', 'unique(session_id, user_id)', 'A session already exists for this user.'),
+    ]
+
+    @api.model
+    def _get_session(self, session_id):
+        """Return the current user's session record, created on first use."""
+        session = self.search([
+            ('session_id', '=', session_id),
+            ('user_id', '=', self.env.uid)
+        ], limit=1)
+        if not session:
+            session = self.create({'session_id': session_id, 'user_id': self.env.uid})
+        return session
+
+    @api.model
+    def _get_context(self, session_id, config, before_message_id=None):
+        """
+        Build the conversation context of a session for the next question.
+
+        Processed turns are replayed newest first until the history token
+        budget is reached. When the session outgrows the budget, folding
+        its older turns into the summary is left to a background job, so
+        that the question is not delayed by a summarization call: until
+        then the previous summary is sent with the turns that fit.
+
+        Args:
+            session_id: chatbot.message session identifier
+            config: Active chatbot.config
+            before_message_id: Only replay turns older than this message
+
+        Returns:
+            Tuple (list of Messages API messages, summary text)
+        """
+        budget = config.history_token_budget
+        if not session_id or budget <= 0:
+            return [], ''
+
+        session = self._get_session(session_id)
+        turns = self._get_turns(session, before_message_id)
+        sizes = self._get_sizes(turns)
+        if sum(sizes) > budget:
+            session._request_fold()
+            turns = turns[:self._count_fitting(sizes, budget)]
+
+        messages = []
+        for turn in reversed(turns):
+            messages.append({'role': 'user', 'content': turn['user_message']})
+            messages.append({'role': 'assistant', 'content': turn['bot_response']})
+        return messages, session.summary or ''
+
+    @api.model
+    def _get_turns(self, session, before_message_id=None):
+        """
+        Processed turns of a session not yet folded into its summary.
+
+        Returns:
+            List of {'id', 'user_message', 'bot_response'}, newest first
+        """
+        domain = [
+            ('session_id', '=', session.session_id),
+            ('user_id', '=', session.user_id.id),
+            ('status', '=', 'processed'),
+            ('id', '>', session.summarized_message_id),
+        ]
+        if before_message_id:
+            domain.append(('id', '<', before_message_id))
+        turns = self.env['chatbot.message'].sudo().search_read(
+            domain, ['user_message', 'bot_response'], order='id desc', limit=HISTORY_SCAN_LIMIT
+        )
+        return [turn for turn in turns if turn['user_message'] and turn['bot_response']]
+
+    @api.model
+    def _get_sizes(self, turns):
+        """Estimated size in tokens of each turn."""
+        return [
+            estimate_tokens(turn['user_message']) + estimate_tokens(turn['bot_response'])
+            + 2 * MESSAGE_TOKEN_OVERHEAD
+            for turn in turns
+        ]
+
+    def _request_fold(self):
+        """Have the background job fold the older turns of the sessions."""
+        pending = self.filtered(lambda session: not session.summary_pending)
+        if pending:
+            pending.write({'summary_pending': True})
+            self.env.ref('mcp_odoo.ir_cron_chatbot_fold_summaries').sudo()._trigger()
+
+    @api.model
+    def _cron_fold_summaries(self):
+        """
+        Fold the older turns of the sessions that outgrew their history
+        budget into their summary, keeping half of the budget as verbatim
+        history so that summarization only runs every few turns. A session
+        whose summarization fails stays pending until the next run.
+        """
+        for session in self.search([('summary_pending', '=', True)]):
+            config = self.env['chatbot.config'].with_company(session.user_id.company_id).get_active_config()
+            budget = config.history_token_budget
+            turns = self._get_turns(session)
+            sizes = self._get_sizes(turns)
+            if budget > 0 and sum(sizes) > budget:
+                keep = self._count_fitting(sizes, budget // 2)
+                if not self._fold_turns(session, list(reversed(turns[keep:])), config):
+                    continue
+            session.summary_pending = False
+            self._commit()
+
+    @api.model
+    def _commit(self):
+        """Commit a folded session, except in tests where the transaction is shared."""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _count_fitting(self, sizes, budget):
+        """Number of leading turns whose cumulated size fits in the budget."""
+        total = 0
+        for count, size in enumerate(sizes):
+            total += size
+            if total > budget:
+                return count
+        return len(sizes)
+
+    @api.model
+    def _fold_turns(self, session, turns, config):
+        """
+        Merge turns (oldest first) into the session summary.
+
+        Returns:
+            True when the summary was updated
+        """
+        if not turns:
+            return True
+        try:
+            summary = self.env['anthropic.service']._summarize_conversation(
+                session.summary or '', turns, config
+            )
+        except Exception as e:
+            _logger.warning(f"Chatbot session summary failed for {session.session_id}: {e}")
+            return False
+        session.write({
+            'summary': summary,
+            'summarized_message_id': max(turn['id'] for turn in turns),
+            'summary_tokens': estimate_tokens(summary),
+        })
+        return True
+
+    @api.autovacuum
+    def _gc_orphan_sessions(self):
+        """Remove the sessions whose messages were all deleted."""
+        self.env.cr.execute("""
+            DELETE FROM chatbot_session s
+             WHERE NOT EXISTS (
+                    SELECT 1 FROM chatbot_message m
+                     WHERE m.session_id = s.session_id AND m.user_id = s.user_id
+                   )
+        """)
+        _logger.info(f'Cleaned up {self.env.cr.rowcount} orphan chatbot sessions')
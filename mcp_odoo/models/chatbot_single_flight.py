@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+from odoo import models, fields, api
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+# Requests in flight in this worker, by (database, canonical key): the
+# worker serves every database, identical questions of two databases must
+# never share an answer
+_FLIGHTS_LOCK = threading.Lock()
+_FLIGHTS = {}
+_FLIGHT_STATS = {'leaders': 0, 'coalesced': 0, 'coalesced_remote': 0, 'wait_timeouts': 0}
+
+
+class _Flight:
+    """Upstream call shared by the identical requests arriving while it runs."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def _count(stat):
+    with _FLIGHTS_LOCK:
+        _FLIGHT_STATS[stat] += 1
+
+
+class ChatbotSingleFlight(models.AbstractModel):
+    """
+    Single-flight deduplication of identical deterministic requests.
+
+    The first request of a canonical key (question, model, settings, sharing
+    scope) calls Anthropic; the identical requests arriving meanwhile wait for
+    its answer instead of making their own call. Within a worker they wait on
+    the first thread; across workers (optional) the first request holds a
+    PostgreSQL advisory lock and publishes its answer in the response cache,
+    where the others read it once the lock is released. Coalescing across
+    workers therefore requires the response cache.
+    """
+
+    _name = 'chatbot.single.flight'
+    _description = 'Chatbot Request Coalescing'
+
+    @api.model
+    def _get_key(self, user_input, config):
+        """
+        Canonical key of a question, the one of its response cache entry.
+
+        Returns:
+            Key, or None when the request must not be shared (sampled answers)
+        """
+        if not config.request_coalescing or config.temperature:
+            return None
+        cache = self.env['chatbot.response.cache']
+        return cache._make_key(cache._normalize_input(user_input), config, cache._get_scope(config))
+
+    @api.model
+    def _run(self, key, user_input, config, func):
+        """
+        Run func() once for the identical requests in flight.
+
+        Args:
+            key: Canonical key (see _get_key), scoped to the current database here
+            user_input: The user question
+            config: Active chatbot.config
+            func: Callable returning the call_api-like result of the upstream call
+
+        Returns:
+            Tuple (result, stored): stored is set when the answer is already in
+            the response cache (shared with another request)
+        """
+        flight_key = (self.env.cr.dbname, key)
+        with _FLIGHTS_LOCK:
+            flight = _FLIGHTS.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = _FLIGHTS[flight_key] = _Flight()
+                _FLIGHT_STATS['leaders'] += 1
+
+        if not leader:
+            if flight.done.wait(config.coalescing_timeout or None) and flight.result:
+                _count('coalesced')
+                return self._shared_result(flight.result['message']), True
+            if not flight.done.is_set():
+                _count('wait_timeouts')
+            # The first request failed or is too slow: make our own call
+            return func(), False
+
+        try:
+            if config.coalescing_across_workers and config.response_cache_enabled:
+                result, stored = self._run_across_workers(key, user_input, config, func)
+            else:
+                result, stored = func(), False
+            if result.get('success'):
+                flight.result = result
+            return result, stored
+        finally:
+            with _FLIGHTS_LOCK:
+                _FLIGHTS.pop(flight_key, None)
+            flight.done.set()
+
+    @api.model
+    def _run_across_workers(self, key, user_input, config, func):
+        """
+        Leader of this worker: coalesce with the other workers through an advisory lock.
+
+        The lock is held by a dedicated connection for the duration of the
+        upstream call; the answer is committed to the response cache before
+        the lock is released, and read by the waiters with a fresh cursor
+        (their own transaction would not see it).
+
+        PostgreSQL advisory locks belong to the current database: the same
+        key taken in another database is another lock.
+        """
+        lock_id = int(key[:15], 16)
+        registry = Registry(self.env.cr.dbname)
+        with registry.cursor() as lock_cr:
+            lock_cr.execute("SELECT pg_try_advisory_lock(%s)", (lock_id,))
+            if lock_cr.fetchone()[0]:
+                try:
+                    result = func()
+                    stored = result.get('success') and self._publish(user_input, config, result)
+                    return result, bool(stored)
+                finally:
+                    lock_cr.execute("SELECT pg_advisory_unlock(%s)", (lock_id,))
+
+            # Another worker is calling Anthropic for the same request: wait for it
+            try:
+                lock_cr.execute("SET LOCAL lock_timeout = %s", (f'{config.coalescing_timeout or 60}s',))
+                lock_cr.execute("SELECT pg_advisory_lock(%s)", (lock_id,))
+                lock_cr.execute("SELECT pg_advisory_unlock(%s)", (lock_id,))
+            except Exception as e:
+                _count('wait_timeouts')
+                _logger.info(f"Coalesced chatbot request not answered in time, calling Anthropic: {e}")
+                lock_cr.rollback()
+                return func(), False
+
+        with registry.cursor() as cr:
+            env = api.Environment(cr, self.env.uid, self.env.context)
+            entry = env['chatbot.response.cache'].sudo().search([
+                ('cache_key', '=', key),
+                ('expires_at', '>', fields.Datetime.now())
+            ], limit=1)
+            response = entry.response if entry else None
+        if response is None:
+            # The other worker failed: make our own call
+            return func(), False
+        _count('coalesced_remote')
+        return self._shared_result(response), True
+
+    @api.model
+    def _publish(self, user_input, config, result):
+        """Commit an answer to the response cache for the waiting workers."""
+        if not config.response_cache_enabled:
+            return False
+        try:
+            with Registry(self.env.cr.dbname).cursor() as cr:
+                env = api.Environment(cr, self.env.uid, self.env.context)
+                env['chatbot.response.cache'].sudo()._store(user_input, config.with_env(env), result)
+            return True
+        except Exception as e:
+            _logger.warning(f"Coalesced chatbot answer not published: {e}")
+            return False
+
+    @api.model
+    def _shared_result(self, message):
+        """Result of a request answered by another one (not billed to it)."""
+        return {
+            'success': True,
+            'message': message,
+            'usage': {},
+            'coalesced': True
+        }
+
+    @api.model
+    def get_single_flight_stats(self):
+        """Coalescing counters of the current worker."""
+        with _FLIGHTS_LOCK:
+            return dict(_FLIGHT_STATS, in_flight=len(_FLIGHTS))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class ToolResultLRU:
+    """
+    Per-worker LRU cache of tool results with a per-entry TTL.
+
+    The worker serves every database: entries are indexed by (database,
+    model) so that clearing the cache of a database keeps the others.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_model = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _pop(self, key):
+        _expires, model_key, _value = self._entries.pop(key)
+        keys = self._keys_by_model.get(model_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_model[model_key]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, model_key, value, ttl, max_entries):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.monotonic() + ttl, model_key, value)
+            self._keys_by_model.setdefault(model_key, set()).add(key)
+            while len(self._entries) > max_entries:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self, dbname):
+        with self._lock:
+            for model_key in [model_key for model_key in self._keys_by_model if model_key[0] == dbname]:
+                for key in list(self._keys_by_model.get(model_key, ())):
+                    self._pop(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_MEMORY_CACHE = ToolResultLRU()
+
+
+class ChatbotToolCache(models.Model):
+    """Shared (DB-backed) level of the tool result cache."""
+
+    _name = 'chatbot.tool.cache'
+    _description = 'Chatbot Tool Result Cache'
+    _order = 'id desc'
+    _rec_name = 'cache_key'
+
+    cache_key = fields.Char(
+        string='Cache Key',
+        required=True,
+        index=True
+    )
+
+    res_model = fields.Char(
+        string='Odoo Model',
+        index=True,
+        help='Model read by the tool call; a change on it invalidates the entry'
+    )
+
+    model_stamps = fields.Char(
+        string='Model Stamps',
+        help='Change stamp of the model when the result was stored (see chatbot.cache.validity)'
+    )
+
+    result = fields.Text(
+        string='Result',
+        help='JSON encoded tool result'
+    )
+
+    hit_count = fields.Integer(
+        string='Hits',
+        default=0
+    )
+
+    expires_at = fields.Datetime(
+        string='Expires At',
+        required=True,
+        index=True
+    )
+
+    _sql_constraints = [
+        ('cache_key_uniq', 'unique(cache_key)', 'A cache entry already exists for this key.'),
+    ]
+
+    @api.model
+    def _make_key(self, scope, url, payload, config):
+        """
+        Canonical key of a tool call: same scope, endpoint and payload share a result.
+
+        The database and the configuration are part of the key: the memory
+        level is shared by every database of the worker, and two
+        configurations may reach the same MCP URL with other credentials.
+        """
+        raw = json.dumps([self.env.cr.dbname, config.id, scope, url, payload], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @api.model
+    def _get(self, key, config):
+        """
+        Look a tool result up, in the worker memory first then in the database.
+
+        Either way the result is only served while the model it was read
+        from is unchanged: the change stamps are shared by every worker,
+        so a write made through another worker invalidates the memory
+        entries of this one too.
+
+        Returns:
+            Cached result, or None when missed
+        """
+        validity = self.env['chatbot.cache.validity']
+        entry = _MEMORY_CACHE.get(key)
+        if entry is not None:
+            stamps, value = entry
+            if validity._is_valid(stamps):
+                return value
+        if not config.tool_cache_db:
+            return None
+
+        entry = self.search([
+            ('cache_key', '=', key),
+            ('expires_at', '>', fields.Datetime.now())
+        ], limit=1)
+        if not entry or not validity._is_valid(entry.model_stamps):
+            return None
+        self.env.cr.execute(
+            "UPDATE chatbot_tool_cache SET hit_count = hit_count + 1 WHERE id = %s", (entry.id,)
+        )
+        value = json.loads(entry.result)
+        remaining = (entry.expires_at - fields.Datetime.now()).total_seconds()
+        _MEMORY_CACHE.set(
+            key, (self.env.cr.dbname, entry.res_model), (entry.model_stamps, value), remaining,
+            config.tool_cache_max_entries
+        )
+        return value
+
+    @api.model
+    def _set(self, key, res_model, value, config):
+        """Store a tool result in the worker memory and, if enabled, in the database."""
+        stamps = self.env['chatbot.cache.validity']._dump([res_model] if res_model else [])
+        _MEMORY_CACHE.set(
+            key, (self.env.cr.dbname, res_model), (stamps, value), config.tool_cache_ttl,
+            config.tool_cache_max_entries
+        )
+        if not config.tool_cache_db:
+            return
+        self.flush_model()
+        self.env.cr.execute("""
+            INSERT INTO chatbot_tool_cache (cache_key, res_model, model_stamps, result, hit_count, expires_at,
+                                            create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, 0, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+            ON CONFLICT (cache_key) DO UPDATE
+               SET result = EXCLUDED.result,
+                   res_model = EXCLUDED.res_model,
+                   model_stamps = EXCLUDED.model_stamps,
+                   expires_at = EXCLUDED.expires_at,
+                   write_date = EXCLUDED.write_date
+        """, (
+            key, res_model, stamps, json.dumps(value, default=str),
+            fields.Datetime.now() + timedelta(seconds=config.tool_cache_ttl),
+            self.env.uid, self.env.uid
+        ))
+        self.invalidate_model()
+
+    @api.model
+    def get_tool_cache_stats(self):
+        """Hit-rate metrics of the tool result cache (memory counters are per worker)."""
+        stats = _MEMORY_CACHE.stats()
+        self.env.cr.execute("""
+            SELECT count(*), coalesce(sum(hit_count), 0)
+              FROM chatbot_tool_cache
+             WHERE expires_at > now() at time zone 'UTC'
+        """)
+        stats['db_entries'], stats['db_hits'] = self.env.cr.fetchone()
+        return stats
+
+    @api.model
+    def action_clear_cache(self):
+        """Remove every cached tool result."""
+        _MEMORY_CACHE.clear(self.env.cr.dbname)
+        self.search([]).unlink()
+        return True
+
+    @api.autovacuum
+    def _gc_expired_entries(self):
+        """Remove expired tool cache entries."""
+        records = self.search([('expires_at', '<=', fields.Datetime.now())])
+        records.unlink()
+        _logger.info(f'Cleaned up {len(records)} expired chatbot tool cache entries')
\ No newline at end of file
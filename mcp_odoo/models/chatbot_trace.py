@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+_CURRENT_TRACE = contextvars.ContextVar('chatbot_trace', default=None)
+# (trace, index of the open span) of the current thread or task: the runner
+# threads and the event loop tasks of a request each have their own
+_CURRENT_SPAN = contextvars.ContextVar('chatbot_span', default=None)
+
+
+class Trace:
+    """
+    Spans of one chatbot request.
+
+    A span is stored as [name, start_ms, duration_ms, parent_index, attributes],
+    offsets being relative to the start of the trace.
+    """
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.start_ns = time.time_ns()
+        self._t0 = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def _now_ms(self):
+        return (time.perf_counter_ns() - self._t0) / 1e6
+
+    @property
+    def duration_ms(self):
+        return round(self._now_ms(), 3)
+
+    def _current_span(self):
+        """Index of the span open in the current context, None at the top level."""
+        current = _CURRENT_SPAN.get()
+        return current[1] if current is not None and current[0] is self else None
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time a phase of the current thread or task; yields its attributes to enrich them."""
+        start = self._now_ms()
+        with self._lock:
+            index = len(self.spans)
+            self.spans.append([name, round(start, 3), None, self._current_span(), attributes])
+        # Restored with set rather than reset: a span may be left in a generator
+        # resumed from another context (streamed answers)
+        outer = _CURRENT_SPAN.get()
+        _CURRENT_SPAN.set((self, index))
+        try:
+            yield attributes
+        finally:
+            _CURRENT_SPAN.set(outer)
+            self.spans[index][2] = round(self._now_ms() - start, 3)
+
+    def wrap(self, name, func, **attributes):
+        """Time a function run in another thread, as a child of the current span."""
+        parent = self._current_span()
+
+        def timed(*args, **kwargs):
+            start = self._now_ms()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.spans.append([
+                        name, round(start, 3), round(self._now_ms() - start, 3), parent, attributes
+                    ])
+        return timed
+
+    def wrap_async(self, name, func, **attributes):
+        """Same as wrap, for a coroutine function run on the event loop."""
+        parent = self._current_span()
+
+        async def timed(*args, **kwargs):
+            start = self._now_ms()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.spans.append([
+                        name, round(start, 3), round(self._now_ms() - start, 3), parent, attributes
+                    ])
+        return timed
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a phase of the current chatbot request (no-op outside of a trace)."""
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield {}
+        return
+    with trace.span(name, **attributes) as span_attributes:
+        yield span_attributes
+
+
+def current_trace():
+    """Trace of the current chatbot request, None when not traced."""
+    return _CURRENT_TRACE.get()
+
+
+class ChatbotTrace(models.Model):
+    """Latency breakdown of a chatbot request."""
+
+    _name = 'chatbot.trace'
+    _description = 'Chatbot Request Trace'
+    _order = 'id desc'
+    _rec_name = 'trace_id'
+
+    message_id = fields.Many2one(
+        'chatbot.message',
+        string='Message',
+        ondelete='cascade',
+        index=True
+    )
+
+    trace_id = fields.Char(
+        string='Trace ID',
+        required=True,
+        index=True
+    )
+
+    duration_ms = fields.Float(
+        string='Duration (ms)'
+    )
+
+    spans = fields.Json(
+        string='Spans',
+        help='[name, start_ms, duration_ms, parent_index, attributes] of each phase'
+    )
+
+    @api.model
+    @contextmanager
+    def _trace(self, message=None, name='chatbot.request'):
+        """
+        Trace a chatbot request.
+
+        Nested calls join the trace already running, so the outermost caller
+        records the whole request.
+
+        Yields:
+            Trace
+        """
+        outer = _CURRENT_TRACE.get()
+        if outer is not None:
+            yield outer
+            return
+        trace = Trace()
+        token = _CURRENT_TRACE.set(trace)
+        try:
+            with trace.span(name):
+                yield trace
+        finally:
+            _CURRENT_TRACE.reset(token)
+            self._record(trace, message)
+
+    @api.model
+    def _record(self, trace, message=None):
+        """Store a finished trace and export it when an export file is configured."""
+        config = (message and message.config_id or self.env['chatbot.config'].get_active_config()).sudo()
+        if not config.tracing_enabled:
+            return
+        try:
+            self.sudo().create({
+                'message_id': message.id if message else False,
+                'trace_id': trace.trace_id,
+                'duration_ms': trace.duration_ms,
+                'spans': trace.spans,
+            })
+            if config.trace_export_path:
+                self._export(trace, config.trace_export_path)
+        except Exception as e:
+            _logger.warning(f"Chatbot trace {trace.trace_id} not recorded: {e}")
+
+    @api.model
+    def _export(self, trace, path):
+        """Append a trace to a file in the OpenTelemetry OTLP/JSON lines format."""
+        span_ids = [uuid.uuid4().hex[:16] for _span in trace.spans]
+        otel_spans = []
+        for index, (name, start_ms, duration_ms, parent, attributes) in enumerate(trace.spans):
+            start_ns = trace.start_ns + int(start_ms * 1e6)
+            otel_span = {
+                'traceId': trace.trace_id,
+                'spanId': span_ids[index],
+                'name': name,
+                'kind': 1,
+                'startTimeUnixNano': str(start_ns),
+                'endTimeUnixNano': str(start_ns + int((duration_ms or 0) * 1e6)),
+                'attributes': [
+                    {'key': key, 'value': {'stringValue': str(value)}}
+                    for key, value in attributes.items()
+                ],
+            }
+            if parent is not None:
+                otel_span['parentSpanId'] = span_ids[parent]
+            otel_spans.append(otel_span)
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': 'mcp_odoo'}},
+                {'key': 'db.name', 'value': {'stringValue': self.env.cr.dbname}},
+            ]},
+            'scopeSpans': [{'scope': {'name': 'mcp_odoo.chatbot'}, 'spans': otel_spans}],
+        }]})
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as export_file:
+            export_file.write(line + '\n')
+
+    @api.model
+    def get_latency_percentiles(self, days=1):
+        """
+        p50/p95/p99 latency of the requests of the last days, total and per phase.
+
+        Returns:
+            {'total': {'count', 'p50', 'p95', 'p99'}, 'phases': {name: {...}}} in milliseconds
+        """
+        self.flush_model()
+        since = fields.Datetime.now() - timedelta(days=days)
+        self.env.cr.execute("""
+            SELECT NULL, count(*),
+                   percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY duration_ms)
+              FROM chatbot_trace
+             WHERE create_date >= %s
+            UNION ALL
+            SELECT span->>0, count(*),
+                   percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY (span->>2)::float)
+              FROM chatbot_trace, jsonb_array_elements(spans) span
+             WHERE create_date >= %s AND span->>2 IS NOT NULL
+             GROUP BY span->>0
+        """, (since, since))
+        result = {'total': {'count': 0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0}, 'phases': {}}
+        for name, count, percentiles in self.env.cr.fetchall():
+            p50, p95, p99 = [round(value or 0.0, 1) for value in (percentiles or [0.0] * 3)]
+            values = {'count': count, 'p50': p50, 'p95': p95, 'p99': p99}
+            if name is None:
+                result['total'] = values
+            else:
+                result['phases'][name] = values
+        return result
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+from odoo import models, fields, api
+from odoo.modules.registry import Registry
+from odoo.tools import sql
+
+_logger = logging.getLogger(__name__)
+
+# Days recomputed from chatbot.message by the drift correction job
+COUNTER_REBUILD_DAYS = 2
+
+
+class ChatbotUsageCounter(models.Model):
+    """Materialized number of chatbot messages per day, configuration and user."""
+
+    _name = 'chatbot.usage.counter'
+    _description = 'Chatbot Daily Usage Counter'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    date = fields.Date(
+        string='Date',
+        required=True,
+        index=True,
+        help='UTC day of the messages'
+    )
+
+    config_id = fields.Many2one(
+        'chatbot.config',
+        string='Configuration',
+        required=True,
+        ondelete='cascade'
+    )
+
+    user_id = fields.Many2one(
+        'res.users',
+        string='User',
+        ondelete='cascade',
+        help='Empty on the row counting the messages of every user'
+    )
+
+    message_count = fields.Integer(
+        string='Messages',
+        default=0
+    )
+
+    def init(self):
+        # One row per day, configuration and user; user NULL holds the configuration total
+        sql.create_unique_index(
+            self.env.cr, 'chatbot_usage_counter_key_uniq', self._table,
+            ['date', 'config_id', 'COALESCE(user_id, 0)']
+        )
+
+    @api.model
+    def _get_count(self, config, user=None, date=None):
+        """
+        Number of messages of a day, read from a single counter row.
+
+        Args:
+            config: chatbot.config record
+            user: res.users record, None for the configuration total
+            date: UTC day, today when not given
+
+        Returns:
+            Message count
+        """
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT message_count FROM chatbot_usage_counter
+             WHERE date = %s AND config_id = %s AND COALESCE(user_id, 0) = %s
+        """, (date or fields.Datetime.now().date(), config.id, user.id if user else 0))
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def _increment(self, messages):
+        """
+        Count new messages once their transaction is committed.
+
+        Messages are accumulated per transaction and counted by a single
+        upsert in a short separate transaction after commit, so the counter
+        rows are never locked for the duration of an Anthropic call and a
+        rolled back message is never counted.
+        """
+        pending = self.env.cr.postcommit.data.get('chatbot.usage.counter')
+        if pending is None:
+            pending = self.env.cr.postcommit.data['chatbot.usage.counter'] = set()
+            dbname = self.env.cr.dbname
+            self.env.cr.postcommit.add(lambda: self._apply_increments(dbname, pending))
+        pending.update(messages.filtered('config_id').ids)
+
+    @api.model
+    def _apply_increments(self, dbname, message_ids):
+        """
+        Count messages in their own transaction, each of them exactly once.
+
+        The messages are flagged as counted in the transaction of the upsert:
+        a message the rebuild job counted in the meantime is skipped, so the
+        increment and the rebuild never count it twice.
+        """
+        if not message_ids:
+            return
+        try:
+            with Registry(dbname).cursor() as cr:
+                cr.execute("""
+                    WITH counted AS (
+                        UPDATE chatbot_message SET usage_counted = true
+                         WHERE id IN (
+                                SELECT id FROM chatbot_message
+                                 WHERE id = ANY(%s) AND NOT usage_counted
+                                   FOR UPDATE SKIP LOCKED
+                               )
+                        RETURNING create_date::date AS date, config_id, user_id
+                    )
+                    INSERT INTO chatbot_usage_counter (date, config_id, user_id, message_count)
+                    SELECT date, config_id, user_id, count(*)
+                      FROM counted
+                     GROUP BY GROUPING SETS ((date, config_id, user_id), (date, config_id))
+                     ORDER BY date, config_id, user_id
+                    ON CONFLICT (date, config_id, (COALESCE(user_id, 0))) DO UPDATE
+                       SET message_count = chatbot_usage_counter.message_count + EXCLUDED.message_count
+                """, (sorted(message_ids),))
+        except Exception as e:
+            # The rebuild job counts the messages left uncounted
+            _logger.warning(f"Chatbot usage counter update failed: {e}")
+
+    @api.model
+    def _cron_rebuild_counters(self, days=COUNTER_REBUILD_DAYS):
+        """
+        Recompute the counters of the last days from chatbot.message (drift correction).
+
+        The messages whose increment is still pending or was lost are
+        counted here and flagged, so that their increment skips them. The
+        messages an increment is counting at the same time are locked by
+        it: they are skipped here and counted by the increment once this
+        rebuild is committed.
+        """
+        self.env['chatbot.message'].flush_model()
+        since = fields.Datetime.now().date() - timedelta(days=days - 1)
+        # Serialize with the post-commit increments of the rebuilt days
+        self.env.cr.execute("LOCK TABLE chatbot_usage_counter IN SHARE ROW EXCLUSIVE MODE")
+        self.env.cr.execute("""
+            UPDATE chatbot_message SET usage_counted = true
+             WHERE id IN (
+                    SELECT id FROM chatbot_message
+                     WHERE create_date >= %s AND config_id IS NOT NULL AND NOT usage_counted
+                       FOR UPDATE SKIP LOCKED
+                   )
+        """, (since,))
+        self.env.cr.execute("DELETE FROM chatbot_usage_counter WHERE date >= %s", (since,))
+        self.env.cr.execute("""
+            INSERT INTO chatbot_usage_counter (date, config_id, user_id, message_count)
+            SELECT create_date::date, config_id, user_id, count(*)
+              FROM chatbot_message
+             WHERE create_date >= %s AND config_id IS NOT NULL AND usage_counted
+             GROUP BY GROUPING SETS ((create_date::date, config_id, user_id),
+                                     (create_date::date, config_id))
+        """, (since,))
+        count = self.env.cr.rowcount
+        self.invalidate_model()
+        self.env['chatbot.message'].invalidate_model(['usage_counted'])
+        _logger.info(f"Rebuilt {count} chatbot usage counters since {since}")
+        return True
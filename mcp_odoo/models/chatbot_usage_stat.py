@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import Counter
+from datetime import timedelta
+from odoo import models, fields, api
+from odoo.tools import sql
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the response time histogram buckets, the last one is open
+LATENCY_BUCKETS = (
+    (1, 'latency_lt_1'),
+    (3, 'latency_lt_3'),
+    (10, 'latency_lt_10'),
+    (30, 'latency_lt_30'),
+    (None, 'latency_ge_30'),
+)
+
+STAT_COLUMNS = (
+    'message_count', 'processed_count', 'error_count', 'session_count',
+    'response_time_sum', 'response_time_count',
+    *(column for _bound, column in LATENCY_BUCKETS),
+    'input_tokens', 'output_tokens', 'cost',
+)
+
+FLOAT_COLUMNS = ('response_time_sum', 'cost')
+
+# Hourly rows older than this are rolled up into one row per day
+HOURLY_RETENTION_DAYS = 35
+
+
+def _latency_column(response_time):
+    for bound, column in LATENCY_BUCKETS:
+        if bound is None or response_time < bound:
+            return column
+
+
+class ChatbotUsageStat(models.Model):
+    """
+    Usage statistics of the chatbot rolled up per hour, configuration and user.
+
+    Rows are maintained incrementally, in the transaction of the message
+    writes, from the difference between the old and new values of each
+    message; the dashboards read them with a single aggregate query instead
+    of scanning chatbot.message. Rows older than HOURLY_RETENTION_DAYS are
+    rolled up per day. Statistics outlive the messages deleted by retention.
+    """
+
+    _name = 'chatbot.usage.stat'
+    _description = 'Chatbot Usage Statistics'
+    _order = 'period_start desc, id desc'
+    _log_access = False
+
+    period_start = fields.Datetime(
+        string='Period',
+        required=True,
+        index=True,
+        help='Start of the hour (UTC) of the messages, or of the day once rolled up'
+    )
+
+    config_id = fields.Many2one(
+        'chatbot.config',
+        string='Configuration',
+        ondelete='set null'
+    )
+
+    user_id = fields.Many2one(
+        'res.users',
+        string='User',
+        required=True,
+        ondelete='cascade'
+    )
+
+    message_count = fields.Integer(string='Messages', default=0)
+    processed_count = fields.Integer(string='Processed', default=0)
+    error_count = fields.Integer(string='Errors', default=0)
+    session_count = fields.Integer(
+        string='Sessions',
+        default=0,
+        help='Conversations started in the period'
+    )
+
+    response_time_sum = fields.Float(string='Total Response Time (s)', default=0.0)
+    response_time_count = fields.Integer(string='Timed Responses', default=0)
+
+    latency_lt_1 = fields.Integer(string='< 1 s', default=0)
+    latency_lt_3 = fields.Integer(string='1-3 s', default=0)
+    latency_lt_10 = fields.Integer(string='3-10 s', default=0)
+    latency_lt_30 = fields.Integer(string='10-30 s', default=0)
+    latency_ge_30 = fields.Integer(string='>= 30 s', default=0)
+
+    input_tokens = fields.Integer(
+        string='Input Tokens',
+        default=0,
+        help='Including the tokens written to and read from the prompt cache'
+    )
+    output_tokens = fields.Integer(string='Output Tokens', default=0)
+    cost = fields.Float(string='Estimated Cost (USD)', digits=(16, 6), default=0.0)
+
+    def init(self):
+        # One row per period, configuration and user
+        sql.create_unique_index(
+            self.env.cr, 'chatbot_usage_stat_key_uniq', self._table,
+            ['period_start', 'COALESCE(config_id, 0)', 'user_id']
+        )
+        self._backfill()
+
+    def _backfill(self):
+        """Compute the statistics of the existing messages when the table is empty (install)."""
+        cr = self.env.cr
+        cr.execute("SELECT 1 FROM chatbot_usage_stat LIMIT 1")
+        if cr.fetchone():
+            return
+        cr.execute("""
+            WITH messages AS (
+                SELECT m.*, m.id = min(m.id) OVER (PARTITION BY m.user_id, m.session_id) AS first_of_session
+                  FROM chatbot_message m
+            )
+            INSERT INTO chatbot_usage_stat (period_start, config_id, user_id, message_count, processed_count,
+                                            error_count, session_count, response_time_sum, response_time_count,
+                                            latency_lt_1, latency_lt_3, latency_lt_10, latency_lt_30, latency_ge_30,
+                                            input_tokens, output_tokens, cost)
+            SELECT date_trunc('hour', create_date), config_id, user_id,
+                   count(*),
+                   count(*) FILTER (WHERE status = 'processed'),
+                   count(*) FILTER (WHERE status = 'error'),
+                   count(*) FILTER (WHERE first_of_session),
+                   COALESCE(sum(response_time) FILTER (WHERE status = 'processed' AND response_time > 0), 0),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time > 0),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time > 0 AND response_time < 1),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time >= 1 AND response_time < 3),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time >= 3 AND response_time < 10),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time >= 10 AND response_time < 30),
+                   count(*) FILTER (WHERE status = 'processed' AND response_time >= 30),
+                   COALESCE(sum(COALESCE(input_tokens, 0) + COALESCE(cache_write_tokens, 0)
+                                + COALESCE(cache_read_tokens, 0)), 0),
+                   COALESCE(sum(output_tokens), 0),
+                   COALESCE(sum(cost), 0)
+              FROM messages
+             WHERE create_date IS NOT NULL
+             GROUP BY 1, 2, 3
+        """)
+        if cr.rowcount:
+            _logger.info(f"Computed {cr.rowcount} chatbot usage statistic rows from the existing messages")
+
+    @api.model
+    def _get_values(self, message):
+        """
+        Contribution of a message to the statistics of its period.
+
+        Returns:
+            Tuple (key, Counter of column values)
+        """
+        values = Counter(message_count=1)
+        if message.status == 'error':
+            values['error_count'] = 1
+        elif message.status == 'processed':
+            values['processed_count'] = 1
+            if message.response_time > 0:
+                values['response_time_sum'] = message.response_time
+                values['response_time_count'] = 1
+                values[_latency_column(message.response_time)] = 1
+        values['input_tokens'] = message.input_tokens + message.cache_write_tokens + message.cache_read_tokens
+        values['output_tokens'] = message.output_tokens
+        values['cost'] = message.cost
+        period = message.create_date.replace(minute=0, second=0, microsecond=0)
+        return (period, message.config_id.id or None, message.user_id.id), values
+
+    @api.model
+    def _snapshot(self, messages):
+        """Contributions of messages, by message ID."""
+        return {message.id: self._get_values(message) for message in messages}
+
+    @api.model
+    def _record_create(self, messages):
+        """Add new messages to the statistics, counting the sessions they start."""
+        if not messages:
+            return
+        messages.flush_recordset(['user_id', 'session_id'])
+        self.env.cr.execute("""
+            SELECT min(id) FROM chatbot_message
+             WHERE session_id IN %s
+             GROUP BY user_id, session_id
+        """, (tuple(set(messages.mapped('session_id'))),))
+        first_ids = {row[0] for row in self.env.cr.fetchall()}
+        deltas = {}
+        for message in messages:
+            key, values = self._get_values(message)
+            if message.id in first_ids:
+                values['session_count'] = 1
+            deltas.setdefault(key, Counter()).update(values)
+        self._apply(deltas)
+
+    @api.model
+    def _record_write(self, before, messages):
+        """
+        Apply the changes of written messages to the statistics.
+
+        Args:
+            before: _snapshot of the messages taken before the write
+            messages: The written chatbot.message records
+        """
+        deltas = {}
+        for message_id, (key, values) in self._snapshot(messages).items():
+            old_key, old_values = before[message_id]
+            deltas.setdefault(key, Counter()).update(values)
+            deltas.setdefault(old_key, Counter()).subtract(old_values)
+        self._apply(deltas)
+
+    @api.model
+    def _apply(self, deltas):
+        """Upsert column deltas by (period, configuration, user) in a single statement."""
+        rows = [
+            (key, values) for key, values in sorted(deltas.items(), key=str)
+            if any(values[column] for column in STAT_COLUMNS)
+        ]
+        if not rows:
+            return
+        columns = ', '.join(STAT_COLUMNS)
+        arrays = ', '.join(
+            '%s::float8[]' if column in FLOAT_COLUMNS else '%s::int[]' for column in STAT_COLUMNS
+        )
+        updates = ', '.join(f'{column} = chatbot_usage_stat.{column} + EXCLUDED.{column}' for column in STAT_COLUMNS)
+        self.flush_model()
+        self.env.cr.execute(f"""
+            INSERT INTO chatbot_usage_stat (period_start, config_id, user_id, {columns})
+            SELECT * FROM unnest(%s::timestamp[], %s::int[], %s::int[], {arrays})
+            ON CONFLICT (period_start, (COALESCE(config_id, 0)), user_id) DO UPDATE SET {updates}
+        """, [
+            [key[0] for key, _values in rows],
+            [key[1] for key, _values in rows],
+            [key[2] for key, _values in rows],
+            *([values[column] for _key, values in rows] for column in STAT_COLUMNS),
+        ])
+        self.invalidate_model()
+
+    @api.model
+    def _query(self, since=None, user=None, group_by_user=False):
+        """
+        Sum the statistics in one query.
+
+        Args:
+            since: Only the periods starting from this datetime
+            user: Only this res.users record
+            group_by_user: Also return one row per user (grouping sets)
+
+        Returns:
+            List of dictionaries of column sums, with 'user_id' (None on the total row)
+        """
+        self.flush_model()
+        conditions, params = ['TRUE'], []
+        if since:
+            conditions.append('period_start >= %s')
+            params.append(since)
+        if user:
+            conditions.append('user_id = %s')
+            params.append(user.id)
+        sums = ', '.join(f'COALESCE(sum({column}), 0) AS {column}' for column in STAT_COLUMNS)
+        grouping = 'GROUP BY GROUPING SETS ((), (user_id))' if group_by_user else ''
+        user_column = 'user_id' if group_by_user else 'NULL::int AS user_id'
+        self.env.cr.execute(f"""
+            SELECT {user_column}, {sums}
+              FROM chatbot_usage_stat
+             WHERE {' AND '.join(conditions)}
+             {grouping}
+        """, params)
+        return self.env.cr.dictfetchall()
+
+    @api.model
+    def _format(self, row):
+        """Statistics dictionary of a summed row."""
+        total = row['message_count']
+        processed = row['processed_count']
+        timed = row['response_time_count']
+        return {
+            'total_messages': total,
+            'processed_messages': processed,
+            'error_messages': row['error_count'],
+            'avg_response_time': round(row['response_time_sum'] / timed, 2) if timed else 0,
+            'sessions_count': row['session_count'],
+            'success_rate': round((processed / total) * 100, 1) if total > 0 else 0,
+            'input_tokens': row['input_tokens'],
+            'output_tokens': row['output_tokens'],
+            'cost': round(row['cost'], 4),
+            'latency_histogram': [
+                {'lt': bound, 'count': row[column]} for bound, column in LATENCY_BUCKETS
+            ],
+        }
+
+    @api.model
+    def get_statistics(self, user=None, days=None):
+        """
+        Usage statistics of a user, or of every user.
+
+        Args:
+            user: res.users record, None for the whole organization
+            days: Only the last days, None for all time
+
+        Returns:
+            Statistics dictionary (see _format)
+        """
+        since = fields.Datetime.now() - timedelta(days=days) if days else None
+        rows = self._query(since=since, user=user)
+        return self._format(rows[0])
+
+    @api.model
+    def get_dashboard_statistics(self, days=30):
+        """
+        Organization-wide statistics and their breakdown per user, in one query.
+
+        Returns:
+            Dictionary with 'total' and 'users' (list, busiest first)
+        """
+        since = fields.Datetime.now() - timedelta(days=days) if days else None
+        total = None
+        users = []
+        for row in self._query(since=since, group_by_user=True):
+            if row['user_id'] is None:
+                total = self._format(row)
+            else:
+                users.append(dict(self._format(row), user_id=row['user_id']))
+        names = {user.id: user.name for user in self.env['res.users'].browse([u['user_id'] for u in users])}
+        for stats in users:
+            stats['user_name'] = names.get(stats['user_id'], '')
+        users.sort(key=lambda stats: stats['total_messages'], reverse=True)
+        return {'total': total, 'users': users}
+
+    @api.autovacuum
+    def _gc_roll_up_hourly_stats(self):
+        """Roll the old hourly rows up into one row per day."""
+        limit = fields.Datetime.now() - timedelta(days=HOURLY_RETENTION_DAYS)
+        columns = ', '.join(STAT_COLUMNS)
+        sums = ', '.join(f'sum({column})' for column in STAT_COLUMNS)
+        updates = ', '.join(f'{column} = chatbot_usage_stat.{column} + EXCLUDED.{column}' for column in STAT_COLUMNS)
+        self.flush_model()
+        self.env.cr.execute(f"""
+            WITH hourly AS (
+                DELETE FROM chatbot_usage_stat
+                 WHERE period_start < date_trunc('day', %s::timestamp)
+                   AND period_start <> date_trunc('day', period_start)
+             RETURNING *
+            )
+            INSERT INTO chatbot_usage_stat (period_start, config_id, user_id, {columns})
+            SELECT date_trunc('day', period_start), config_id, user_id, {sums}
+              FROM hourly
+             GROUP BY 1, 2, 3
+            ON CONFLICT (period_start, (COALESCE(config_id, 0)), user_id) DO UPDATE SET {updates}
+        """, (limit,))
+        count = self.env.cr.rowcount
+        self.invalidate_model()
+        if count:
+            _logger.info(f"Rolled up {count} days of chatbot usage statistics")
+        return True
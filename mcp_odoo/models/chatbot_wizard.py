@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-import time
 import uuid
 import re
 import logging
 from odoo import models, fields, api
 from odoo.exceptions import UserError
+from .chatbot_rate_limit import RateLimitError
+from .chatbot_trace import span
 
 _logger = logging.getLogger(__name__)
 
@@ -64,10 +65,8 @@ class ChatbotWizard(models.TransientModel):
     @api.depends('current_session_id')
     def _compute_conversation_history(self):
         """Compute conversation history for current user."""
+        history = self.env['chatbot.message'].get_conversation_history(limit=20)
         for wizard in self:
-            history = self.env['chatbot.message'].search([
-                ('user_id', '=', self.env.user.id)
-            ], limit=20, order='create_date desc')
             wizard.conversation_history = history
     
     @api.model
@@ -87,8 +86,6 @@ class ChatbotWizard(models.TransientModel):
         if not self.user_input:
             return self._return_wizard()
         
-        start_time = time.time()
-        
         # Save user message
         self.previous_user_message = self.user_input
         
@@ -97,8 +94,9 @@ class ChatbotWizard(models.TransientModel):
         if not config:
             raise UserError('No chatbot configuration found')
         
-        # Check daily limit
+        # Check daily limit and rate limit
         config.check_daily_limit()
+        wait = config.check_rate_limit()
         
         # Create message record
         message = self.env['chatbot.message'].create({
@@ -108,49 +106,19 @@ class ChatbotWizard(models.TransientModel):
             'status': 'sent'
         })
         
-        try:
-            # Call Anthropic service directly
-            service = self.env['anthropic.service']
-            result = service.create_chat_completion(
-                messages=[{
-                    'role': 'user',
-                    'content': self.previous_user_message
-                }],
-                model=config.model_name,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens
-            )
-            
-            response_time = time.time() - start_time
-            
-            if not result.get('success'):
-                raise UserError(result.get('message', 'Unknown error'))
-            
-            # Update message record
-            bot_response = result.get('message', '')
-            message.write({
-                'bot_response': bot_response,
-                'status': 'processed',
-                'response_time': response_time,
-                'usage_data': str(result.get('usage', {}))
-            })
-            
-            # Format and display response
-            self.bot_response = self._format_response(bot_response, response_time)
-            
-        except Exception as e:
-            error_msg = str(e)
-            _logger.error(f"Chatbot error: {error_msg}")
-            
-            # Update message with error
-            message.write({
-                'bot_response': error_msg,
-                'status': 'error',
-                'error_message': error_msg,
-                'response_time': time.time() - start_time
-            })
-            
-            self.bot_response = self._format_error(error_msg)
+        if config.processing_mode == 'queued' or wait:
+            # The background runner will answer; the history shows the result
+            message._enqueue(delay=wait)
+            self.bot_response = self._format_queued()
+        else:
+            with self.env['chatbot.trace']._trace(message):
+                message._generate_response()
+                with span('format'):
+                    if message.status == 'processed':
+                        # Format and display response
+                        self.bot_response = self._format_response(message.bot_response, message.response_time)
+                    else:
+                        self.bot_response = self._format_error(message.error_message)
         
         # Clear input
         self.user_input = ""
@@ -188,6 +156,15 @@ class ChatbotWizard(models.TransientModel):
         {footer}
         """
     
+    def _format_queued(self):
+        """Format the notice shown while a queued message is processed."""
+        return """
+        <div style="padding: 15px; background: #f8f9fa; border-radius: 8px; 
+                    border-left: 4px solid #6c757d;">
+            ⏳ Your message is being processed. The answer will appear in the history.
+        </div>
+        """
+    
     def _format_error(self, error):
         """Format error message."""
         return f"""
@@ -243,23 +220,26 @@ class ChatbotWizard(models.TransientModel):
         return self._return_wizard()
     
     @api.model
-    def process_message_api(self, user_message):
+    def process_message_api(self, user_message, bypass_cache=False, session_id=None):
         """API endpoint for processing messages (used by JavaScript)."""
         try:
             config = self.env['chatbot.config'].get_active_config()
             config.check_daily_limit()
+            wait = config.check_rate_limit()
+            
+            # The turn is recorded so that the next questions of the session get it as history
+            message = self.env['chatbot.message'].create({
+                'user_message': user_message,
+                'session_id': session_id or str(uuid.uuid4())[:12],
+                'config_id': config.id,
+                'status': 'sent'
+            })
+            if config.processing_mode == 'queued' or wait:
+                message._enqueue(delay=wait)
+                return {'error': False, 'queued': True, 'message_id': message.id}
             
-            # Call Anthropic service directly
-            service = self.env['anthropic.service']
-            result = service.create_chat_completion(
-                messages=[{
-                    'role': 'user',
-                    'content': user_message
-                }],
-                model=config.model_name,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens
-            )
+            # Call Anthropic service (served from the response cache when possible)
+            result = message._generate_response(bypass_cache=bypass_cache)
             
             if not result.get('success'):
                 return {'error': True, 'message': result.get('message')}
@@ -267,9 +247,14 @@ class ChatbotWizard(models.TransientModel):
             return {
                 'error': False,
                 'message': result.get('message', ''),
-                'usage': result.get('usage', {})
+                'usage': result.get('usage', {}),
+                'cost': message.cost,
+                'cached': result.get('cached', False),
+                'coalesced': result.get('coalesced', False)
             }
             
+        except RateLimitError as e:
+            return {'error': True, 'status': 429, 'retry_after': e.retry_after, 'message': str(e)}
         except Exception as e:
             _logger.error(f"API error: {str(e)}")
             return {'error': True, 'message': str(e)}
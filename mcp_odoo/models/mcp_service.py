@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import logging
 import json
-from datetime import timedelta
 from typing import Dict, Any, List, Optional
 from odoo import models, fields, api
 from odoo.exceptions import UserError
@@ -20,8 +19,16 @@ class MCPService(BaseService, models.Model):
     # Fields
     request_data = fields.Text('Request Data')
     response_data = fields.Text('Response Data')
+    request_body = fields.Binary('Request Body', attachment=False, help='Compressed structured request log')
+    response_body = fields.Binary('Response Body', attachment=False, help='Compressed structured response log')
     error_message = fields.Text('Error Message')
     success = fields.Boolean('Success', default=False)
+    model_name = fields.Char('Model', index=True)
+    input_tokens = fields.Integer('Input Tokens')
+    output_tokens = fields.Integer('Output Tokens')
+    cache_write_tokens = fields.Integer('Cache Write Tokens')
+    cache_read_tokens = fields.Integer('Cache Read Tokens')
+    cost = fields.Float('Estimated Cost (USD)', digits=(16, 6))
     
     @api.model
     def send_message_to_mcp(
@@ -43,7 +50,7 @@ class MCPService(BaseService, models.Model):
         Returns:
             API response dictionary
         """
-        config = self.env['chatbot.config'].sudo().search([], limit=1)
+        config = self.env['chatbot.config'].sudo().get_active_config()
         if not config:
             raise UserError('Chatbot configuration not found')
         
@@ -66,12 +73,7 @@ class MCPService(BaseService, models.Model):
             'api_key': config.api_key
         }
         
-        # Log request
-        service_record = self.create({
-            'request_data': json.dumps(payload, indent=2),
-            'success': False
-        })
-        
+        data = None
         try:
             # Make request to MCP server
             url = f"{config.mcp_server_url.rstrip('/')}/messages"
@@ -83,57 +85,39 @@ class MCPService(BaseService, models.Model):
                 url=url,
                 headers=headers,
                 data=payload,
-                timeout=60  # Increased timeout for MCP server
+                timeout=60,  # Increased timeout for MCP server
+                config=config
             )
             
-            if 'error' not in data:
-                
-                # Update service record
-                service_record.write({
-                    'response_data': json.dumps(data, indent=2),
-                    'success': True
-                })
-                
-                # Extract message content - handle different response formats
-                if 'message' in data:
-                    return {
-                        'success': True,
-                        'message': data['message'],
-                        'usage': data.get('usage', {})
-                    }
-                elif 'content' in data:
-                    # Handle Anthropic-style response
-                    return {
-                        'success': True,
-                        'message': data['content'],
-                        'usage': data.get('usage', {})
-                    }
-                elif 'choices' in data and len(data['choices']) > 0:
-                    # Handle OpenAI-style response
-                    return {
-                        'success': True,
-                        'message': data['choices'][0].get('message', {}).get('content', ''),
-                        'usage': data.get('usage', {})
-                    }
-                elif 'error' in data:
-                    raise UserError(f"MCP Server Error: {data['error']}")
-                else:
-                    # Log the unexpected response for debugging
-                    _logger.error(f"Unexpected MCP response format: {json.dumps(data)}")
-                    raise UserError('Unexpected response format from MCP server')
+            if 'error' in data:
+                raise UserError(data.get('error') or 'Unknown error from MCP server')
+            
+            # Extract message content - handle different response formats
+            if 'message' in data:
+                message = data['message']
+            elif 'content' in data:
+                # Handle Anthropic-style response
+                message = data['content']
+            elif 'choices' in data and len(data['choices']) > 0:
+                # Handle OpenAI-style response
+                message = data['choices'][0].get('message', {}).get('content', '')
             else:
-                error_msg = data.get('error', 'Unknown error from MCP server')
-                service_record.write({
-                    'error_message': error_msg,
-                    'success': False
-                })
-                raise UserError(error_msg)
+                # Log the unexpected response for debugging
+                _logger.error(f"Unexpected MCP response format: {json.dumps(data)}")
+                raise UserError('Unexpected response format from MCP server')
+            
+            # Log the exchange (secrets redacted)
+            usage_values = self.env['chatbot.model.price']._get_usage_values(model, data.get('usage'))
+            self._log_exchange(config, True, payload, data, **usage_values)
+            return {
+                'success': True,
+                'message': message,
+                'usage': data.get('usage', {}),
+                'cost': usage_values['cost']
+            }
         except Exception as e:
             error_msg = f'Unexpected error: {str(e)}'
-            service_record.write({
-                'error_message': error_msg,
-                'success': False
-            })
+            self._log_exchange(config, False, payload, data, error_message=error_msg)
             raise UserError(error_msg)
     
     def _build_system_prompt(self) -> str:
@@ -160,15 +144,3 @@ You have access to Odoo's business context and can help with:
 - Helping with Odoo usage
 
 Always provide helpful, accurate, and contextual responses."""
-    
-    
-    @api.autovacuum
-    def _gc_old_records(self):
-        """Clean up old service records (keep last 7 days)."""
-        days_to_keep = 7
-        domain = [
-            ('create_date', '<', fields.Datetime.now() - timedelta(days=days_to_keep))
-        ]
-        records = self.search(domain)
-        records.unlink()
-        _logger.info(f'Cleaned up {len(records)} old MCP service records')
\ No newline at end of file
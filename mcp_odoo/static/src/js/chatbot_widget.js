@@ -1,6 +1,6 @@
 /** @odoo-module **/
 
-import { Component, useState, onMounted } from "@odoo/owl";
+import { Component, useState, onMounted, onWillUnmount } from "@odoo/owl";
 import { Dialog } from "@web/core/dialog/dialog";
 import { _t } from "@web/core/l10n/translation";
 import { useService } from "@web/core/utils/hooks";
@@ -14,7 +14,13 @@ export class ChatbotWidget extends Component {
 
     setup() {
         this.rpc = useService("rpc");
+        this.busService = useService("bus_service");
+        this.streamingEnabled = true;
         this.notification = useService("notification");
+        // Queued messages waiting for their answer: message ID => resolve
+        this.pendingReplies = new Map();
+        this._onMessageNotification = (payload) => this._applyMessageUpdate(payload);
+        this._onBusReconnect = () => this.loadConversationHistory();
         
         this.state = useState({
             messages: [],
@@ -22,14 +28,26 @@ export class ChatbotWidget extends Component {
             isLoading: false,
             showHistory: false,
             conversationHistory: [],
+            historyLatest: false,
+            historyLoaded: false,
             currentSessionId: null
         });
 
         onMounted(() => {
             this.initializeChat();
+            // History updates are pushed by the server on the user's bus channel
+            this.busService.subscribe("mcp_odoo/message", this._onMessageNotification);
+            this.busService.addEventListener("reconnect", this._onBusReconnect);
+            this.busService.start();
             this.loadConversationHistory();
             this.hideDefaultButtons();
         });
+
+        onWillUnmount(() => {
+            this.busService.unsubscribe("mcp_odoo/message", this._onMessageNotification);
+            this.busService.removeEventListener("reconnect", this._onBusReconnect);
+            this.pendingReplies.clear();
+        });
     }
 
     /**
@@ -65,24 +83,59 @@ export class ChatbotWidget extends Component {
     }
 
     /**
-     * Load conversation history
+     * Load conversation history: the first page, then (after a bus
+     * reconnection) only the messages added since the latest one loaded
      */
     async loadConversationHistory() {
         try {
-            const history = await this.rpc("/web/dataset/call_kw", {
+            const page = await this.rpc("/web/dataset/call_kw", {
                 model: "chatbot.message",
-                method: "get_conversation_history",
+                method: "get_history_page",
                 args: [],
-                kwargs: { limit: 20 }
+                kwargs: { limit: 20, after: this.state.historyLatest }
             });
             
-            this.state.conversationHistory = history || [];
+            if (!this.state.historyLatest) {
+                this.state.conversationHistory = page.messages;
+                this.state.historyLatest = page.latest;
+                this.state.historyLoaded = true;
+                return;
+            }
+            const known = new Set(this.state.conversationHistory.map((msg) => msg.id));
+            this.state.conversationHistory.unshift(...page.messages.filter((msg) => !known.has(msg.id)));
+            this.state.historyLatest = page.latest || this.state.historyLatest;
+            if (page.has_more) {
+                // More new messages than one page: keep catching up
+                await this.loadConversationHistory();
+            }
             
         } catch (error) {
             console.error("Error loading history:", error);
         }
     }
 
+    /**
+     * Apply a message pushed on the bus: a new message carries every
+     * history field, an update only the fields that changed
+     */
+    _applyMessageUpdate(update) {
+        const history = this.state.conversationHistory;
+        let message = history.find((msg) => msg.id === update.id);
+        if (message) {
+            Object.assign(message, update);
+        } else if (update.create_date && this.state.historyLoaded) {
+            history.unshift(update);
+            // Cursor (create_date, id) of the newest message, for the catch-up after a reconnection
+            this.state.historyLatest = update.cursor || this.state.historyLatest;
+            message = history[0];
+        }
+        const resolve = this.pendingReplies.get(update.id);
+        if (resolve && update.status && update.status !== "sent") {
+            this.pendingReplies.delete(update.id);
+            resolve(message || update);
+        }
+    }
+
     /**
      * Send message
      */
@@ -106,15 +159,24 @@ export class ChatbotWidget extends Component {
         this._addTypingIndicator();
 
         try {
+            if (this.streamingEnabled && await this._streamMessage(userMessage)) {
+                return;
+            }
+
             // Call chatbot service
             const startTime = Date.now();
             const response = await this.rpc("/web/dataset/call_kw", {
                 model: "chatbot.wizard",
                 method: "process_message_api",
                 args: [userMessage],
-                kwargs: {}
+                kwargs: { session_id: this.state.currentSessionId }
             });
 
+            if (response.queued) {
+                await this._deliverQueuedMessage(response.message_id, startTime);
+                return;
+            }
+
             const responseTime = (Date.now() - startTime) / 1000;
 
             // Remove typing indicator
@@ -132,9 +194,6 @@ export class ChatbotWidget extends Component {
                 responseTime: responseTime
             });
 
-            // Update history
-            await this.loadConversationHistory();
-
         } catch (error) {
             console.error("Message error:", error);
             this._removeTypingIndicator();
@@ -157,6 +216,156 @@ export class ChatbotWidget extends Component {
         }
     }
 
+    /**
+     * Stream the bot response token by token through the SSE route.
+     * Returns false when streaming is unavailable so the caller can fall
+     * back to the RPC path; errors raised after the first event propagate.
+     */
+    async _streamMessage(userMessage) {
+        const startTime = Date.now();
+        const body = new URLSearchParams({
+            user_input: userMessage,
+            session_id: this.state.currentSessionId || "",
+            csrf_token: odoo.csrf_token,
+        });
+        let response;
+        try {
+            response = await fetch("/api/chatbot/stream_message", { method: "POST", body });
+        } catch {
+            return false;
+        }
+        if (response.status === 202) {
+            // Queued mode: the answer is produced in the background
+            const data = await response.json();
+            await this._deliverQueuedMessage(data.message_id, startTime);
+            return true;
+        }
+        if (!response.ok || !response.body) {
+            if (response.status === 400 || response.status === 429) {
+                const data = await response.json();
+                throw new Error(data.error || "Unknown error");
+            }
+            return false;
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let text = "";
+        let botMessage = null;
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split("\n\n");
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                const event = this._parseSseFrame(frame);
+                if (!event) {
+                    continue;
+                }
+                if (event.type === "delta") {
+                    if (!botMessage) {
+                        this._removeTypingIndicator();
+                        this._addMessage({ type: "bot", content: "", timestamp: new Date() });
+                        botMessage = this.state.messages[this.state.messages.length - 1];
+                    }
+                    text += event.data.text;
+                    botMessage.content = this._formatResponse(text);
+                    this._scrollToBottom();
+                } else if (event.type === "done") {
+                    this._removeTypingIndicator();
+                    if (!botMessage) {
+                        this._addMessage({ type: "bot", content: "", timestamp: new Date() });
+                        botMessage = this.state.messages[this.state.messages.length - 1];
+                    }
+                    botMessage.content = this._formatResponse(text || "No response received.");
+                    botMessage.responseTime = (Date.now() - startTime) / 1000;
+                } else if (event.type === "error") {
+                    this._removeTypingIndicator();
+                    throw new Error(event.data.message || "Unknown error");
+                }
+            }
+        }
+        return true;
+    }
+
+    /**
+     * Wait for the answer of a queued message, pushed on the bus, and display it
+     */
+    async _deliverQueuedMessage(messageId, startTime) {
+        const message = await this._waitForReply(messageId);
+        if (!message) {
+            throw new Error("Message not found");
+        }
+        this._removeTypingIndicator();
+        if (message.status === "error") {
+            throw new Error(message.error_message || "Unknown error");
+        }
+        this._addMessage({
+            type: 'bot',
+            content: this._formatResponse(message.bot_response || "No response received."),
+            timestamp: new Date(),
+            responseTime: (Date.now() - startTime) / 1000
+        });
+    }
+
+    /**
+     * Resolve with the message once answered. The answer normally arrives
+     * on the bus; its status is also checked every 30 seconds in case the
+     * bus connection was lost meanwhile.
+     */
+    _waitForReply(messageId) {
+        const known = this.state.conversationHistory.find((msg) => msg.id === messageId);
+        if (known && known.status !== "sent") {
+            return Promise.resolve(known);
+        }
+        return new Promise((resolve) => {
+            this.pendingReplies.set(messageId, resolve);
+            const check = async () => {
+                if (!this.pendingReplies.has(messageId)) {
+                    return;
+                }
+                try {
+                    const result = await this.rpc("/api/chatbot/poll", { message_ids: [messageId] });
+                    const message = (result.messages || [])[0];
+                    if (!message || message.status !== "sent") {
+                        this.pendingReplies.delete(messageId);
+                        resolve(message);
+                        return;
+                    }
+                } catch (error) {
+                    console.error("Error checking message status:", error);
+                }
+                setTimeout(check, 30000);
+            };
+            setTimeout(check, 30000);
+        });
+    }
+
+    /**
+     * Parse one server-sent events frame into { type, data }
+     */
+    _parseSseFrame(frame) {
+        let type = "message";
+        const dataLines = [];
+        for (const line of frame.split("\n")) {
+            if (line.startsWith("event:")) {
+                type = line.slice(6).trim();
+            } else if (line.startsWith("data:")) {
+                dataLines.push(line.slice(5).trim());
+            }
+        }
+        if (!dataLines.length) {
+            return null;
+        }
+        return { type, data: JSON.parse(dataLines.join("\n")) };
+    }
+
     /**
      * Format response with markdown support
      */
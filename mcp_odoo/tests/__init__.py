@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from . import test_response_cache
+from . import test_tool_cache
+from . import test_queue
+from . import test_agent_loop
+from . import test_http_retry
+from . import test_retention
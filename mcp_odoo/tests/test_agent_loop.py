@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.mcp_odoo.models.anthropic_service import TURN_SEPARATOR
+
+TOOL_TURN = {
+    'content': [
+        {'type': 'text', 'text': 'Let me look that up.'},
+        {'type': 'tool_use', 'id': 'toolu_1', 'name': 'search_odoo_records', 'input': {'model': 'res.partner'}},
+    ],
+    'stop_reason': 'tool_use',
+    'usage': {'input_tokens': 100, 'output_tokens': 20},
+}
+FINAL_TURN = {
+    'content': [{'type': 'text', 'text': 'You have 3 partners.'}],
+    'stop_reason': 'end_turn',
+    'usage': {'input_tokens': 150, 'output_tokens': 10},
+}
+
+
+@tagged('post_install', '-at_install')
+class TestAgentLoop(TransactionCase):
+    """The answer of the agent loop holds the text of every turn, streamed or not."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.env['chatbot.config'].create({'name': 'Agent Loop Test', 'max_agent_turns': 5})
+        cls.service = cls.env['anthropic.service']
+        cls.Service = type(cls.service)
+
+    def setUp(self):
+        super().setUp()
+        for name, value in [
+            ('_prepare_completion_request', (self.config, {}, 'System prompt', [])),
+            ('_run_tool_calls', [{'type': 'tool_result', 'tool_use_id': 'toolu_1', 'content': '[]'}]),
+        ]:
+            patcher = patch.object(self.Service, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_text_of_every_turn_kept(self):
+        with patch.object(self.Service, '_post_hop', side_effect=[TOOL_TURN, FINAL_TURN]):
+            result = self.service.create_chat_completion(
+                [{'role': 'user', 'content': 'How many partners?'}], model=self.config.model_name
+            )
+        self.assertTrue(result['success'])
+        self.assertEqual(result['turns'], 2)
+        self.assertEqual(result['message'], f'Let me look that up.{TURN_SEPARATOR}You have 3 partners.')
+        self.assertEqual(result['usage'], {'input_tokens': 250, 'output_tokens': 30})
+
+    def test_streamed_text_matches_answer(self):
+        turns = iter([TOOL_TURN, FINAL_TURN])
+
+        def stream_hop(payload, headers, config, separator=''):
+            data = next(turns)
+            for block in data['content']:
+                if block['type'] == 'text':
+                    yield {'type': 'text', 'text': separator + block['text']}
+                    separator = ''
+            return data
+
+        with patch.object(self.Service, '_stream_hop', side_effect=stream_hop):
+            events = list(self.service.stream_chat_completion(
+                [{'role': 'user', 'content': 'How many partners?'}], model=self.config.model_name
+            ))
+        streamed = ''.join(event['text'] for event in events if event['type'] == 'text')
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertEqual(events[-1]['message'], streamed)
+        self.assertEqual(streamed, f'Let me look that up.{TURN_SEPARATOR}You have 3 partners.')
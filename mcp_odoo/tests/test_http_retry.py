@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock, patch
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.mcp_odoo.models import base_service
+
+
+@tagged('post_install', '-at_install')
+class TestHttpRetry(TransactionCase):
+    """Retry policy of the pooled HTTP requests: a POST is never sent twice."""
+
+    def _request(self, method, errors):
+        session = MagicMock()
+        session.request.side_effect = errors
+        with patch.object(base_service, '_get_pooled_session', return_value=session):
+            response = base_service.pooled_request(method, 'http://upstream.test/v1/messages', max_retries=1)
+        return response, session.request.call_count
+
+    def _reset_error(self):
+        # Connection cut while the request was sent or answered
+        return requests.exceptions.ConnectionError(ProtocolError('Connection aborted.', ConnectionResetError()))
+
+    def _connect_error(self):
+        # Connection refused: the request never left
+        reason = NewConnectionError(None, 'Failed to establish a new connection: [Errno 111] Connection refused')
+        return requests.exceptions.ConnectionError(MaxRetryError(None, '/v1/messages', reason=reason))
+
+    def test_post_not_retried_after_reset(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._request('POST', [self._reset_error(), 'retried'])
+
+    def test_post_retried_when_never_sent(self):
+        self.assertEqual(self._request('POST', [self._connect_error(), 'response']), ('response', 2))
+
+    def test_idempotent_retried_after_reset(self):
+        self.assertEqual(self._request('GET', [self._reset_error(), 'response']), ('response', 2))
+
+    def test_retries_bounded(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self._request('GET', [self._reset_error(), self._reset_error(), 'response'])
+
+    def test_timeout_never_retried(self):
+        with self.assertRaises(requests.exceptions.Timeout):
+            self._request('GET', [requests.exceptions.ReadTimeout(), 'response'])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+from odoo.tools import mute_logger
+
+from odoo.addons.mcp_odoo.models.chatbot_message import MAX_QUEUE_ATTEMPTS
+
+
+@tagged('post_install', '-at_install')
+class TestQueue(TransactionCase):
+    """Claim, failure handling and retries of the queued messages."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.env['chatbot.config'].create({
+            'name': 'Queue Test',
+            'processing_mode': 'queued',
+            'rate_limit_enabled': False,
+            'response_cache_enabled': False,
+        })
+        cls.Message = type(cls.env['chatbot.message'])
+
+    def _queue(self, text='Queued question'):
+        message = self.env['chatbot.message'].create({
+            'user_message': text,
+            'session_id': 'queue-test',
+            'config_id': self.config.id,
+        })
+        message._enqueue()
+        return message
+
+    def _run_worker(self):
+        # The runner reads the queue through its own cursor
+        self.env.flush_all()
+        processed = self.env['chatbot.message']._run_queue_worker(self.env.cr.dbname, time.monotonic() + 10)
+        self.env.invalidate_all()
+        return processed
+
+    def _answer(self, message, bypass_cache=False):
+        if message.user_message == 'Poison':
+            raise RuntimeError('boom')
+        message.write({'bot_response': 'ok', 'status': 'processed', 'queued': False})
+        return {'success': True, 'message': 'ok'}
+
+    def test_claim_and_process(self):
+        message = self._queue()
+        with patch.object(self.Message, '_generate_response', autospec=True, side_effect=self._answer):
+            self.assertEqual(self._run_worker(), 1)
+        self.assertEqual(message.status, 'processed')
+        self.assertFalse(message.queued)
+
+    @mute_logger('odoo.addons.mcp_odoo.models.chatbot_message')
+    def test_failing_message_does_not_block_queue(self):
+        poison = self._queue('Poison')
+        message = self._queue()
+        with patch.object(self.Message, '_generate_response', autospec=True, side_effect=self._answer):
+            self.assertEqual(self._run_worker(), 1)
+        self.assertEqual(message.status, 'processed')
+        # Retried later rather than claimed again by the same run
+        self.assertEqual(poison.queue_attempts, 1)
+        self.assertEqual(poison.status, 'sent')
+        self.assertTrue(poison.queued)
+        self.assertGreater(poison.retry_at, fields.Datetime.now())
+
+    @mute_logger('odoo.addons.mcp_odoo.models.chatbot_message')
+    def test_poison_message_set_in_error(self):
+        poison = self._queue('Poison')
+        with patch.object(self.Message, '_generate_response', autospec=True, side_effect=self._answer):
+            for attempt in range(1, MAX_QUEUE_ATTEMPTS + 1):
+                poison.retry_at = fields.Datetime.now() - timedelta(hours=1)
+                self.assertEqual(self._run_worker(), 0)
+                self.assertEqual(poison.queue_attempts, attempt)
+        self.assertEqual(poison.status, 'error')
+        self.assertFalse(poison.queued)
+        self.assertIn('boom', poison.error_message)
+        self.assertEqual(self._run_worker(), 0)
+
+    @mute_logger('odoo.addons.mcp_odoo.models.chatbot_message', 'odoo.sql_db')
+    def test_error_stored_after_failed_query(self):
+        message = self._queue()
+
+        def call_api(service, *args, **kwargs):
+            service.env.cr.execute('SELECT 1 / 0')
+
+        service = type(self.env['anthropic.service'])
+        with patch.object(service, 'call_api', autospec=True, side_effect=call_api):
+            result = message._generate_response()
+        self.assertFalse(result['success'])
+        self.assertEqual(message.status, 'error')
+        self.assertIn('division by zero', message.error_message)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestResponseCache(TransactionCase):
+    """Read-time invalidation of the cached answers (chatbot.cache.validity)."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.env['chatbot.config'].create({
+            'name': 'Response Cache Test',
+            'response_cache_enabled': True,
+            'response_cache_ttl': 3600,
+        })
+        cls.cache = cls.env['chatbot.response.cache']
+
+    def _store(self, question, tool_models=None):
+        return self.cache._store(question, self.config, {
+            'success': True,
+            'message': f'Answer to {question}',
+            'tool_models': tool_models or [],
+        })
+
+    def test_hit_while_related_model_unchanged(self):
+        entry = self._store('How many partners?', ['res.partner'])
+        self.assertEqual(self.cache._lookup('How many partners?', self.config), entry)
+        self.assertEqual(self.cache._lookup('how many partners', self.config), entry)
+
+    def test_miss_after_related_model_changed(self):
+        entry = self._store('How many partners?', ['res.partner'])
+        self.env['res.partner'].create({'name': 'Cache Invalidation Partner'})
+        self.assertFalse(self.cache._lookup('How many partners?', self.config))
+        # The entry is left in place: the writing transaction never touches the cache
+        self.assertTrue(entry.exists())
+
+    def test_unrelated_change_keeps_entry(self):
+        entry = self._store('How many partners?', ['res.partner'])
+        self.env['res.country.group'].create({'name': 'Cache Test Group'})
+        self.assertEqual(self.cache._lookup('How many partners?', self.config), entry)
+
+    def test_entry_without_models_stays_valid(self):
+        entry = self._store('What is a quotation?')
+        self.env['res.partner'].create({'name': 'Cache Invalidation Partner'})
+        self.assertEqual(self.cache._lookup('What is a quotation?', self.config), entry)
+
+    def test_stamps_follow_changes(self):
+        validity = self.env['chatbot.cache.validity']
+        stamps = validity._dump(['res.partner', 'chatbot.cache.validity'])
+        # Abstract models have no table and are not stamped
+        self.assertEqual(list(validity._get_stamps(['res.partner', 'chatbot.cache.validity'])), ['res.partner'])
+        self.assertTrue(validity._is_valid(stamps))
+        self.env['res.partner'].create({'name': 'Cache Invalidation Partner'})
+        self.assertFalse(validity._is_valid(stamps))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestRetention(TransactionCase):
+    """Each configuration's retention applies to its own records only."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Config = cls.env['chatbot.config']
+        cls.short = Config.create({'name': 'Short Retention', 'retention_message_days': 10})
+        cls.forever = Config.create({'name': 'Keep Forever', 'retention_message_days': 0, 'active': False})
+        cls.Retention = type(cls.env['chatbot.retention'])
+
+    def _message(self, config, age_days):
+        message = self.env['chatbot.message'].create({
+            'user_message': f'Question {age_days} days ago',
+            'session_id': 'retention-test',
+            'config_id': config.id if config else False,
+        })
+        message.flush_recordset()
+        self.env.cr.execute(
+            "UPDATE chatbot_message SET create_date = %s WHERE id = %s",
+            (fields.Datetime.now() - timedelta(days=age_days), message.id)
+        )
+        return message
+
+    def test_policy_scoped_to_configuration(self):
+        old_short = self._message(self.short, 30)
+        recent_short = self._message(self.short, 1)
+        old_forever = self._message(self.forever, 30)
+        old_orphan = self._message(None, 30)
+        self.env['chatbot.retention']._gc_expired_records()
+        self.assertFalse(old_short.exists())
+        self.assertTrue(recent_short.exists())
+        # The archived configuration keeps its messages forever
+        self.assertTrue(old_forever.exists())
+        # Messages of no configuration follow the longest retention (forever here)
+        self.assertTrue(old_orphan.exists())
+        self.assertTrue(self.forever.last_retention_date)
+
+    def test_autovacuum_commits_per_batch(self):
+        self._message(self.short, 30)
+        with patch.object(self.Retention, '_commit') as commit:
+            self.env['chatbot.retention']._gc_expired_records()
+        self.assertTrue(commit.called)
+
+    def test_cleanup_keeps_caller_transaction(self):
+        message = self._message(self.short, 30)
+        with patch.object(self.Retention, '_commit') as commit:
+            self.assertGreaterEqual(self.env['chatbot.message'].cleanup_old_messages(days=20), 1)
+        commit.assert_not_called()
+        self.assertFalse(message.exists())
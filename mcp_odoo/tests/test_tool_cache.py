@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+from odoo.addons.mcp_odoo.models.chatbot_tool_cache import _MEMORY_CACHE
+
+
+@tagged('post_install', '-at_install')
+class TestToolCache(TransactionCase):
+    """Tool results served from the worker memory or the database only while their model is unchanged."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = cls.env['chatbot.config'].create({
+            'name': 'Tool Cache Test',
+            'tool_cache_enabled': True,
+            'tool_cache_ttl': 300,
+            'tool_cache_max_entries': 100,
+            'tool_cache_db': True,
+        })
+        cls.cache = cls.env['chatbot.tool.cache']
+
+    def setUp(self):
+        super().setUp()
+        _MEMORY_CACHE.clear(self.env.cr.dbname)
+        self.addCleanup(_MEMORY_CACHE.clear, self.env.cr.dbname)
+
+    def _key(self, payload, config=None):
+        return self.cache._make_key('user:1', 'orm', payload, config or self.config)
+
+    def test_memory_entry_invalidated_by_change(self):
+        key = self._key({'model': 'res.partner', 'domain': []})
+        self.cache._set(key, 'res.partner', [{'id': 1}], self.config)
+        self.assertEqual(self.cache._get(key, self.config), [{'id': 1}])
+        # The stamps are shared by every worker: a write made anywhere is seen here
+        self.env['res.partner'].create({'name': 'Tool Cache Partner'})
+        self.assertIsNone(self.cache._get(key, self.config))
+
+    def test_database_entry_served_to_other_workers(self):
+        key = self._key({'model': 'res.partner', 'domain': []})
+        self.cache._set(key, 'res.partner', [{'id': 1}], self.config)
+        # Another worker: nothing in its memory
+        _MEMORY_CACHE.clear(self.env.cr.dbname)
+        self.assertEqual(self.cache._get(key, self.config), [{'id': 1}])
+        _MEMORY_CACHE.clear(self.env.cr.dbname)
+        self.env['res.partner'].create({'name': 'Tool Cache Partner'})
+        self.assertIsNone(self.cache._get(key, self.config))
+
+    def test_key_depends_on_configuration(self):
+        other = self.env['chatbot.config'].create({'name': 'Other Tool Cache Test', 'tool_cache_db': True})
+        payload = {'model': 'res.partner', 'domain': []}
+        self.assertNotEqual(self._key(payload), self._key(payload, other))
+        self.cache._set(self._key(payload), 'res.partner', [{'id': 1}], self.config)
+        self.assertIsNone(self.cache._get(self._key(payload, other), other))